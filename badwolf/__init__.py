@@ -24,12 +24,14 @@ def register_blueprints(app):
     import badwolf.log.views
     import badwolf.security
     import badwolf.artifacts
+    import badwolf.stats
 
     register(badwolf.webhook.views.blueprint)
     register(badwolf.oauth.views.blueprint)
     register(badwolf.log.views.blueprint)
     register(badwolf.security.blueprint)
     register(badwolf.artifacts.blueprint)
+    register(badwolf.stats.blueprint)
 
 
 def register_error_handlers(app):
@@ -37,8 +39,12 @@ def register_error_handlers(app):
 
 
 def register_extensions(app):
-    from .extensions import sentry, mail, bitbucket
+    from .extensions import sentry, mail, bitbucket, docker, queue, statuses, services
 
     sentry.init_app(app)
     mail.init_app(app)
     bitbucket.init_app(app)
+    docker.init_app(app)
+    queue.init_app(app)
+    statuses.init_app(app)
+    services.init_app(app)
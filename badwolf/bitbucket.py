@@ -1,15 +1,70 @@
 # -*- coding: utf-8 -*-
+import copy
+import time
+import random
 import logging
-from urllib.parse import quote
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlparse
 
 import git
 import requests
 from requests.auth import HTTPBasicAuth
 from optionaldict import optionaldict
 
+from badwolf.diff import iter_lines, parse_diff
+from badwolf.ratelimit import parse_retry_after
+
 
 logger = logging.getLogger(__name__)
 
+# Methods safe to retry after connection errors and server errors
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUS_CODES = frozenset([500, 502, 503, 504])
+
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def _incr_stat(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def get_stats():
+    """Counters of Bitbucket API calls made by this process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def fetch_all_pages(fetch_page, size=50, max_workers=4):
+    """Values of all pages of a paginated API, ``fetch_page(page, size)`` fetches one page
+
+    Pages after the first one are fetched concurrently when total size is known,
+    otherwise next pages are followed one by one.
+    """
+    res = fetch_page(1, size)
+    rs = list(res['values'])
+    if not res.get('next'):
+        return rs
+
+    total = res.get('size')
+    if total is None:
+        while res.get('next'):
+            res = fetch_page(res['page'] + 1, size)
+            rs.extend(res['values'])
+        return rs
+
+    pagelen = res.get('pagelen') or size
+    pages = range(res['page'] + 1, -(-total // pagelen) + 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for page in executor.map(lambda page: fetch_page(page, pagelen), pages):
+            rs.extend(page['values'])
+    return rs
+
 
 class BitbucketAPIError(requests.RequestException):
     """Bitbucket API call error"""
@@ -34,6 +89,124 @@ class BitbucketAPIError(requests.RequestException):
         )
 
 
+class CircuitOpenError(BitbucketAPIError):
+    """Bitbucket API call short-circuited because the API keeps failing"""
+
+
+class CircuitBreaker(object):
+    """Stop calling a host for ``reset_timeout`` seconds after ``failure_threshold``
+    consecutive failures, then let one call through to probe whether it recovered"""
+    def __init__(self, host, failure_threshold=5, reset_timeout=30):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<CircuitBreaker {} {}>'.format(self.host, 'open' if self.is_open else 'closed')
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Half open, other calls are still short-circuited until the probe finishes
+            self._opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info('Bitbucket API %s recovered, circuit closed', self.host)
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures < self.failure_threshold:
+                return
+            if self._opened_at is None:
+                logger.warning('Bitbucket API %s failed %d times in a row, circuit opened', self.host, self._failures)
+                _incr_stat('circuit_opened')
+            self._opened_at = time.monotonic()
+
+
+def get_circuit_breaker(host, failure_threshold=5, reset_timeout=30):
+    """Process wide circuit breaker of ``host``"""
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(host)
+        if breaker is None:
+            breaker = _circuit_breakers[host] = CircuitBreaker(host, failure_threshold, reset_timeout)
+        breaker.failure_threshold = failure_threshold
+        breaker.reset_timeout = reset_timeout
+        return breaker
+
+
+class _CachedResponse(object):
+    def __init__(self, data, etag=None, last_modified=None, expires=0):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+
+class ResponseCache(object):
+    """Least recently used cache of Bitbucket API GET responses
+
+    Responses are revalidated with conditional requests by their ``ETag`` and
+    ``Last-Modified`` headers, or served without request until they expire when
+    fetched with a ``ttl``.
+    """
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<ResponseCache {}/{}>'.format(len(self._entries), self.max_size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(url, params=None):
+        if not params:
+            return url
+        return '{}?{}'.format(url, sorted((str(k), str(v)) for k, v in dict(params).items()))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, url):
+        """Drop cached responses of ``url`` and its sub resources"""
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(url)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class APIDispatcher(object):
     def __init__(self):
         self._session = requests.Session()
@@ -44,6 +217,11 @@ class APIDispatcher(object):
     def clone_repository(self, full_name, path):
         raise NotImplementedError()
 
+    @property
+    def account(self):
+        """Identity of the account API requests are made as, used for rate limiting"""
+        raise NotImplementedError()
+
     @property
     def session(self):
         return self._session
@@ -55,6 +233,10 @@ class BasicAuthDispatcher(APIDispatcher):
         self._username = username
         self._password = password
 
+    @property
+    def account(self):
+        return self._username
+
     def dispatch(self, method, url, **kwargs):
         kwargs['auth'] = HTTPBasicAuth(self._username, self._password)
         return self._session.request(
@@ -83,6 +265,10 @@ class OAuth2Dispatcher(APIDispatcher):
         self._access_token = None
         self._refresh_token = None
 
+    @property
+    def account(self):
+        return self._oauth_key
+
     def get_authorization_url(self, grant_type='code'):
         return 'https://bitbucket.org/site/oauth2/authorize?client_id={key}&response_type={type_}'.format(
             key=self._oauth_key,
@@ -143,9 +329,8 @@ class OAuth2Dispatcher(APIDispatcher):
         return data
 
     def dispatch(self, method, url, **kwargs):
-        headers = {
-            'Authorization': 'Bearer {}'.format(self._access_token),
-        }
+        headers = dict(kwargs.get('headers') or {})
+        headers['Authorization'] = 'Bearer {}'.format(self._access_token)
         kwargs['headers'] = headers
         return self._session.request(method, url, **kwargs)
 
@@ -161,42 +346,180 @@ class OAuth2Dispatcher(APIDispatcher):
 
 
 class Bitbucket(object):
-    def __init__(self, dispatcher):
+    """Bitbucket API client
+
+    :param timeout: seconds to wait for Bitbucket to respond
+    :param max_retries: times to retry idempotent requests failed with connection errors
+                        or server errors
+    :param throttle_retries: times to retry requests throttled with HTTP 429 after ``Retry-After``,
+                             throttled requests are rejected unprocessed so they are retried
+                             regardless of method. This is the only place throttling is retried
+    :param backoff_factor: base seconds of jittered exponential backoff between retries
+    :param failure_threshold: consecutive failures before short-circuiting calls, 0 to disable
+    :param reset_timeout: seconds to short-circuit calls before trying again
+    :param cache_size: number of GET responses cached for conditional requests, 0 to disable
+    """
+    def __init__(self, dispatcher, timeout=None, max_retries=0, backoff_factor=0.5,
+                 failure_threshold=0, reset_timeout=30, cache_size=0, throttle_retries=0):
         self._dispatcher = dispatcher
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.throttle_retries = throttle_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = 60
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.cache = ResponseCache(cache_size) if cache_size > 0 else None
+
+    @property
+    def account(self):
+        return self._dispatcher.account
+
+    @property
+    def stats(self):
+        return get_stats()
 
     def request(self, method, url, **kwargs):
         if not url.startswith('https://'):
             url = 'https://api.bitbucket.org/{}'.format(url)
 
+        method = method.upper()
         raw = kwargs.pop('raw', False)
-        res = self._dispatcher.dispatch(method, url, **kwargs)
-        res.encoding = 'utf-8'
-        try:
-            res.raise_for_status()
-        except requests.RequestException as reqe:
-            if res.status_code == 401 and isinstance(self._dispatcher, OAuth2Dispatcher):
-                # Access token expired
-                self.refresh_access_token()
-                return self.request(method, url, **kwargs)
-            else:
-                try:
-                    error_info = res.json()
-                except (TypeError, ValueError):
-                    error_info = {}
-                    logger.exception('Extract bitbucket error info failed, response: %s', res.text)
-
-                raise BitbucketAPIError(
-                    res.status_code,
-                    error_info.get('error', ''),
-                    error_info.get('error_description', ''),
-                    request=reqe.request,
-                    response=reqe.response
-                )
-
+        ttl = kwargs.pop('ttl', None)
+        # Called with seconds to wait whenever the request is throttled
+        on_throttled = kwargs.pop('on_throttled', None)
+        if self.timeout:
+            kwargs.setdefault('timeout', self.timeout)
+        if self.cache is not None:
+            if method == 'GET' and not raw:
+                return self._cached_get(url, ttl, on_throttled, **kwargs)
+            if method != 'GET':
+                # Modified resources have to be refetched, e.g. hook list after adding a hook
+                self.cache.invalidate(url)
+        res = self._send(method, url, on_throttled, **kwargs)
         if raw:
             return res
         return res.json()
 
+    def _cached_get(self, url, ttl=None, on_throttled=None, **kwargs):
+        key = ResponseCache.make_key(url, kwargs.get('params'))
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry.expires > time.time():
+                _incr_stat('cache_hits')
+                return copy.deepcopy(entry.data)
+            headers = dict(kwargs.get('headers') or {})
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+            kwargs['headers'] = headers
+
+        res = self._send('GET', url, on_throttled, **kwargs)
+        expires = time.time() + ttl if ttl else 0
+        if res.status_code == 304 and entry is not None:
+            _incr_stat('cache_revalidated')
+            entry.expires = expires
+            self.cache.set(key, entry)
+            return copy.deepcopy(entry.data)
+
+        data = res.json()
+        etag = res.headers.get('ETag')
+        last_modified = res.headers.get('Last-Modified')
+        if etag or last_modified or ttl:
+            self.cache.set(key, _CachedResponse(copy.deepcopy(data), etag, last_modified, expires))
+        return data
+
+    def _backoff(self, retries):
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** retries))  # nosec
+
+    def _send(self, method, url, on_throttled=None, **kwargs):
+        host = urlparse(url).netloc
+        breaker = None
+        if self.failure_threshold > 0:
+            breaker = get_circuit_breaker(host, self.failure_threshold, self.reset_timeout)
+
+        retries = 0
+        throttled = 0
+        token_refreshed = False
+        while True:
+            if breaker is not None and not breaker.allow():
+                _incr_stat('short_circuited')
+                raise CircuitOpenError(503, 'circuit_open', 'Bitbucket API {} is unavailable'.format(host))
+
+            _incr_stat('requests')
+            try:
+                res = self._dispatcher.dispatch(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                _incr_stat('connection_errors')
+                if breaker is not None:
+                    breaker.record_failure()
+                if method not in IDEMPOTENT_METHODS or retries >= self.max_retries:
+                    raise
+                delay = self._backoff(retries)
+                logger.warning('Error connecting to Bitbucket API, retry %s %s in %.1f seconds', method, url, delay)
+            else:
+                res.encoding = 'utf-8'
+                if breaker is not None:
+                    if res.status_code >= 500:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                if res.ok:
+                    return res
+
+                if (res.status_code == 401 and not token_refreshed and
+                        isinstance(self._dispatcher, OAuth2Dispatcher)):
+                    # Access token expired, refresh it only once
+                    token_refreshed = True
+                    _incr_stat('token_refreshes')
+                    self._dispatcher.refresh_access_token()
+                    continue
+
+                if res.status_code == 429:
+                    _incr_stat('throttled')
+                    delay = min(
+                        self.max_backoff,
+                        parse_retry_after(res.headers.get('Retry-After'), default=self._backoff(throttled))
+                    )
+                    if on_throttled is not None:
+                        on_throttled(delay)
+                    if throttled >= self.throttle_retries:
+                        _incr_stat('errors')
+                        raise self._api_error(res)
+                    throttled += 1
+                    logger.warning('Throttled by Bitbucket API, retry %s %s in %.1f seconds', method, url, delay)
+                    _incr_stat('retries')
+                    time.sleep(delay)
+                    continue
+
+                retryable = res.status_code in RETRY_STATUS_CODES and method in IDEMPOTENT_METHODS
+                delay = self._backoff(retries)
+                if not retryable or retries >= self.max_retries:
+                    _incr_stat('errors')
+                    raise self._api_error(res)
+                logger.warning('Bitbucket API returned %d, retry %s %s in %.1f seconds',
+                               res.status_code, method, url, delay)
+
+            retries += 1
+            _incr_stat('retries')
+            time.sleep(delay)
+
+    def _api_error(self, res):
+        try:
+            error_info = res.json()
+        except (TypeError, ValueError):
+            error_info = {}
+            logger.exception('Extract bitbucket error info failed, response: %s', res.text)
+
+        return BitbucketAPIError(
+            res.status_code,
+            error_info.get('error', ''),
+            error_info.get('error_description', ''),
+            request=res.request,
+            response=res
+        )
+
     def get(self, url, **kwargs):
         return self.request('GET', url, **kwargs)
 
@@ -261,7 +584,11 @@ class PullRequest(object):
         )
         return self.client.get(endpoint)
 
-    def list(self, state=None, page=1, size=50):
+    def list(self, state=None, page=1, size=50, query=None):
+        """List a page of pull requests
+
+        :param query: optional filter in Bitbucket query language, like ``destination.branch.name="master"``
+        """
         endpoint = '2.0/repositories/{repo}/pullrequests'.format(
             repo=self.repo,
             id=id
@@ -272,8 +599,18 @@ class PullRequest(object):
         }
         if state:
             params['state'] = state
+        if query:
+            params['q'] = query
         return self.client.get(endpoint, params=params)
 
+    def list_all(self, state=None, size=50, query=None, max_workers=4):
+        """List pull requests of all pages"""
+        return fetch_all_pages(
+            lambda page, size: self.list(state=state, page=page, size=size, query=query),
+            size=size,
+            max_workers=max_workers
+        )
+
     def merge(self, id, message):
         endpoint = '2.0/repositories/{repo}/pullrequests/{id}/merge'.format(
             repo=self.repo,
@@ -287,7 +624,8 @@ class PullRequest(object):
         )
 
     def comment(self, id, content, line_from=None, line_to=None, parent_id=None,
-                filename=None):
+                filename=None, **kwargs):
+        """Add comment, extra ``kwargs`` like ``on_throttled`` are passed to :meth:`Bitbucket.request`"""
         endpoint = '2.0/repositories/{repo}/pullrequests/{id}/comments'.format(
             repo=self.repo,
             id=id
@@ -298,9 +636,13 @@ class PullRequest(object):
             data['inline'] = inline
         if parent_id:
             data['parent'] = {'id': parent_id}
-        return self.client.post(endpoint, json=data)
+        return self.client.post(endpoint, json=data, **kwargs)
 
-    def comments(self, id, page=1, size=100):
+    def comments(self, id, page=1, size=100, fields=None):
+        """List a page of comments
+
+        :param fields: optional comment fields to transfer, like ``('id', 'content.raw')``
+        """
         endpoint = '2.0/repositories/{repo}/pullrequests/{id}/comments'.format(
             repo=self.repo,
             id=id
@@ -309,38 +651,60 @@ class PullRequest(object):
             'page': page,
             'pagelen': size,
         }
+        if fields:
+            params['fields'] = ','.join(
+                ['values.{}'.format(field) for field in fields] + ['size', 'page', 'pagelen', 'next']
+            )
         return self.client.get(endpoint, params=params)
 
-    def all_comments(self, id):
-        rs = []
-        res = self.comments(id)
-        rs.extend(res['values'])
+    def iter_comments(self, id, size=100, fields=None):
+        """Iterate all comments page by page"""
+        res = self.comments(id, size=size, fields=fields)
+        yield from res['values']
         while res.get('next'):
-            res = self.comments(id, page=res['page'] + 1)
-            rs.extend(res['values'])
-        return rs
+            res = self.comments(id, page=res['page'] + 1, size=size, fields=fields)
+            yield from res['values']
+
+    def all_comments(self, id, size=100, fields=None, max_workers=4):
+        """List all comments, pages after the first one are fetched concurrently"""
+        return fetch_all_pages(
+            lambda page, size: self.comments(id, page=page, size=size, fields=fields),
+            size=size,
+            max_workers=max_workers
+        )
 
-    def delete_comment(self, id, comment_id):
+    def delete_comment(self, id, comment_id, **kwargs):
         endpoint = '2.0/repositories/{repo}/pullrequests/{id}/comments/{cid}'.format(
             repo=self.repo,
             id=id,
             cid=comment_id,
         )
-        return self.client.delete(endpoint)
+        return self.client.delete(endpoint, **kwargs)
 
-    def diff(self, id, raw=False):
-        from unidiff import PatchSet
+    def diff(self, id, raw=False, exclude=None):
+        """Diff of pull request, as text if ``raw`` otherwise as :class:`~badwolf.diff.DiffIndex`
 
+        Diff is parsed while it's being downloaded, huge diffs are never held in memory.
+        Lines of paths matching ``exclude`` predicate are not indexed.
+        """
         endpoint = '2.0/repositories/{repo}/pullrequests/{id}/diff'.format(
             repo=self.repo,
             id=id
         )
-        res = self.client.get(endpoint, raw=True)
-        res.encoding = 'utf-8'
         if raw:
+            res = self.client.get(endpoint, raw=True)
+            res.encoding = 'utf-8'
             return res.text
-        patch = PatchSet(res.text.split('\n'))
-        return patch
+
+        res = self.client.get(endpoint, raw=True, stream=True)
+        res.encoding = 'utf-8'
+        try:
+            return parse_diff(
+                iter_lines(res.iter_content(chunk_size=64 * 1024, decode_unicode=True)),
+                exclude=exclude
+            )
+        finally:
+            res.close()
 
 
 class Changesets(object):
@@ -394,10 +758,27 @@ class FlaskBitbucket(object):
             self.init_app(app)
 
     def init_app(self, app):
-        self.client = Bitbucket(BasicAuthDispatcher(
-            app.config['BITBUCKET_USERNAME'],
-            app.config['BITBUCKET_PASSWORD']
-        ))
+        self.client = Bitbucket(
+            BasicAuthDispatcher(
+                app.config['BITBUCKET_USERNAME'],
+                app.config['BITBUCKET_PASSWORD']
+            ),
+            timeout=app.config['BITBUCKET_TIMEOUT'],
+            max_retries=app.config['BITBUCKET_MAX_RETRIES'],
+            backoff_factor=app.config['BITBUCKET_BACKOFF_FACTOR'],
+            failure_threshold=app.config['BITBUCKET_CIRCUIT_FAILURES'],
+            reset_timeout=app.config['BITBUCKET_CIRCUIT_TIMEOUT'],
+            cache_size=app.config['BITBUCKET_CACHE_SIZE'],
+            throttle_retries=app.config['BITBUCKET_THROTTLE_RETRIES'],
+        )
+
+    @property
+    def stats(self):
+        return self.client.stats
+
+    @property
+    def account(self):
+        return self.client.account
 
     def request(self, method, url, **kwargs):
         return self.client.request(method, url, **kwargs)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import time
+import fcntl
+import shutil
+import tempfile
+import hashlib
+import logging
+import contextlib
+
+
+logger = logging.getLogger(__name__)
+
+# Throwaway copies of caches for untrusted builds
+SNAPSHOT_DIR = '.snapshots'
+
+
+def _slugify(name):
+    slug = re.sub(r'[^a-zA-Z0-9._-]+', '_', name).strip('._')[:64]
+    # Different names may have the same slug
+    return '{}-{}'.format(slug, hashlib.sha1(name.encode('utf-8')).hexdigest()[:8])  # nosec
+
+
+class BuildCache(object):
+    '''Dependency directories declared by ``cache`` in spec, persisted between builds
+
+    Caches live in ``BADWOLF_BUILD_CACHE_DIR/<owner>/<repo>/<branch>`` on the Docker
+    host, ``repository`` being the one the built branch belongs to, and are bind
+    mounted into build containers. A branch without cache starts from a copy of
+    the cache of ``fallback_branch``, usually the main branch.
+    '''
+    def __init__(self, cache_dir, repository, branch, fallback_branch=None):
+        self.cache_dir = cache_dir
+        self.repository = repository
+        self.branch = branch
+        self.fallback_branch = fallback_branch
+        self.path = self._branch_path(branch)
+
+    def __repr__(self):
+        return '<BuildCache {}@{}>'.format(self.repository, self.branch)
+
+    def _branch_path(self, branch):
+        return os.path.join(self.cache_dir, self.repository, _slugify(branch))
+
+    @staticmethod
+    def container_path(path, home, working_dir):
+        if path == '~' or path.startswith('~/'):
+            return os.path.normpath(home + path[1:])
+        return os.path.normpath(os.path.join(working_dir, path))
+
+    @contextlib.contextmanager
+    def _lock(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open('{}.lock'.format(self.path), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _volumes(self, root, paths, home, working_dir):
+        volumes = {}
+        for path in paths:
+            host_path = os.path.join(root, _slugify(path))
+            os.makedirs(host_path, exist_ok=True)
+            volumes[host_path] = {
+                'bind': self.container_path(path, home, working_dir),
+                'mode': 'rw',
+            }
+        return volumes
+
+    @contextlib.contextmanager
+    def mount(self, paths, home, working_dir):
+        '''Yield Docker volumes of cached ``paths``, cache is locked meanwhile
+
+        No volumes are yielded when the cache is in use by another build of the branch.
+        '''
+        with self._lock() as locked:
+            if not locked:
+                logger.info('Build cache of %s is in use, build without cache', self.branch)
+                yield {}
+                return
+
+            self._prepare()
+            yield self._volumes(self.path, paths, home, working_dir)
+
+    @contextlib.contextmanager
+    def snapshot(self, paths, home, working_dir):
+        '''Yield Docker volumes of a throwaway copy of cached ``paths``, removed afterwards
+
+        Changes made by the build are never written back to the cache.
+        '''
+        snapshot_dir = os.path.join(self.cache_dir, SNAPSHOT_DIR)
+        os.makedirs(snapshot_dir, exist_ok=True)
+        root = tempfile.mkdtemp(dir=snapshot_dir)
+        try:
+            with self._lock() as locked:
+                if locked and os.path.isdir(self.path):
+                    for path in paths:
+                        cached_path = os.path.join(self.path, _slugify(path))
+                        if os.path.isdir(cached_path):
+                            shutil.copytree(cached_path, os.path.join(root, _slugify(path)), symlinks=True)
+                elif not locked:
+                    logger.info('Build cache of %s is in use, build without cache', self.branch)
+            yield self._volumes(root, paths, home, working_dir)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    def _prepare(self):
+        if not os.path.isdir(self.path) and self.fallback_branch and self.fallback_branch != self.branch:
+            fallback_path = self._branch_path(self.fallback_branch)
+            if os.path.isdir(fallback_path):
+                logger.info('Seeding build cache of %s from %s', self.branch, self.fallback_branch)
+                start = time.time()
+                try:
+                    shutil.copytree(fallback_path, self.path, symlinks=True)
+                except (OSError, shutil.Error):
+                    logger.exception('Error copying build cache of %s', self.fallback_branch)
+                    shutil.rmtree(self.path, ignore_errors=True)
+                else:
+                    logger.info('Seeded build cache in %.2f seconds', time.time() - start)
+        os.makedirs(self.path, exist_ok=True)
+        # Used as last used time for eviction
+        os.utime(self.path, None)
+
+
+def _disk_usage(path):
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def evict_build_caches(cache_dir, max_size):
+    '''Remove least recently used branch caches until total size is below ``max_size`` bytes,
+    caches in use are kept'''
+    if max_size <= 0 or not os.path.isdir(cache_dir):
+        return []
+
+    caches = []
+    for owner in os.listdir(cache_dir):
+        owner_dir = os.path.join(cache_dir, owner)
+        if owner == SNAPSHOT_DIR or not os.path.isdir(owner_dir):
+            continue
+        for repo in os.listdir(owner_dir):
+            repo_dir = os.path.join(owner_dir, repo)
+            if not os.path.isdir(repo_dir):
+                continue
+            for name in os.listdir(repo_dir):
+                path = os.path.join(repo_dir, name)
+                if os.path.isdir(path):
+                    caches.append((os.stat(path).st_mtime, path, _disk_usage(path)))
+    total = sum(size for _, _, size in caches)
+    if total <= max_size:
+        return []
+
+    start = time.time()
+    removed = []
+    for _, path, size in sorted(caches):
+        if total <= max_size:
+            break
+        with open('{}.lock'.format(path), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        total -= size
+        removed.append(path)
+    logger.info('Evicted %d build cache(s) in %.2f seconds, %d bytes in use', len(removed), time.time() - start, total)
+    return removed
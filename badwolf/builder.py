@@ -5,20 +5,28 @@ import time
 import base64
 import logging
 import shlex
+import uuid
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from html import escape as html_escape
 
 import deansi
 import requests
 from flask import current_app, render_template, url_for
-from requests.exceptions import ReadTimeout
-from docker import DockerClient
+from requests.exceptions import ReadTimeout, RequestException
 from docker.errors import APIError, DockerException, ImageNotFound, NotFound
 from markupsafe import Markup
 
 from badwolf.utils import to_text, to_binary, sanitize_sensitive_data
-from badwolf.extensions import bitbucket, sentry
-from badwolf.bitbucket import BuildStatus, BitbucketAPIError
+from badwolf.extensions import bitbucket, sentry, registry, docker, statuses, services
+from badwolf.bitbucket import BuildStatus
 from badwolf.notification import send_mail
+from badwolf.spec import SecureString
+from badwolf.exceptions import PipelineCancelled
+from badwolf.log.store import LogStore
+from badwolf.buildcache import BuildCache, evict_build_caches
+from badwolf.imagecache import IMAGE_LABEL, ImageCache, image_content_hash
 
 
 logger = logging.getLogger(__name__)
@@ -26,8 +34,13 @@ logger = logging.getLogger(__name__)
 
 class Builder(object):
     """Badwolf build runner"""
+    # Seconds to wait for remaining container logs after container exited
+    LOG_FLUSH_TIMEOUT = 30
+    # Bytes of the end of test logs included in notification email
+    MAIL_LOG_SIZE = 64 * 1024
+    _LOGS_PLACEHOLDER = '<!-- badwolf:logs -->'
 
-    def __init__(self, context, spec, build_status=None, docker_version='auto'):
+    def __init__(self, context, spec, build_status=None):
         self.context = context
         self.spec = spec
         self.repo_name = context.repository.split('/')[-1]
@@ -39,14 +52,25 @@ class Builder(object):
             'badwolf/test',
             url_for('log.build_log', sha=self.commit_hash, _external=True)
         )
-
-        self.docker = DockerClient(
-            base_url=current_app.config['DOCKER_HOST'],
-            timeout=current_app.config['DOCKER_API_TIMEOUT'],
-            version=docker_version,
-        )
+        self.docker = docker.client
+        self.cache_volumes = {}
+        self.log_dir = os.path.join(current_app.config['BADWOLF_LOG_DIR'], self.commit_hash, context.task_id)
 
     def run(self):
+        with self.mount_build_cache() as cache_volumes:
+            self.cache_volumes = cache_volumes
+            exit_code = self._run()
+        if self.spec.cache:
+            try:
+                evict_build_caches(
+                    current_app.config['BADWOLF_BUILD_CACHE_DIR'],
+                    current_app.config['BADWOLF_BUILD_CACHE_SIZE']
+                )
+            except OSError:
+                logger.exception('Error evicting build caches')
+        return exit_code
+
+    def _run(self):
         start_time = time.time()
         branch = self.context.source['branch']
         context = {
@@ -69,8 +93,18 @@ class Builder(object):
             self.send_notifications(context)
             return
 
-        exit_code, output = self.run_in_container(docker_image_name)
-        logger.debug('Docker run output: %s', output)
+        registry.check(self.context.task_id)
+        environments = self.get_run_environments()
+        if len(environments) > 1:
+            exit_code = self.run_matrix(docker_image_name, environments, context)
+            context.update({
+                'exit_code': exit_code,
+                'elapsed_time': int(time.time() - start_time),
+            })
+            self.send_notifications(context)
+            return exit_code
+
+        exit_code, log = self.run_in_container(docker_image_name, environments[0])
         if exit_code == 0:
             # Success
             logger.info('Test succeed for repo: %s', self.context.repository)
@@ -88,55 +122,185 @@ class Builder(object):
                 self.update_build_status('FAILED', '1 of 1 test failed')
 
         context.update({
-            'logs': Markup(deansi.deansi(output)),
+            'log': log,
             'exit_code': exit_code,
             'elapsed_time': int(time.time() - start_time),
         })
         self.send_notifications(context)
         return exit_code
 
+    def get_run_environments(self):
+        """Environments of containers to run, one per build matrix environment and test shard
+
+        Shards get ``BADWOLF_NODE_INDEX`` (starts from 0) and ``BADWOLF_NODE_TOTAL`` to split tests by.
+        """
+        environments = self.spec.environments or [{}]
+        total = self.spec.parallel
+        if total <= 1:
+            return environments
+        return [
+            dict(environment, BADWOLF_NODE_INDEX=str(index), BADWOLF_NODE_TOTAL=str(total))
+            for environment in environments
+            for index in range(total)
+        ]
+
+    def run_matrix(self, docker_image_name, environments, context):
+        """Run tests in every environment of build matrix and test shard in parallel
+        containers, each reported as build status ``badwolf/test/<n>`` with its own log"""
+        runs = []
+        for index, environment in enumerate(environments, 1):
+            build_status = BuildStatus(
+                bitbucket,
+                self.context.source['repository']['full_name'],
+                self.commit_hash,
+                '{}/{}'.format(self.build_status.key, index),
+                url_for('log.build_log', sha=self.commit_hash, task_id=self.context.task_id,
+                        env=index, _external=True)
+            )
+            statuses.publish(build_status, 'INPROGRESS', description='Queued')
+            runs.append((index, environment, build_status))
+
+        self.update_build_status('INPROGRESS', 'Running tests in {} environments'.format(len(runs)))
+        app = current_app._get_current_object()
+        max_workers = min(len(runs), current_app.config['BADWOLF_BUILD_PARALLELISM'])
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._run_matrix_environment, app, docker_image_name, context, *run)
+                for run in runs
+            ]
+            exit_codes = [future.result() for future in futures]
+
+        succeed = sum(1 for exit_code in exit_codes if exit_code == 0)
+        if 137 in exit_codes:
+            exit_code = 137
+            self.update_build_status('FAILED', 'build cancelled')
+        elif succeed == len(exit_codes):
+            exit_code = 0
+            self.update_build_status('SUCCESSFUL', '{} of {} tests succeed'.format(succeed, len(exit_codes)))
+        else:
+            exit_code = next(exit_code for exit_code in exit_codes if exit_code != 0)
+            self.update_build_status(
+                'FAILED',
+                '{} of {} tests failed'.format(len(exit_codes) - succeed, len(exit_codes))
+            )
+        logger.info('Test matrix of repo %s finished, exit codes: %s', self.context.repository, exit_codes)
+
+        context['logs'] = Markup(render_template(
+            'matrix_summary.html',
+            runs=[(index, self._describe_environment(environment), build_status.url, exit_code)
+                  for (index, environment, build_status), exit_code in zip(runs, exit_codes)]
+        ))
+        return exit_code
+
+    @staticmethod
+    def _describe_environment(environment):
+        parts = []
+        for name in sorted(environment):
+            if name.startswith('BADWOLF_NODE_'):
+                continue
+            value = environment[name]
+            # Values of secure variables are never shown
+            parts.append(name if isinstance(value, SecureString) else '{}={}'.format(name, value))
+        if 'BADWOLF_NODE_INDEX' in environment:
+            parts.append('node {}/{}'.format(
+                int(environment['BADWOLF_NODE_INDEX']) + 1,
+                environment['BADWOLF_NODE_TOTAL']
+            ))
+        return ' '.join(parts)
+
+    def _run_matrix_environment(self, app, docker_image_name, context, index, environment, build_status):
+        with app.app_context():
+            if registry.is_cancelled(self.context.task_id):
+                statuses.publish(build_status, 'STOPPED', description='build cancelled')
+                return 137
+
+            start_time = time.time()
+            log_dir = os.path.join(self.log_dir, str(index))
+            try:
+                exit_code, log = self.run_in_container(
+                    docker_image_name,
+                    environment,
+                    log_dir=log_dir,
+                    build_status=build_status,
+                    extra_labels={'env': str(index)}
+                )
+            except Exception:
+                # Other environments go on, this one is reported as failed
+                logger.exception('Error running tests in environment #%s', index)
+                sentry.captureException()
+                exit_code, log = -1, None
+            if exit_code == 0:
+                statuses.publish(build_status, 'SUCCESSFUL', description='Test succeed')
+            elif exit_code == 137:
+                statuses.publish(build_status, 'STOPPED', description='build cancelled')
+            else:
+                statuses.publish(build_status, 'FAILED', description='Test failed, exit code {}'.format(exit_code))
+
+            env_context = dict(context)
+            env_context.update({
+                'build_log_url': build_status.url,
+                'log': log,
+                'exit_code': exit_code,
+                'elapsed_time': int(time.time() - start_time),
+            })
+            self.save_log_page(env_context, log_dir)
+            return exit_code
+
     def get_docker_image(self):
-        docker_image_name = self.context.repository.replace('/', '-')
         output = []
+        build_options = {
+            'rm': True,
+            'forcerm': True,
+            'decode': True,
+            'nocache': self.context.nocache,
+            'labels': {IMAGE_LABEL: self.context.repository},
+        }
+        build_args = self.context.environment.copy()
+        if self.spec.environments:
+            build_args.update(self.spec.environments[0])
+        if build_args:
+            # Environments of build matrix share the same image built with the first environment
+            build_options['buildargs'] = build_args
+        if self.spec.image:
+            dockerfile_content = 'FROM {}\n'.format(self.spec.image)
+            build_options['fileobj'] = io.BytesIO(dockerfile_content.encode('utf-8'))
+        else:
+            dockerfile = os.path.join(self.context.clone_path, self.spec.dockerfile)
+            if os.path.exists(dockerfile):
+                with open(dockerfile, encoding='utf-8', errors='replace') as f:
+                    dockerfile_content = f.read()
+                build_options['dockerfile'] = self.spec.dockerfile
+            else:
+                logger.warning(
+                    'No Dockerfile: %s found for repo: %s, using simple runner image',
+                    dockerfile,
+                    self.context.repository
+                )
+                dockerfile_content = 'FROM messense/badwolf-test-runner:python\n'
+                build_options['fileobj'] = io.BytesIO(dockerfile_content.encode('utf-8'))
+
+        # Images are tagged by content hash so that branches with different Dockerfiles
+        # don't rebuild each other's image and the same content is built only once
+        content_hash = image_content_hash(self.context.clone_path, dockerfile_content, build_args)
+        docker_image_name = '{}:{}'.format(self.context.repository.replace('/', '-'), content_hash[:16])
+        build_options['tag'] = docker_image_name
+        image_cache = ImageCache(
+            self.docker,
+            current_app.config['BADWOLF_IMAGE_CACHE_DIR'],
+            current_app.config['BADWOLF_IMAGE_CACHE_SIZE']
+        )
         try:
             docker_image = self.docker.images.get(docker_image_name)
         except ImageNotFound:
             docker_image = None
-        if not docker_image or self.context.rebuild:
-            build_options = {
-                'tag': docker_image_name,
-                'rm': True,
-                'forcerm': True,
-                'decode': True,
-                'nocache': self.context.nocache
-            }
-            build_args = self.context.environment.copy()
-            if self.spec.environments:
-                # TODO: Support run in multiple environments
-                build_args.update(self.spec.environments[0])
-            if build_args:
-                build_options['buildargs'] = build_args
+        if docker_image and not self.context.rebuild:
+            logger.info('Reusing Docker image %s', docker_image_name)
+        else:
             if self.spec.image:
                 from_image_name, from_image_tag = self.spec.image.split(':', 2)
                 logger.info('Pulling Docker image %s', self.spec.image)
                 self.docker.images.pull(from_image_name, tag=from_image_tag)
                 logger.info('Pulled Docker image %s', self.spec.image)
-                dockerfile_content = 'FROM {}\n'.format(self.spec.image)
-                fileobj = io.BytesIO(dockerfile_content.encode('utf-8'))
-                build_options['fileobj'] = fileobj
-            else:
-                dockerfile = os.path.join(self.context.clone_path, self.spec.dockerfile)
-                if os.path.exists(dockerfile):
-                    build_options['dockerfile'] = self.spec.dockerfile
-                else:
-                    logger.warning(
-                        'No Dockerfile: %s found for repo: %s, using simple runner image',
-                        dockerfile,
-                        self.context.repository
-                    )
-                    dockerfile_content = 'FROM messense/badwolf-test-runner:python\n'
-                    fileobj = io.BytesIO(dockerfile_content.encode('utf-8'))
-                    build_options['fileobj'] = fileobj
 
             build_success = False
             logger.info('Building Docker image %s', docker_image_name)
@@ -145,6 +309,12 @@ class Builder(object):
             # Use low level API instead of high level API to get raw output
             res = self.docker.api.build(self.context.clone_path, **build_options)
             for log in res:
+                if registry.is_cancelled(self.context.task_id):
+                    # Closing the stream makes Docker daemon abort the build
+                    res.close()
+                    logger.info('Building Docker image %s cancelled', docker_image_name)
+                    raise PipelineCancelled()
+
                 if 'errorDetail' in log:
                     msg = log['errorDetail']['message']
                 elif 'error' in log:
@@ -165,13 +335,64 @@ class Builder(object):
             if not build_success:
                 return None, ''.join(output)
 
+            try:
+                image_cache.gc(keep=docker_image_name)
+            except (APIError, DockerException, RequestException):
+                logger.exception('Error removing least recently used Docker images')
+
+        image_cache.touch(docker_image_name)
         return docker_image_name, ''.join(output)
 
-    def run_in_container(self, docker_image_name):
+    @contextlib.contextmanager
+    def mount_build_cache(self):
+        """Yield Docker volumes of directories declared by ``cache`` in spec"""
+        if not self.spec.cache:
+            yield {}
+            return
+
+        if self.context.target:
+            fallback_branch = self.context.target['branch']['name']
+        else:
+            fallback_branch = self._get_main_branch()
+        cache_dir = current_app.config['BADWOLF_BUILD_CACHE_DIR']
+        source_repository = self.context.source['repository']['full_name']
+        if source_repository != self.context.repository:
+            # Pull request from fork gets a throwaway copy, caches used by
+            # trusted builds of the repository are never written by it
+            cache = BuildCache(cache_dir, self.context.repository, fallback_branch)
+            mount = cache.snapshot(self.spec.cache, '/root', self.context.clone_path)
+        else:
+            cache = BuildCache(
+                cache_dir,
+                source_repository,
+                self.context.source['branch']['name'],
+                fallback_branch=fallback_branch
+            )
+            mount = cache.mount(self.spec.cache, '/root', self.context.clone_path)
+        with contextlib.ExitStack() as stack:
+            try:
+                volumes = stack.enter_context(mount)
+            except OSError:
+                logger.exception('Error preparing build cache %r', cache)
+                volumes = {}
+            # Cache is locked until all containers of the build are removed
+            yield volumes
+
+    def _get_main_branch(self):
+        try:
+            repo = bitbucket.get(
+                '2.0/repositories/{}'.format(self.context.repository),
+                ttl=current_app.config['BITBUCKET_REPO_CACHE_TTL']
+            )
+            return repo['mainbranch']['name']
+        except (RequestException, KeyError, TypeError):
+            logger.exception('Error getting main branch of repository %s', self.context.repository)
+            return 'master'
+
+    def run_in_container(self, docker_image_name, env=None, log_dir=None, build_status=None, extra_labels=None):
         environment = self.context.environment.copy()
-        if self.spec.environments:
-            # TODO: Support run in multiple environments
-            environment.update(self.spec.environments[0])
+        if env:
+            environment.update(env)
 
         # TODO: Add more test context related env vars
         script = shlex.quote(to_text(base64.b64encode(to_binary(self.spec.shell_script))))
@@ -193,6 +414,7 @@ class Builder(object):
             labels['branch'] = branch['name']
         if self.context.pr_id:
             labels['pull_request'] = str(self.context.pr_id)
+        labels.update(extra_labels or {})
 
         volumes = {
             self.context.clone_path: {
@@ -206,69 +428,124 @@ class Builder(object):
                 'mode': 'ro',
             }
             environment.setdefault('DOCKER_HOST', 'unix:///var/run/docker.sock')
+        # Shared by all containers of build matrix and test shards
+        volumes.update(self.cache_volumes)
         logger.debug('Docker container environment: \n %r', environment)
-        container = self.docker.containers.create(
-            docker_image_name,
-            entrypoint=['/bin/{}'.format(self.spec.shell), '-c'],
-            command=['echo $BADWOLF_SCRIPT | base64 --decode | /bin/{}'.format(self.spec.shell)],
-            environment=environment,
-            working_dir=self.context.clone_path,
-            volumes=volumes,
-            privileged=self.spec.privileged,
-            stdin_open=False,
-            tty=True,
-            labels=labels,
-        )
+        network = None
+        sidecars = []
+        if self.spec.sidecars:
+            network, sidecars = services.start(
+                'badwolf-{}-{}'.format(self.context.task_id, uuid.uuid4().hex[:8]),
+                self.spec.sidecars,
+                labels=labels
+            )
+        try:
+            container = self.docker.containers.create(
+                docker_image_name,
+                entrypoint=['/bin/{}'.format(self.spec.shell), '-c'],
+                command=['echo $BADWOLF_SCRIPT | base64 --decode | /bin/{}'.format(self.spec.shell)],
+                environment=environment,
+                working_dir=self.context.clone_path,
+                volumes=volumes,
+                privileged=self.spec.privileged,
+                stdin_open=False,
+                tty=True,
+                labels=labels,
+                network=network.name if network is not None else None,
+            )
+        except BaseException:
+            services.stop(network, sidecars)
+            raise
         container_id = container.id
         logger.info('Created container %s from image %s', container_id, docker_image_name)
 
-        output = []
+        log = LogStore(
+            log_dir or self.log_dir,
+            chunk_size=current_app.config['BADWOLF_LOG_CHUNK_SIZE'],
+            head_size=current_app.config['BADWOLF_LOG_HEAD_SIZE'],
+            tail_size=current_app.config['BADWOLF_LOG_TAIL_SIZE'],
+        )
+        reader = threading.Thread(target=self._capture_logs, args=(container, log))
+        reader.daemon = True
+        exit_code = -1
         try:
             container.start()
-            self.update_build_status('INPROGRESS', 'Running tests in Docker container')
+            reader.start()
+            statuses.publish(
+                build_status or self.build_status,
+                'INPROGRESS',
+                description='Running tests in Docker container'
+            )
             exit_code = container.wait(timeout=current_app.config['DOCKER_RUN_TIMEOUT'])
             if isinstance(exit_code, dict):
                 exit_code = exit_code['StatusCode']
         except (APIError, DockerException, ReadTimeout) as e:
             exit_code = -1
-            output.append(str(e) + '\n')
+            log.write(str(e) + '\n')
             logger.exception('Docker error')
         finally:
+            if reader.is_alive() and exit_code != -1:
+                # Container exited, wait for remaining logs
+                reader.join(self.LOG_FLUSH_TIMEOUT)
             try:
-                output.append(to_text(container.logs()))
                 container.remove(force=True)
             except NotFound:
                 pass
-            except APIError as api_e:
-                if 'can not get logs from container which is dead or marked for removal' in str(api_e):
-                    output.append('Build cancelled')
-                else:
-                    logger.exception('Error removing docker container')
-            except (DockerException, ReadTimeout):
+            except (APIError, DockerException, ReadTimeout):
                 logger.exception('Error removing docker container')
+            services.stop(network, sidecars)
+            if reader.is_alive():
+                reader.join(self.LOG_FLUSH_TIMEOUT)
+            log.close()
 
-        return exit_code, ''.join(output)
+        return exit_code, log
 
-    def update_build_status(self, state, description=None):
+    def _capture_logs(self, container, log):
         try:
-            self.build_status.update(state, description=description)
-        except BitbucketAPIError:
-            logger.exception('Error calling Bitbucket API')
-            sentry.captureException()
+            for chunk in container.logs(stdout=True, stderr=True, stream=True, follow=True):
+                log.write(chunk)
+        except NotFound:
+            log.write('Build cancelled')
+        except APIError as api_e:
+            if 'can not get logs from container which is dead or marked for removal' in str(api_e):
+                log.write('Build cancelled')
+            else:
+                logger.exception('Error streaming docker container logs')
+        except (DockerException, RequestException):
+            logger.exception('Error streaming docker container logs')
 
-    def send_notifications(self, context):
-        exit_code = context['exit_code']
-        template = 'test_success' if exit_code == 0 else 'test_failure'
+    def update_build_status(self, state, description=None):
+        statuses.publish(self.build_status, state, description=description)
+
+    def save_log_page(self, context, log_dir=None):
+        """Save build log page into ``log_dir``, returns page HTML with log tail for notifications"""
+        log_dir = log_dir or self.log_dir
+        template = 'test_success' if context['exit_code'] == 0 else 'test_failure'
+        log = context.pop('log', None)
+        if log is not None:
+            context['logs'] = Markup(self._LOGS_PLACEHOLDER)
         html = render_template('mail/' + template + '.html', **context)
         html = sanitize_sensitive_data(html)
+        html_head, _, html_tail = html.partition(self._LOGS_PLACEHOLDER)
 
-        # Save log html
-        log_dir = os.path.join(current_app.config['BADWOLF_LOG_DIR'], self.commit_hash, self.context.task_id)
+        # Save log html, streaming test logs from disk
         os.makedirs(log_dir, exist_ok=True)
         log_file = os.path.join(log_dir, 'build.html')
         with open(log_file, 'wb') as f:
-            f.write(to_binary(html))
+            f.write(to_binary(html_head))
+            if log is not None:
+                for log_html in log.iter_html():
+                    f.write(to_binary(log_html))
+            f.write(to_binary(html_tail))
+
+        if log is not None:
+            html = html_head + log.tail_html(self.MAIL_LOG_SIZE) + html_tail
+            log.remove()
+        return html
 
+    def send_notifications(self, context):
+        html = self.save_log_page(context)
+        exit_code = context['exit_code']
         if exit_code == 137:
             logger.info('Build cancelled, will not sending notification')
             return
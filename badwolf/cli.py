@@ -46,7 +46,8 @@ def runserver(host, port, reload, debug):
 @manage.command()
 def shell():
     """Runs a Python shell inside application context"""
-    from badwolf.wsgi import app
+    # Don't import badwolf.wsgi which starts task queue workers
+    app = badwolf.create_app()
 
     app.debug = True
     context = {
@@ -95,9 +96,10 @@ def shell():
 @click.argument('text', required=True)
 def encrypt(text):
     '''Generate secure token from text'''
-    from badwolf.wsgi import app
     from badwolf.security import SecureToken
 
+    app = badwolf.create_app()
+
     with app.app_context():
         token = SecureToken.encrypt(text)
 
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 import os
+import shutil
 import logging
 
 import git
+from flask import current_app
 
-from badwolf.extensions import bitbucket
+from badwolf.extensions import bitbucket, registry
+from badwolf.mirror import RepositoryMirror, evict_mirrors
 
 
 logger = logging.getLogger(__name__)
@@ -20,18 +23,55 @@ class RepositoryCloner(object):
         self.commit_hash = context.source['commit']['hash']
 
     def clone(self):
+        clone_path = self.context.clone_path
+        source_repo = self.context.source['repository']['full_name']
+        if os.path.exists(clone_path):
+            # Left by a build interrupted while cloning, recovered tasks keep their task id
+            logger.warning('Removing leftover clone %s', clone_path)
+            shutil.rmtree(clone_path, ignore_errors=True)
+        mirror = None
+        if current_app.config['BADWOLF_MIRROR_ENABLED']:
+            mirror = self._clone_from_mirror()
+        if mirror is None:
+            registry.check(self.context.task_id)
+            self._clone_from_remote()
+
+        registry.check(self.context.task_id)
+        gitcmd = git.Git(clone_path)
+        if self.context.target:
+            self._merge_pull_request(gitcmd)
+        else:
+            # Push to branch or ci retry comment on some commit
+            if not self.is_commit_exists(gitcmd, self.commit_hash):
+                logger.info('Unshallowing a shallow cloned repository')
+                output = gitcmd.fetch('--unshallow')
+                logger.info('%s', output)
+            logger.info('Checkout commit %s', self.commit_hash)
+            gitcmd.checkout(self.commit_hash)
+
+        if mirror is not None:
+            # Point origin back to BitBucket so that it's usable inside build container
+            gitcmd.remote('set-url', 'origin', bitbucket.get_git_url(source_repo))
+
+        gitmodules = os.path.join(clone_path, '.gitmodules')
+        if os.path.exists(gitmodules):
+            output = gitcmd.submodule('update', '--init', '--recursive', '--depth', '50')
+            logger.info('%s', output)
+
+    def _clone_branch(self):
+        if self.context.target:
+            # Pull request
+            return self.context.target['branch']['name']
+        return self.context.source['branch']['name']
+
+    def _clone_from_remote(self):
         clone_path = self.context.clone_path
         source_repo = self.context.source['repository']['full_name']
         if self.context.clone_depth > 0:
-            if self.context.target:
-                # Pull request
-                branch = self.context.target['branch']['name']
-            else:
-                branch = self.context.source['branch']['name']
             # Use shallow clone to speed up
             clone_kwargs = {
                 'depth': self.context.clone_depth,
-                'branch': branch,
+                'branch': self._clone_branch(),
             }
             if self.context.type == 'commit':
                 # ci retry on commit
@@ -45,22 +85,34 @@ class RepositoryCloner(object):
             # Full clone for ci retry in single commit
             bitbucket.clone(source_repo, clone_path)
 
-        gitcmd = git.Git(clone_path)
-        if self.context.target:
-            self._merge_pull_request(gitcmd)
-        else:
-            # Push to branch or ci retry comment on some commit
-            if not self.is_commit_exists(gitcmd, self.commit_hash):
-                logger.info('Unshallowing a shallow cloned repository')
-                output = gitcmd.fetch('--unshallow')
-                logger.info('%s', output)
-            logger.info('Checkout commit %s', self.commit_hash)
-            gitcmd.checkout(self.commit_hash)
+    def _clone_from_mirror(self):
+        """Clone from local mirror of the repository, returns ``None`` when failed"""
+        clone_path = self.context.clone_path
+        source_repo = self.context.source['repository']['full_name']
+        mirror_dir = current_app.config['BADWOLF_MIRROR_DIR']
+        mirror = RepositoryMirror(mirror_dir, source_repo)
+        branch = self._clone_branch() if self.context.clone_depth > 0 else None
+        try:
+            with mirror.lock():
+                try:
+                    mirror.sync()
+                    registry.check(self.context.task_id)
+                    mirror.clone_to(clone_path, branch=branch)
+                except git.GitCommandError:
+                    logger.exception('Error cloning repository %s from mirror', source_repo)
+                    if mirror.is_corrupted():
+                        mirror.remove()
+                    shutil.rmtree(clone_path, ignore_errors=True)
+                    return None
+        except OSError:
+            logger.exception('Error locking mirror of repository %s', source_repo)
+            return None
 
-        gitmodules = os.path.join(clone_path, '.gitmodules')
-        if os.path.exists(gitmodules):
-            output = gitcmd.submodule('update', '--init', '--recursive', '--depth', '50')
-            logger.info('%s', output)
+        try:
+            evict_mirrors(mirror_dir, current_app.config['BADWOLF_MIRROR_MAX_SIZE'], keep=source_repo)
+        except OSError:
+            logger.exception('Error evicting repository mirrors')
+        return mirror
 
     def _merge_pull_request(self, gitcmd):
         # Pull Request
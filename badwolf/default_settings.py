@@ -2,6 +2,7 @@
 import os
 import sys
 import base64
+import socket
 import tempfile
 import platform
 
@@ -29,6 +30,13 @@ SENTRY_DSN = os.getenv('SENTRY_DSN', '')
 DOCKER_HOST = os.getenv('DOCKER_HOST', 'unix:///var/run/docker.sock')
 DOCKER_API_TIMEOUT = int(os.getenv('DOCKER_API_TIMEOUT', 600))
 DOCKER_RUN_TIMEOUT = int(os.getenv('DOCKER_RUN_TIMEOUT', 1200))
+# Negotiated once with Docker daemon when set to auto
+DOCKER_API_VERSION = os.getenv('DOCKER_API_VERSION', 'auto')
+# Defaults to BADWOLF_WORKERS
+DOCKER_MAX_POOL_SIZE = int(os.getenv('DOCKER_MAX_POOL_SIZE', 0))
+DOCKER_HEALTH_INTERVAL = int(os.getenv('DOCKER_HEALTH_INTERVAL', 30))
+# Timeout of health checks and API version negotiation
+DOCKER_PING_TIMEOUT = int(os.getenv('DOCKER_PING_TIMEOUT', 10))
 
 # Mail
 MAIL_SERVER = os.getenv('MAIL_SERVER', '')
@@ -81,6 +89,25 @@ BITBUCKET_OAUTH_SECRET = os.getenv('BITBUCKET_OAUTH_SECRET', '')
 
 BITBUCKET_USERNAME = os.getenv('BITBUCKET_USERNAME', '')
 BITBUCKET_PASSWORD = os.getenv('BITBUCKET_PASSWORD', '')
+# Bitbucket API timeout in seconds, idempotent requests are retried with jittered exponential backoff,
+# calls are short-circuited for BITBUCKET_CIRCUIT_TIMEOUT seconds after BITBUCKET_CIRCUIT_FAILURES
+# consecutive failures
+BITBUCKET_TIMEOUT = int(os.getenv('BITBUCKET_TIMEOUT', 30))
+BITBUCKET_MAX_RETRIES = int(os.getenv('BITBUCKET_MAX_RETRIES', 3))
+BITBUCKET_BACKOFF_FACTOR = float(os.getenv('BITBUCKET_BACKOFF_FACTOR', 0.5))
+BITBUCKET_CIRCUIT_FAILURES = int(os.getenv('BITBUCKET_CIRCUIT_FAILURES', 5))
+BITBUCKET_CIRCUIT_TIMEOUT = int(os.getenv('BITBUCKET_CIRCUIT_TIMEOUT', 30))
+# GET responses are cached and revalidated with conditional requests, 0 disables caching.
+# Repository metadata like main branch is served from cache for BITBUCKET_REPO_CACHE_TTL seconds
+BITBUCKET_CACHE_SIZE = int(os.getenv('BITBUCKET_CACHE_SIZE', 256))
+BITBUCKET_REPO_CACHE_TTL = int(os.getenv('BITBUCKET_REPO_CACHE_TTL', 300))
+# Pull request comments are sent concurrently, at most BITBUCKET_RATE_LIMIT requests per second
+# per account with bursts of BITBUCKET_RATE_BURST requests, 0 means unlimited
+BITBUCKET_COMMENT_WORKERS = int(os.getenv('BITBUCKET_COMMENT_WORKERS', 4))
+BITBUCKET_RATE_LIMIT = float(os.getenv('BITBUCKET_RATE_LIMIT', 5))
+BITBUCKET_RATE_BURST = int(os.getenv('BITBUCKET_RATE_BURST', 10))
+# Times to retry requests throttled by Bitbucket with HTTP 429, after Retry-After
+BITBUCKET_THROTTLE_RETRIES = int(os.getenv('BITBUCKET_THROTTLE_RETRIES', 3))
 
 BADWOLF_DATA_DIR = os.getenv('BADWOLF_DATA_DIR', '/var/lib/badwolf')
 if DEBUG:
@@ -92,9 +119,66 @@ if DEBUG:
     else:
         BADWOLF_DATA_DIR = os.path.join(tempfile.gettempdir(), 'badwolf')
 BADWOLF_LOG_DIR = os.getenv('BADWOLF_LOG_DIR', os.path.join(BADWOLF_DATA_DIR, 'log'))
+# Test logs are stored on disk in chunks, only head and tail are kept for huge logs
+BADWOLF_LOG_CHUNK_SIZE = int(os.getenv('BADWOLF_LOG_CHUNK_SIZE', 1024 * 1024))
+BADWOLF_LOG_HEAD_SIZE = int(os.getenv('BADWOLF_LOG_HEAD_SIZE', 1024 * 1024))
+BADWOLF_LOG_TAIL_SIZE = int(os.getenv('BADWOLF_LOG_TAIL_SIZE', 10 * 1024 * 1024))
 BADWOLF_REPO_DIR = os.getenv('BADWOLF_REPO_DIR', os.path.join(BADWOLF_DATA_DIR, 'repos'))
 BADWOLF_ARTIFACTS_DIR = os.getenv('BADWOLF_REPO_DIR', os.path.join(BADWOLF_DATA_DIR, 'artifacts'))
 
+# Local bare mirrors of repositories, builds clone from them instead of BitBucket
+BADWOLF_MIRROR_ENABLED = yesish(os.getenv('BADWOLF_MIRROR_ENABLED', True))
+BADWOLF_MIRROR_DIR = os.getenv('BADWOLF_MIRROR_DIR', os.path.join(BADWOLF_DATA_DIR, 'mirrors'))
+BADWOLF_MIRROR_MAX_SIZE = int(os.getenv('BADWOLF_MIRROR_MAX_SIZE', 20 * 1024 * 1024 * 1024))
+# Open pull requests are checked for mergeability concurrently, against mirror when enabled
+BADWOLF_MERGEABLE_WORKERS = int(os.getenv('BADWOLF_MERGEABLE_WORKERS', 4))
+
+# Docker images are tagged by content hash of Dockerfile, copied files and build args,
+# least recently used images are removed when they take more than BADWOLF_IMAGE_CACHE_SIZE bytes
+BADWOLF_IMAGE_CACHE_DIR = os.getenv('BADWOLF_IMAGE_CACHE_DIR', os.path.join(BADWOLF_DATA_DIR, 'images'))
+BADWOLF_IMAGE_CACHE_SIZE = int(os.getenv('BADWOLF_IMAGE_CACHE_SIZE', 50 * 1024 * 1024 * 1024))
+# Directories declared by ``cache`` in spec are kept per repository and branch,
+# least recently used caches are removed when they take more than BADWOLF_BUILD_CACHE_SIZE bytes
+BADWOLF_BUILD_CACHE_DIR = os.getenv('BADWOLF_BUILD_CACHE_DIR', os.path.join(BADWOLF_DATA_DIR, 'build-cache'))
+BADWOLF_BUILD_CACHE_SIZE = int(os.getenv('BADWOLF_BUILD_CACHE_SIZE', 20 * 1024 * 1024 * 1024))
+
+# Task queue
+BADWOLF_QUEUE_DB = os.getenv('BADWOLF_QUEUE_DB', os.path.join(BADWOLF_DATA_DIR, 'queue.sqlite3'))
+BADWOLF_QUEUE_MAX_SIZE = int(os.getenv('BADWOLF_QUEUE_MAX_SIZE', 1000))
+BADWOLF_QUEUE_PUT_TIMEOUT = int(os.getenv('BADWOLF_QUEUE_PUT_TIMEOUT', 10))
+# Defaults to 5 * CPU count
+BADWOLF_WORKERS = int(os.getenv('BADWOLF_WORKERS', 0))
+# Concurrent pipelines limits, 0 means unlimited
+BADWOLF_MAX_PIPELINES = int(os.getenv('BADWOLF_MAX_PIPELINES', 0))
+BADWOLF_MAX_PIPELINES_PER_REPO = int(os.getenv('BADWOLF_MAX_PIPELINES_PER_REPO', 0))
+BADWOLF_MAX_PIPELINES_PER_DOCKER_HOST = int(os.getenv('BADWOLF_MAX_PIPELINES_PER_DOCKER_HOST', 0))
+# Containers a build runs concurrently for environments of its build matrix
+BADWOLF_BUILD_PARALLELISM = int(os.getenv('BADWOLF_BUILD_PARALLELISM', 4))
+# Warm containers kept for every sidecar service, 0 disables pooling.
+# Containers are labeled with BADWOLF_INSTANCE_ID, only stale ones of the same instance are removed,
+# it must be unique among badwolf instances sharing a Docker daemon and stable across restarts
+BADWOLF_INSTANCE_ID = os.getenv('BADWOLF_INSTANCE_ID', socket.gethostname())
+BADWOLF_SERVICE_POOL_SIZE = int(os.getenv('BADWOLF_SERVICE_POOL_SIZE', 1))
+BADWOLF_SERVICE_TIMEOUT = int(os.getenv('BADWOLF_SERVICE_TIMEOUT', 60))
+
+# Code lint, linters run concurrently with subprocess timeout in seconds, 0 means no timeout
+BADWOLF_LINT_WORKERS = int(os.getenv('BADWOLF_LINT_WORKERS', 4))
+BADWOLF_LINT_TIMEOUT = int(os.getenv('BADWOLF_LINT_TIMEOUT', 600))
+# Processes a single linter may split files into, defaults to CPU count
+BADWOLF_LINT_JOBS = int(os.getenv('BADWOLF_LINT_JOBS', 0))
+# Lint results of unchanged files are replayed from cache
+BADWOLF_LINT_CACHE_ENABLED = yesish(os.getenv('BADWOLF_LINT_CACHE_ENABLED', True))
+BADWOLF_LINT_CACHE_DIR = os.getenv('BADWOLF_LINT_CACHE_DIR', os.path.join(BADWOLF_DATA_DIR, 'lint-cache'))
+BADWOLF_LINT_CACHE_SIZE = int(os.getenv('BADWOLF_LINT_CACHE_SIZE', 1024 * 1024 * 1024))
+# Pull request diff is computed from local clone, falls back to Bitbucket API when failed
+BADWOLF_LINT_LOCAL_DIFF = yesish(os.getenv('BADWOLF_LINT_LOCAL_DIFF', True))
+
+# Build statuses are sent to Bitbucket in background, final states are retried
+# and pipelines wait at most BADWOLF_STATUS_TIMEOUT seconds for them when finishing
+BADWOLF_STATUS_WORKERS = int(os.getenv('BADWOLF_STATUS_WORKERS', 4))
+BADWOLF_STATUS_RETRIES = int(os.getenv('BADWOLF_STATUS_RETRIES', 4))
+BADWOLF_STATUS_TIMEOUT = int(os.getenv('BADWOLF_STATUS_TIMEOUT', 60))
+
 # Vault
 VAULT_URL = os.getenv('VAULT_URL', os.getenv('VAULT_ADDR'))
 VAULT_TOKEN = os.getenv('VAULT_TOKEN')
@@ -5,9 +5,9 @@ import logging
 import requests
 from flask import url_for
 
-from badwolf.extensions import bitbucket, sentry
+from badwolf.extensions import bitbucket, sentry, statuses
 from badwolf.utils import run_command
-from badwolf.bitbucket import BitbucketAPIError, BuildStatus
+from badwolf.bitbucket import BuildStatus
 from badwolf.deploy.providers.script import ScriptProvider
 from badwolf.deploy.providers.pypi import PypiProvider
 
@@ -84,11 +84,7 @@ class Deployer(object):
             logger.info('After deploy command `%s` exit code: %s, output: \n %s', script, exit_code, output)
 
     def _update_build_status(self, build_status, state, description=None):
-        try:
-            build_status.update(state, description=description)
-        except BitbucketAPIError:
-            logger.exception('Error calling Bitbucket API')
-            sentry.captureException()
+        statuses.publish(build_status, state, description=description)
 
 
 def trigger_slack_webhook(webhooks, context, provider, succeed):
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import re
+import logging
+import tempfile
+import subprocess
+import collections
+
+
+logger = logging.getLogger(__name__)
+
+RE_HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+RE_DIFF_GIT_HEADER = re.compile(r'^diff --git "?a/(.+?)"? "?b/(.+?)"?$')
+
+
+class ChangedFile(object):
+    """A file changed in diff with its added and context lines indexed by target line number"""
+    def __init__(self, path):
+        self.path = path
+        self.is_added_file = False
+        self.is_removed_file = False
+        self.is_binary_file = False
+        # Not linted, hunks are counted but lines not indexed
+        self.is_excluded = False
+        # target line number -> (is_added, source line number)
+        self.lines = {}
+
+    @property
+    def is_modified_file(self):
+        return not (self.is_added_file or self.is_removed_file)
+
+    def __repr__(self):
+        return '<ChangedFile {}>'.format(self.path)
+
+
+class DiffIndex(object):
+    """Changed files and lines of an unified diff
+
+    Only what linting needs is kept, hunks of removed, binary and excluded files are skipped.
+    """
+    def __init__(self):
+        self._files = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._files)
+
+    def __iter__(self):
+        return iter(self._files.values())
+
+    def __getitem__(self, path):
+        return self._files[path]
+
+    def add_file(self, path):
+        # First diff of a file wins when it appears more than once
+        changed_file = self._files.get(path)
+        if changed_file is None:
+            changed_file = self._files[path] = ChangedFile(path)
+        return changed_file
+
+    def rename_file(self, changed_file, path):
+        del self._files[changed_file.path]
+        changed_file.path = path
+        self._files[path] = changed_file
+        return changed_file
+
+    @property
+    def added_files(self):
+        return [f for f in self if f.is_added_file and not (f.is_binary_file or f.is_excluded)]
+
+    @property
+    def modified_files(self):
+        return [f for f in self if f.is_modified_file and not (f.is_binary_file or f.is_excluded)]
+
+    @property
+    def removed_files(self):
+        return [f for f in self if f.is_removed_file]
+
+    @property
+    def line_index(self):
+        """Index of filename -> target line number -> (is_added, source line number)"""
+        return {f.path: f.lines for f in self}
+
+
+def iter_lines(chunks):
+    """Split text chunks of streaming response into lines, only on ``\\n``"""
+    pending = ''
+    for chunk in chunks:
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def _strip_prefix(path):
+    path = path.rstrip('\r').split('\t')[0].strip('"')
+    if path.startswith(('a/', 'b/')):
+        return path[2:]
+    return path
+
+
+def parse_diff(lines, exclude=None):
+    """Build :class:`DiffIndex` from lines of an unified diff, reading them one at a time
+
+    :param exclude: optional predicate of paths not linted, lines of their hunks are not indexed
+    """
+    index = DiffIndex()
+    changed_file = None
+    source_path = None
+    # Whether hunks of current file have been read
+    has_hunks = False
+    # Lines of current hunk remain to be read
+    source_remain = target_remain = 0
+    source_line_no = target_line_no = 0
+    for line in lines:
+        if source_remain > 0 or target_remain > 0:
+            if line.startswith('\\'):
+                # \ No newline at end of file
+                continue
+            if changed_file is None or changed_file.is_removed_file or changed_file.is_excluded:
+                # Hunks of skipped files are only counted
+                lines_dict = None
+            else:
+                lines_dict = changed_file.lines
+            if line.startswith('+'):
+                if lines_dict is not None:
+                    lines_dict.setdefault(target_line_no, (True, None))
+                target_line_no += 1
+                target_remain -= 1
+            elif line.startswith('-'):
+                source_line_no += 1
+                source_remain -= 1
+            else:
+                # Context line, some tools strip the leading space of empty lines
+                if lines_dict is not None:
+                    lines_dict.setdefault(target_line_no, (False, source_line_no))
+                source_line_no += 1
+                target_line_no += 1
+                source_remain -= 1
+                target_remain -= 1
+            continue
+
+        if line.startswith('diff --git '):
+            match = RE_DIFF_GIT_HEADER.match(line.rstrip('\r'))
+            changed_file = index.add_file(match.group(2)) if match else None
+            source_path = None
+            has_hunks = False
+            continue
+        if line.startswith('--- '):
+            if has_hunks:
+                # Plain unified diff without ``diff --git`` header, a new file starts
+                changed_file = None
+                has_hunks = False
+            source_path = _strip_prefix(line[4:])
+            continue
+        if line.startswith('+++ '):
+            target_path = _strip_prefix(line[4:])
+            if target_path == '/dev/null':
+                changed_file = index.add_file(source_path)
+                changed_file.is_removed_file = True
+            else:
+                if changed_file is None:
+                    changed_file = index.add_file(target_path)
+                elif changed_file.path != target_path:
+                    # Path in ``diff --git`` header is ambiguous when it contains spaces
+                    changed_file = index.rename_file(changed_file, target_path)
+                if source_path == '/dev/null':
+                    changed_file.is_added_file = True
+            continue
+        if changed_file is None:
+            continue
+
+        if line.startswith('new file mode'):
+            changed_file.is_added_file = True
+        elif line.startswith('deleted file mode'):
+            changed_file.is_removed_file = True
+        elif line.startswith(('Binary files ', 'GIT binary patch')):
+            changed_file.is_binary_file = True
+        elif line.startswith('@@ '):
+            match = RE_HUNK_HEADER.match(line)
+            if not match:
+                logger.warning('Invalid hunk header in diff of %s: %s', changed_file.path, line)
+                continue
+            if not has_hunks and exclude is not None:
+                changed_file.is_excluded = bool(exclude(changed_file.path))
+            has_hunks = True
+            source_line_no = int(match.group(1))
+            source_remain = int(match.group(2) or 1)
+            target_line_no = int(match.group(3))
+            target_remain = int(match.group(4) or 1)
+    return index
+
+
+def _iter_process_lines(process):
+    for line in process.stdout:
+        yield line.decode('utf-8', 'replace').rstrip('\n')
+
+
+def git_diff(repo_path, base, head, timeout=None, exclude=None):
+    """Build :class:`DiffIndex` from ``git diff base...head`` of local repository,
+    same as the pull request diff of Bitbucket
+
+    Raises :class:`subprocess.CalledProcessError` when git failed, e.g. commits not found in a shallow clone.
+    """
+    command = [
+        'git', '-c', 'core.quotepath=false', 'diff', '--no-color', '--no-ext-diff',
+        '{}...{}'.format(base, head),
+    ]
+    # stderr goes to a file so that git never blocks on it while diff is being read
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            command,
+            cwd=repo_path,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+        )
+        try:
+            index = parse_diff(_iter_process_lines(process), exclude=exclude)
+            process.communicate(timeout=timeout)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr.read())
+    return index
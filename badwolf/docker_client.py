@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import time
+import logging
+import threading
+import multiprocessing
+
+from docker import DockerClient
+from docker.errors import DockerException
+from requests.exceptions import RequestException
+
+
+logger = logging.getLogger(__name__)
+
+
+class FlaskDocker(object):
+    '''Process wide Docker client
+
+    The Docker API version is negotiated only once and the client, with its
+    connection pool, is shared by builders, log views and webhooks. The
+    connection is health checked periodically and replaced when it's broken.
+    '''
+    def __init__(self, app=None):
+        self.app = app
+        self._client = None
+        self._negotiated_version = None
+        self._last_checked = 0
+        self._checking = False
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.base_url = app.config['DOCKER_HOST']
+        self.timeout = app.config['DOCKER_API_TIMEOUT']
+        self.version = app.config['DOCKER_API_VERSION']
+        self.max_pool_size = (
+            app.config['DOCKER_MAX_POOL_SIZE'] or
+            app.config['BADWOLF_WORKERS'] or
+            5 * multiprocessing.cpu_count()
+        )
+        self.health_check_interval = app.config['DOCKER_HEALTH_INTERVAL']
+        self.ping_timeout = app.config['DOCKER_PING_TIMEOUT']
+        self.close()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._create_client()
+                self._last_checked = time.time()
+                return self._client
+            client = self._client
+            check = not self._checking and time.time() - self._last_checked >= self.health_check_interval
+            if not check:
+                return client
+            # Only one thread checks, others keep using current client meanwhile
+            self._checking = True
+
+        new_client = None
+        try:
+            if not self._is_healthy():
+                logger.warning('Docker client for %s is unhealthy, reconnecting', self.base_url)
+                # Docker daemon may have been upgraded
+                self._negotiated_version = None
+                new_client = self._create_client()
+        except (DockerException, RequestException):
+            logger.exception('Error reconnecting to Docker daemon %s', self.base_url)
+        finally:
+            with self._lock:
+                self._checking = False
+                self._last_checked = time.time()
+                if new_client is not None:
+                    # The old client is not closed, other threads may still be streaming
+                    # logs from it. Its connections are released once it's unreferenced
+                    self._client = new_client
+                client = self._client
+        return client
+
+    @property
+    def api_version(self):
+        if self.version != 'auto':
+            return self.version
+        if self._negotiated_version is None:
+            probe = DockerClient(base_url=self.base_url, timeout=self.ping_timeout, version='auto')
+            try:
+                self._negotiated_version = probe.api.api_version
+            finally:
+                probe.close()
+            logger.info('Negotiated Docker API version %s with %s', self._negotiated_version, self.base_url)
+        return self._negotiated_version
+
+    def _create_client(self):
+        return DockerClient(
+            base_url=self.base_url,
+            timeout=self.timeout,
+            version=self.api_version,
+            max_pool_size=self.max_pool_size,
+        )
+
+    def _is_healthy(self):
+        # Pinged by a separate client with short timeout, a hung daemon doesn't
+        # block for DOCKER_API_TIMEOUT seconds
+        probe = DockerClient(base_url=self.base_url, timeout=self.ping_timeout, version=self.api_version)
+        try:
+            probe.ping()
+        except (DockerException, RequestException):
+            logger.exception('Error pinging Docker daemon %s', self.base_url)
+            return False
+        finally:
+            probe.close()
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                try:
+                    self._client.close()
+                except Exception:
+                    logger.exception('Error closing Docker client')
+                self._client = None
+
+    @property
+    def api(self):
+        return self.client.api
+
+    @property
+    def containers(self):
+        return self.client.containers
+
+    @property
+    def images(self):
+        return self.client.images
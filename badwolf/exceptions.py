@@ -15,3 +15,11 @@ class BuildDisabled(BadwolfException):
 
 class InvalidSpecification(BadwolfException):
     pass
+
+
+class QueueFull(BadwolfException):
+    pass
+
+
+class PipelineCancelled(BadwolfException):
+    pass
@@ -3,6 +3,11 @@ from raven.contrib.flask import Sentry
 from flask_mail import Mail
 
 from badwolf.bitbucket import FlaskBitbucket
+from badwolf.docker_client import FlaskDocker
+from badwolf.taskqueue import TaskQueue
+from badwolf.registry import PipelineRegistry
+from badwolf.status import BuildStatusPublisher
+from badwolf.services import ServicePool
 
 
 # Sentry
@@ -13,3 +18,18 @@ mail = Mail()
 
 # Bitbucket API
 bitbucket = FlaskBitbucket()
+
+# Docker API
+docker = FlaskDocker()
+
+# Persistent task queue
+queue = TaskQueue()
+
+# Queued and running pipelines
+registry = PipelineRegistry()
+
+# Background build status updates
+statuses = BuildStatusPublisher()
+
+# Sidecar service containers of builds
+services = ServicePool(docker)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import glob
+import time
+import shlex
+import hashlib
+import logging
+
+from docker.errors import APIError, ImageNotFound
+
+
+logger = logging.getLogger(__name__)
+
+# Label of images built by badwolf, only they are garbage collected
+IMAGE_LABEL = 'badwolf.image-cache'
+_CONTEXT_EXCLUDES = frozenset(['.git'])
+
+
+def _dockerfile_instructions(content):
+    """Yield (instruction, arguments) of Dockerfile, continuation lines joined"""
+    current = ''
+    for line in content.splitlines():
+        stripped = line.strip()
+        if not current and (not stripped or stripped.startswith('#')):
+            continue
+        if stripped.endswith('\\'):
+            current += stripped[:-1] + ' '
+            continue
+        current += stripped
+        parts = current.split(None, 1)
+        current = ''
+        if parts:
+            yield parts[0].upper(), parts[1] if len(parts) > 1 else ''
+
+
+def _copy_sources(arguments):
+    """Sources in build context of ``COPY``/``ADD`` arguments, ``None`` if unknown"""
+    arguments = arguments.strip()
+    if arguments.startswith('['):
+        try:
+            args = json.loads(arguments)
+        except ValueError:
+            return None
+    else:
+        try:
+            args = shlex.split(arguments)
+        except ValueError:
+            return None
+    flags = [arg for arg in args if arg.startswith('--')]
+    if any(flag.startswith('--from') for flag in flags):
+        # Copied from other build stage or image, not from build context
+        return []
+    args = [arg for arg in args if not arg.startswith('--')]
+    sources = []
+    for source in args[:-1]:
+        if '://' in source or source.startswith('git@'):
+            continue
+        if '$' in source:
+            return None
+        sources.append(source)
+    return sources
+
+
+def _iter_context_files(context_path, source):
+    pattern = os.path.join(context_path, source.lstrip('/'))
+    for path in sorted(glob.glob(pattern)):
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if d not in _CONTEXT_EXCLUDES)
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif os.path.isfile(path):
+            yield path
+
+
+def _hash_file(sha, context_path, path):
+    sha.update(os.path.relpath(path, context_path).encode('utf-8', 'surrogateescape'))
+    sha.update(b'\0')
+    if os.path.islink(path):
+        sha.update(os.readlink(path).encode('utf-8', 'surrogateescape'))
+        return
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha.update(chunk)
+    sha.update(b'\0')
+
+
+def _declared_args(dockerfile_content):
+    """Names of build args declared by ``ARG`` in Dockerfile"""
+    names = set()
+    for instruction, arguments in _dockerfile_instructions(dockerfile_content):
+        if instruction == 'ARG':
+            names.update(arg.split('=', 1)[0] for arg in arguments.split())
+    return names
+
+
+def image_content_hash(context_path, dockerfile_content, build_args=None):
+    """Hash of everything a Docker image build depends on
+
+    Includes Dockerfile, build args declared by ``ARG``, ``.dockerignore`` and files
+    copied from build context by ``COPY``/``ADD``. The whole build context is hashed
+    when sources can't be resolved, for example paths referencing build args.
+    Other build args don't affect the image, per build values like commit hash among
+    them must not prevent reusing it.
+    """
+    declared = _declared_args(dockerfile_content)
+    build_args = {name: value for name, value in (build_args or {}).items() if name in declared}
+    sha = hashlib.sha256()
+    sha.update(dockerfile_content.encode('utf-8'))
+    sha.update(json.dumps(build_args, sort_keys=True).encode('utf-8'))
+    dockerignore = os.path.join(context_path, '.dockerignore')
+    if os.path.isfile(dockerignore):
+        _hash_file(sha, context_path, dockerignore)
+
+    sources = []
+    for instruction, arguments in _dockerfile_instructions(dockerfile_content):
+        if instruction not in ('COPY', 'ADD'):
+            continue
+        copy_sources = _copy_sources(arguments)
+        if copy_sources is None:
+            sources = ['.']
+            break
+        sources.extend(copy_sources)
+
+    for source in sorted(set(sources)):
+        for path in _iter_context_files(context_path, source):
+            _hash_file(sha, context_path, path)
+    return sha.hexdigest()
+
+
+class ImageCache(object):
+    '''Docker images of repositories tagged by content hash of their builds
+
+    Images are reused by all branches and pull requests building the same content.
+    Last used time of an image is recorded by a marker file under ``path``, least
+    recently used images are removed once they take more than ``max_size`` bytes.
+    '''
+    def __init__(self, client, path, max_size=0):
+        self.client = client
+        self.path = path
+        self.max_size = max_size
+
+    def __repr__(self):
+        return '<ImageCache {}>'.format(self.path)
+
+    def _marker_path(self, tag):
+        return os.path.join(self.path, tag.replace('/', '-').replace(':', '@'))
+
+    def touch(self, tag):
+        '''Mark image ``tag`` as used now'''
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._marker_path(tag), 'a'):
+                pass
+            os.utime(self._marker_path(tag), None)
+        except OSError:
+            logger.exception('Error marking Docker image %s as used', tag)
+
+    def last_used(self, tag):
+        try:
+            return os.stat(self._marker_path(tag)).st_mtime
+        except OSError:
+            return 0
+
+    def gc(self, keep=None):
+        '''Remove least recently used images until total size is below ``max_size`` bytes,
+        images used by containers are kept. Returns tags removed'''
+        if self.max_size <= 0:
+            return []
+
+        # Size of an image includes layers shared with other images, only the
+        # unique part is freed by removing it. Shared layers are counted once,
+        # as much as the image sharing most of them, which is an approximation.
+        usage = {image['Id']: image for image in self.client.df().get('Images') or []}
+        images = []
+        total = 0
+        shared_total = 0
+        for image in self.client.images.list(filters={'label': IMAGE_LABEL}):
+            info = usage.get(image.id, {})
+            shared = max(0, info.get('SharedSize') or 0)
+            size = max(0, info.get('Size', image.attrs.get('Size', 0)) - shared)
+            total += size
+            shared_total = max(shared_total, shared)
+            for tag in image.tags:
+                images.append((self.last_used(tag), tag, size, image.id))
+        total += shared_total
+        if total <= self.max_size:
+            return []
+
+        start = time.time()
+        removed = []
+        removed_ids = set()
+        for _, tag, size, image_id in sorted(images):
+            if total <= self.max_size:
+                break
+            if tag == keep:
+                continue
+            try:
+                self.client.images.remove(tag)
+            except ImageNotFound:
+                pass
+            except APIError as e:
+                logger.info('Docker image %s is not removable: %s', tag, e)
+                continue
+            removed.append(tag)
+            try:
+                os.remove(self._marker_path(tag))
+            except OSError:
+                pass
+            if image_id not in removed_ids:
+                # Layers are freed only after all tags of the image are removed
+                removed_ids.add(image_id)
+                total -= size
+        logger.info('Removed %d Docker image(s) in %.2f seconds, %d bytes in use',
+                    len(removed), time.time() - start, total)
+        return removed
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import threading
+
+from badwolf.diff import DiffIndex
 
 
 class Problem(object):
@@ -30,46 +33,59 @@ class Problems(object):
     REPORT_CHANGES_RANGE = 3
 
     def __init__(self):
-        self._items = set()
+        # Ordered set, problems are reported in the order linters found them
+        self._items = {}
         self._changes = None
+        self._line_index = {}
+        self._lock = threading.Lock()
 
     def add(self, problem):
-        self._items.add(problem)
+        # Linters run concurrently and add problems from different threads
+        with self._lock:
+            self._items[problem] = None
 
     def set_changes(self, changes):
         self._changes = changes
+        self._line_index = self._build_line_index(changes)
 
-    def limit_to_changes(self):
-        changes = self._changes
+    @staticmethod
+    def _build_line_index(changes):
+        """Index of filename -> target line number -> (is_added, source line number)"""
+        index = {}
         if not changes:
+            return index
+        if isinstance(changes, DiffIndex):
+            return changes.line_index
+
+        for patched_file in changes:
+            lines = index.setdefault(patched_file.path, {})
+            for hunk in patched_file:
+                if not hunk.is_valid():
+                    continue
+
+                for line in hunk.target_lines():
+                    # First line wins when a file appears more than once in diff
+                    lines.setdefault(line.target_line_no, (line.is_added, line.source_line_no))
+        return index
+
+    def limit_to_changes(self):
+        if not self._changes:
             return
 
         def should_keep(item):
-            keep = False
-            for patched_file in changes:
-                if patched_file.path != item.filename:
-                    continue
+            # Only problems right on the added or context lines of diff are kept,
+            # they are always within REPORT_CHANGES_RANGE
+            change = self._line_index.get(item.filename, {}).get(item.line)
+            if change is None:
+                return False
+
+            is_added, source_line_no = change
+            item.has_line_change = is_added
+            if not is_added:
+                item.line = source_line_no
+            return True
 
-                for hunk in patched_file:
-                    if not hunk.is_valid():
-                        continue
-
-                    for line in hunk.target_lines():
-                        if abs(item.line - line.target_line_no) <= self.REPORT_CHANGES_RANGE:
-                            if item.line == line.target_line_no:
-                                item.has_line_change = line.is_added
-                                if line.is_context:
-                                    item.line = line.source_line_no
-                                keep = True
-                            if keep:
-                                break
-                    if keep:
-                        break
-                if keep:
-                    break
-            return keep
-
-        self._items = [item for item in self._items if should_keep(item)]
+        self._items = dict.fromkeys(item for item in self._items if should_keep(item))
 
     def __len__(self):
         return len(self._items)
@@ -78,5 +94,5 @@ class Problems(object):
         for item in self._items:
             yield item
 
-    def __getitem__(self, key):
-        return self._items[key]
+    def __getitem__(self, index):
+        return list(self._items)[index]
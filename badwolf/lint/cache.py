@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+
+
+logger = logging.getLogger(__name__)
+
+
+def blob_hash(path):
+    """Git blob SHA of file at ``path``, same as ``git hash-object``"""
+    with open(path, 'rb') as f:
+        content = f.read()
+    sha = hashlib.sha1(b'blob ' + str(len(content)).encode('ascii') + b'\0')  # nosec
+    sha.update(content)
+    return sha.hexdigest()
+
+
+class LintCache(object):
+    '''Content addressed cache of lint results stored on local disk
+
+    Results of a file are keyed by linter name, version, options and configuration
+    files together with the git blob SHA of the file, so they can be replayed for
+    files unchanged since the previous run. Least recently used results are evicted
+    once the cache grows beyond ``max_size`` bytes.
+    '''
+    def __init__(self, path, max_size=1024 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+
+    def __repr__(self):
+        return '<LintCache {}>'.format(self.path)
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], '{}.json'.format(key))
+
+    def get(self, key):
+        '''Cached results of ``key``, ``None`` when not cached'''
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                results = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.exception('Error reading lint cache entry %s', key)
+            return None
+
+        try:
+            # Used as last access time for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return results
+
+    def set(self, key, results):
+        path = self._entry_path(key)
+        dirname = os.path.dirname(path)
+        try:
+            os.makedirs(dirname, exist_ok=True)
+            # Write to temporary file then rename, concurrent readers never see partial entries
+            fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(results, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception('Error writing lint cache entry %s', key)
+
+    def evict(self):
+        '''Remove least recently used entries until total size is below ``max_size`` bytes'''
+        if self.max_size <= 0:
+            return 0
+
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_size:
+            return 0
+
+        start = time.time()
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        logger.info('Evicted %d lint cache entries in %.2f seconds, %d bytes in use',
+                    removed, time.time() - start, total)
+        return removed
@@ -2,21 +2,100 @@
 import os
 import re
 import sys
+import time
 import logging
 import fnmatch
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from badwolf.utils import run_command
+from badwolf.lint import Problem
+from badwolf.lint.cache import LintCache, blob_hash
+from badwolf.lint.utils import split_argv, npm_exists
 
 
 logger = logging.getLogger(__name__)
 
 
+# Seconds tool versions are cached, so upgraded tools are noticed without restart
+TOOL_VERSION_TTL = 300
+_tool_versions = {}
+
+
+def _get_tool_version(command):
+    now = time.time()
+    cached = _tool_versions.get(command)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    try:
+        exit_code, output = run_command(list(command), include_errors=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        logger.exception('Error getting version by %s', command)
+        exit_code, output = None, ''
+    version = output.strip() if exit_code == 0 else None
+    _tool_versions[command] = (now + TOOL_VERSION_TTL, version)
+    return version
+
+
+def match_pattern(pattern, filename):
+    """Whether ``filename`` matches linter pattern of globs or a regular expression,
+    empty pattern matches everything"""
+    if not pattern:
+        return True
+
+    globs = pattern.split()
+    for glob in globs:
+        if fnmatch.fnmatch(filename, glob):
+            # 先尝试 glob 匹配
+            return True
+    try:
+        if re.match(pattern, filename, re.I):
+            # 否则尝试正则表达式匹配
+            return True
+    except re.error:
+        pass
+    return False
+
+
 class Linter(object):
     name = ''
     default_pattern = ''
+    # Whether files can be linted in separate processes concurrently,
+    # linters checking the whole program like mypy must not be sharded
+    shardable = False
+    # Minimum number of files per shard
+    min_shard_size = 20
+    # Whether problems of a file only depend on the file itself and configuration,
+    # so they can be cached by the content of the file
+    cacheable = False
+    # Configuration files affecting lint results, relative to working directory
+    config_files = ()
+    # Whether config files are also looked up in every directory containing linted files,
+    # e.g. cascading configuration of eslint
+    nested_config = False
+    # Executable name of the linter, defaults to linter name
+    executable = None
+    # Exit statuses of a linter run which completed and reported all problems found,
+    # results are only cached when every run exits with one of them
+    success_exit_codes = (0, 1)
 
-    def __init__(self, working_dir, problems, options=None):
+    def __init__(self, working_dir, problems, options=None, timeout=None, jobs=1, cache=None):
         self.working_dir = working_dir
         self.problems = problems
         self.options = options or {}
+        self.cache = cache
+        # Maximum number of shards run concurrently
+        self.jobs = max(1, jobs)
+        # Seconds the linter is allowed to run in total across all its batches,
+        # can be overridden per linter in spec
+        self.timeout = self.options.get('timeout') or timeout
+        self._deadline = None
+        # Wall time of last execution in seconds
+        self.elapsed = None
+        # Whether results of current execution can be cached
+        self._results_cacheable = True
 
     def is_usable(self):
         """Whether this linter should be usable or not"""
@@ -25,22 +104,7 @@ class Linter(object):
     def match_file(self, filename):
         """Used to check if files can be handled by this linter,
         Often this will just file extension checks."""
-        pattern = self.options.get('pattern') or self.default_pattern
-        if not pattern:
-            return True
-
-        globs = pattern.split()
-        for glob in globs:
-            if fnmatch.fnmatch(filename, glob):
-                # 先尝试 glob 匹配
-                return True
-        try:
-            if re.match(pattern, filename, re.I):
-                # 否则尝试正则表达式匹配
-                return True
-        except re.error:
-            pass
-        return False
+        return match_pattern(self.options.get('pattern') or self.default_pattern, filename)
 
     def lint_files(self, files):
         """Lint all matched files, should yield all problems found"""
@@ -53,9 +117,152 @@ class Linter(object):
             logger.info('No matched files found for linter %s', self.name)
             return
 
-        logger.info('Running linter %s against %d files', self.name, len(matched_files))
-        for problem in self.lint_files(matched_files):
-            self.problems.add(problem)
+        start_time = time.time()
+        self._deadline = start_time + self.timeout if self.timeout else None
+        self._results_cacheable = True
+        cache_keys = {}
+        if self.cache is not None and self.cacheable:
+            cache_keys = self._cache_keys(matched_files)
+            matched_files = self._replay_cached(matched_files, cache_keys)
+            if not matched_files:
+                self.elapsed = time.time() - start_time
+                logger.info('All lint results of linter %s are cached', self.name)
+                return
+
+        batches = self.split_files(matched_files)
+        logger.info(
+            'Running linter %s against %d files in %d batches',
+            self.name,
+            len(matched_files),
+            len(batches)
+        )
+        try:
+            if len(batches) == 1:
+                problems = list(self.lint_files(batches[0]))
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.jobs, len(batches))) as executor:
+                    results = executor.map(lambda batch: list(self.lint_files(batch)), batches)
+                    # Merged in batch order regardless of which shard finishes first
+                    problems = list(itertools.chain.from_iterable(results))
+            for problem in problems:
+                self.problems.add(problem)
+        finally:
+            self.elapsed = time.time() - start_time
+
+        if cache_keys and self._results_cacheable:
+            self._save_cached(matched_files, cache_keys, problems)
+
+    def run_command(self, command, **kwargs):
+        """Run linter command in working directory, results are not cached when it
+        exits with unknown status or fails without any output, e.g. it crashed"""
+        kwargs.setdefault('cwd', self.working_dir)
+        kwargs.setdefault('timeout', self.remaining_time())
+        exit_code, output = run_command(command, **kwargs)
+        if exit_code not in self.success_exit_codes:
+            self.mark_uncacheable('exit code {}'.format(exit_code))
+        elif exit_code != 0 and not output:
+            self.mark_uncacheable('exit code {} without output'.format(exit_code))
+        return exit_code, output
+
+    def remaining_time(self):
+        """Seconds left before the deadline of current execution, ``None`` if unlimited
+
+        :raises subprocess.TimeoutExpired: when the deadline has passed
+        """
+        if self._deadline is None:
+            return self.timeout
+        remaining = self._deadline - time.time()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(self.name, self.timeout)
+        return remaining
+
+    def mark_uncacheable(self, reason):
+        """Results of current execution are not trustworthy, don't cache them"""
+        if self._results_cacheable and self.cacheable:
+            logger.warning('Lint results of linter %s are not cached: %s', self.name, reason)
+        self._results_cacheable = False
+
+    def get_version(self):
+        """Version of the linter, ``None`` if unknown"""
+        executable = self.executable or self.name
+        if npm_exists(executable, self.working_dir):
+            executable = os.path.join(self.working_dir, 'node_modules', '.bin', executable)
+        return _get_tool_version((executable, '--version'))
+
+    def _cache_keys(self, files):
+        version = self.get_version()
+        if not version:
+            return {}
+
+        config_hashes = {}
+        for config_file in self.config_files:
+            path = os.path.join(self.working_dir, config_file)
+            if os.path.isfile(path):
+                config_hashes[config_file] = blob_hash(path)
+        options = {key: value for key, value in self.options.items() if key != 'timeout'}
+        prefix = LintCache.make_key(self.name, version, options, config_hashes)
+
+        keys = {}
+        dir_hashes = {}
+        for filename in files:
+            try:
+                # Configuration may apply per path, e.g. per-file-ignores of flake8
+                keys[filename] = LintCache.make_key(
+                    prefix,
+                    filename,
+                    blob_hash(os.path.join(self.working_dir, filename)),
+                    self._nested_config_hashes(os.path.dirname(filename), dir_hashes)
+                )
+            except OSError:
+                continue
+        return keys
+
+    def _nested_config_hashes(self, dirname, dir_hashes):
+        """Hashes of config files in ``dirname`` and its parents below working directory"""
+        if not self.nested_config or not dirname:
+            return {}
+        if dirname not in dir_hashes:
+            hashes = dict(self._nested_config_hashes(os.path.dirname(dirname), dir_hashes))
+            for config_file in self.config_files:
+                path = os.path.join(self.working_dir, dirname, config_file)
+                if os.path.isfile(path):
+                    hashes[os.path.join(dirname, config_file)] = blob_hash(path)
+            dir_hashes[dirname] = hashes
+        return dir_hashes[dirname]
+
+    def _replay_cached(self, files, cache_keys):
+        """Add cached problems, returns files still need to be linted"""
+        uncached_files = []
+        for filename in files:
+            results = self.cache.get(cache_keys[filename]) if filename in cache_keys else None
+            if results is None:
+                uncached_files.append(filename)
+                continue
+            for line, message, is_error in results:
+                self.problems.add(Problem(filename, line, message, self.name, is_error))
+        logger.info('Replayed lint results of %d files from cache for linter %s',
+                    len(files) - len(uncached_files), self.name)
+        return uncached_files
+
+    def _save_cached(self, files, cache_keys, problems):
+        results = {filename: [] for filename in files if filename in cache_keys}
+        for problem in problems:
+            if problem.filename in results:
+                results[problem.filename].append([problem.line, problem.message, problem.is_error])
+        for filename, file_results in results.items():
+            self.cache.set(cache_keys[filename], file_results)
+
+    def split_files(self, files):
+        """Split files into shards for shardable linters, then into batches
+        fit in command line length limit"""
+        shards = 1
+        if self.shardable:
+            shards = max(1, min(self.jobs, len(files) // self.min_shard_size))
+        shard_size = -(-len(files) // shards)
+        batches = []
+        for index in range(0, len(files), shard_size):
+            batches.extend(split_argv(files[index:index + shard_size]))
+        return batches
 
     def __repr__(self):
         return '<{} linter>'.format(self.name)
@@ -78,3 +285,6 @@ class PythonLinter(Linter):
         current_python = '{}.{}'.format(sys.version_info.major, sys.version_info.minor)
         python_version = self.options.get('python_version', current_python)
         return 'python{}'.format(python_version)
+
+    def get_version(self):
+        return _get_tool_version((self.python_name, '-m', self.executable or self.name, '--version'))
@@ -4,7 +4,6 @@ import io
 import csv
 import logging
 
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import Linter
 from badwolf.lint.utils import in_path
@@ -15,7 +14,10 @@ logger = logging.getLogger(__name__)
 
 class BanditLinter(Linter):
     name = 'bandit'
+    shardable = True
     default_pattern = '*.py'
+    cacheable = True
+    config_files = ('.bandit',)
 
     def is_usable(self):
         return in_path('bandit')
@@ -26,9 +28,9 @@ class BanditLinter(Linter):
         if os.path.exists(ini_conf):
             command.extend(['--ini', '.bandit'])
         command += files
-        _, output = run_command(command, cwd=self.working_dir)
+        _, output = self.run_command(command)
         if not output:
-            raise StopIteration()
+            return
 
         reader = csv.DictReader(io.StringIO(output))
         for row in reader:
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
 
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import Linter
 from badwolf.lint.utils import in_path, npm_exists, parse_checkstyle
@@ -9,7 +8,10 @@ from badwolf.lint.utils import in_path, npm_exists, parse_checkstyle
 
 class CSSLinter(Linter):
     name = 'csslint'
+    shardable = True
     default_pattern = '*.css'
+    cacheable = True
+    config_files = ('.csslintrc',)
 
     def is_usable(self):
         return in_path('csslint') or npm_exists('csslint', self.working_dir)
@@ -22,9 +24,9 @@ class CSSLinter(Linter):
 
     def lint_files(self, files):
         command = self.create_command(files)
-        _, output = run_command(command, cwd=self.working_dir)
+        _, output = self.run_command(command)
         if not output:
-            raise StopIteration()
+            return
 
         problems = parse_checkstyle(output)
         for filename, line, message in problems:
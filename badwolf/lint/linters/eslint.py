@@ -7,7 +7,6 @@ except ImportError:
     def is_likely_minified(_path):
         return False
 
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import Linter
 from badwolf.lint.utils import in_path, npm_exists, parse_checkstyle
@@ -15,7 +14,19 @@ from badwolf.lint.utils import in_path, npm_exists, parse_checkstyle
 
 class ESLinter(Linter):
     name = 'eslint'
+    shardable = True
     default_pattern = '*.js'
+    cacheable = True
+    config_files = (
+        '.eslintrc',
+        '.eslintrc.js',
+        '.eslintrc.json',
+        '.eslintrc.yml',
+        '.eslintrc.yaml',
+        '.eslintignore',
+        'package.json',
+    )
+    nested_config = True
 
     def is_usable(self):
         return in_path('eslint') or npm_exists('eslint', self.working_dir)
@@ -30,9 +41,9 @@ class ESLinter(Linter):
 
     def lint_files(self, files):
         command = self.create_command(files)
-        _, output = run_command(command, cwd=self.working_dir)
+        _, output = self.run_command(command)
         if not output:
-            raise StopIteration()
+            return
 
         problems = parse_checkstyle(output)
         for filename, line, message in problems:
@@ -3,7 +3,6 @@ import os
 import logging
 import configparser
 
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import PythonLinter
 from badwolf.lint.utils import in_path
@@ -14,6 +13,9 @@ logger = logging.getLogger(__name__)
 
 class Flake8Linter(PythonLinter):
     name = 'flake8'
+    shardable = True
+    cacheable = True
+    config_files = ('setup.cfg', 'tox.ini', '.flake8')
 
     def is_usable(self):
         return in_path('flake8')
@@ -31,9 +33,9 @@ class Flake8Linter(PythonLinter):
             '*.py*'
         ]
         command += files
-        _, output = run_command(command, split=True, cwd=self.working_dir)
+        _, output = self.run_command(command, split=True)
         if not output:
-            raise StopIteration()
+            return
 
         for line in output:
             filename, line, message = self._parse_line(line)
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
 
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import Linter
 from badwolf.lint.utils import in_path
@@ -10,33 +9,36 @@ from badwolf.lint.utils import in_path
 class HadoLinter(Linter):
     name = 'hadolint'
     default_pattern = '*Dockerfile*'
+    cacheable = True
+    config_files = ('.hadolint.yaml', '.hadolint.yml')
+    shardable = True
 
     def is_usable(self):
         return in_path('hadolint')
 
     def lint_files(self, files):
-        for file in files:
-            command = ['hadolint', file]
-            _, output = run_command(
-                command,
-                split=True,
-                include_errors=True,
-                cwd=self.working_dir,
-                env={
-                    'HOME': os.getenv('HOME', '/'),
-                    'XDG_CONFIG_HOME': os.getenv('XDG_CONFIG_HOME', '/')
-                }
-            )
-            if not output:
-                continue
+        command = ['hadolint']
+        command += files
+        _, output = self.run_command(
+            command,
+            split=True,
+            include_errors=True,
+            env={
+                'HOME': os.getenv('HOME', '/'),
+                'XDG_CONFIG_HOME': os.getenv('XDG_CONFIG_HOME', '/')
+            }
+        )
+        if not output:
+            return
 
-            for line in output:
-                parsed = self._parse_line(line)
-                if not parsed:
-                    continue
+        for line in output:
+            parsed = self._parse_line(line)
+            if not parsed:
+                self.mark_uncacheable('unparseable output {!r}'.format(line))
+                continue
 
-                filename, line, message = parsed
-                yield Problem(filename, line, message, self.name)
+            filename, line, message = parsed
+            yield Problem(filename, line, message, self.name)
 
     def _parse_line(self, line):
         parts = line.split(' ', 1)
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import json
+from concurrent.futures import ThreadPoolExecutor
 
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import Linter
 from badwolf.lint.utils import in_path, npm_exists
@@ -11,27 +12,71 @@ from badwolf.lint.utils import in_path, npm_exists
 _LINE_RE = re.compile(r'^(.+)?: line (\d+), col \d+, (.+)$', re.I)
 
 
+def _reject_constant(name):
+    raise ValueError('Invalid JSON constant {}'.format(name))
+
+
 class JSONLinter(Linter):
     name = 'jsonlint'
     default_pattern = '*.json'
+    cacheable = True
 
     def is_usable(self):
+        # JSON is validated in process without jsonlint only when asked to
+        return self.has_jsonlint() or bool(self.options.get('builtin'))
+
+    def has_jsonlint(self):
         return in_path('jsonlint') or npm_exists('jsonlint', self.working_dir)
 
+    def get_version(self):
+        if not self.has_jsonlint():
+            return 'builtin'
+        return super(JSONLinter, self).get_version()
+
     def lint_files(self, files):
-        for file in files:
-            command = self.create_command(file)
-            _, output = run_command(command, split=True, include_errors=True, cwd=self.working_dir)
-            if not output:
+        if not self.has_jsonlint():
+            for file in files:
+                yield from self._lint_file_in_process(file)
+            return
+
+        # jsonlint only accepts one file per invocation, run them concurrently
+        with ThreadPoolExecutor(max_workers=min(self.jobs, len(files))) as executor:
+            for problems in executor.map(self._lint_file, files):
+                yield from problems
+
+    def _lint_file(self, file):
+        command = self.create_command(file)
+        _, output = self.run_command(
+            command,
+            split=True,
+            include_errors=True
+        )
+        if not output:
+            return []
+
+        problems = []
+        for line in output:
+            parsed = self._parse_line(line)
+            if not parsed:
+                self.mark_uncacheable('unparseable output {!r}'.format(line))
                 continue
 
-            for line in output:
-                parsed = self._parse_line(line)
-                if not parsed:
-                    continue
+            filename, line, message = parsed
+            problems.append(Problem(filename, line, message, self.name))
+        return problems
 
-                filename, line, message = parsed
-                yield Problem(filename, line, message, self.name)
+    def _lint_file_in_process(self, file):
+        try:
+            with open(os.path.join(self.working_dir, file), 'r', encoding='utf-8') as f:
+                content = f.read()
+            json.loads(content, parse_constant=_reject_constant)
+        except json.JSONDecodeError as e:
+            # Like jsonlint, report the line where the last valid token ends
+            end = len(content[:e.pos].rstrip())
+            line = content.count('\n', 0, end) + 1
+            yield Problem(file, line, '{}: line {} column {}'.format(e.msg, e.lineno, e.colno), self.name)
+        except ValueError as e:
+            yield Problem(file, 1, str(e), self.name)
 
     def create_command(self, file):
         cmd = 'jsonlint'
@@ -37,14 +37,21 @@ class MypyLinter(PythonLinter):
         if not self._is_ignore_missing_imports_configured():
             command.append('--ignore-missing-imports')
         command += files
-        _, output = run_command(command, split=True, include_errors=True, cwd=self.working_dir)
+        _, output = run_command(
+            command,
+            split=True,
+            include_errors=True,
+            cwd=self.working_dir,
+            timeout=self.remaining_time()
+        )
         if not output:
-            raise StopIteration()
+            return
 
         for line in output:
             try:
                 filename, line, level, message = self._parse_line(line)
-            except ValueError:
+            except (ValueError, IndexError):
+                # Summary lines like 'Found 1 error in 1 file'
                 continue
             if level == 'note':
                 continue
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import logging
 
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import PythonLinter
 from badwolf.lint.utils import in_path
@@ -12,6 +11,9 @@ logger = logging.getLogger(__name__)
 
 class PyCodeStyleLinter(PythonLinter):
     name = 'pycodestyle'
+    shardable = True
+    cacheable = True
+    config_files = ('setup.cfg', 'tox.ini', '.pycodestyle')
 
     def is_usable(self):
         return in_path('pycodestyle')
@@ -19,9 +21,9 @@ class PyCodeStyleLinter(PythonLinter):
     def lint_files(self, files):
         command = [self.python_name, '-m', 'pycodestyle']
         command += files
-        _, output = run_command(command, split=True, cwd=self.working_dir)
+        _, output = self.run_command(command, split=True)
         if not output:
-            raise StopIteration()
+            return
 
         for line in output:
             filename, line, message = self._parse_line(line)
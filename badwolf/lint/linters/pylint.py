@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import logging
 
-from badwolf.utils import to_text, run_command
+from badwolf.utils import to_text
 from badwolf.lint import Problem
 from badwolf.lint.linters import PythonLinter
 from badwolf.lint.utils import in_path
@@ -12,6 +12,7 @@ logger = logging.getLogger(__name__)
 
 class PylintLinter(PythonLinter):
     name = 'pylint'
+    # Neither sharded nor cached, checks like duplicate-code and cyclic-import need all files at once
 
     def is_usable(self):
         return in_path('pylint')
@@ -19,14 +20,13 @@ class PylintLinter(PythonLinter):
     def lint_files(self, files):
         command = [self.python_name, '-m', 'pylint', '-r', 'n', '-f', 'parseable']
         command += files
-        _, output = run_command(
+        _, output = self.run_command(
             command,
             split=True,
-            include_errors=True,
-            cwd=self.working_dir
+            include_errors=True
         )
         if not output:
-            raise StopIteration()
+            return
 
         for line in output:
             parsed = self._parse_line(to_text(line))
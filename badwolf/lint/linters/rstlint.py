@@ -2,6 +2,7 @@
 import os
 import logging
 
+import docutils
 import restructuredtext_lint as rstlinter
 
 from badwolf.lint import Problem
@@ -14,18 +15,20 @@ logger = logging.getLogger(__name__)
 class RestructuredTextLinter(Linter):
     name = 'rstlint'
     default_pattern = '*.rst'
+    cacheable = True
+
+    def get_version(self):
+        return 'docutils {}'.format(docutils.__version__)
 
     def lint_files(self, files):
-        cwd = os.getcwd()
-        os.chdir(self.working_dir)
+        # Linters run concurrently, don't change the process wide working directory
         for path in files:
-            errors = rstlinter.lint_file(path, 'utf-8')
+            errors = rstlinter.lint_file(os.path.join(self.working_dir, path), 'utf-8')
             for error in errors:
                 msg = '{}: {}'.format(error.type, error.message)
                 yield Problem(
-                    error.source,
+                    self._relativize_filename(error.source),
                     error.line,
                     msg,
                     self.name
                 )
-        os.chdir(cwd)
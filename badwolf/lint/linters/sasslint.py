@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
 
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import Linter
 from badwolf.lint.utils import in_path, npm_exists, parse_checkstyle
@@ -9,16 +8,20 @@ from badwolf.lint.utils import in_path, npm_exists, parse_checkstyle
 
 class SassLinter(Linter):
     name = 'sasslint'
+    shardable = True
     default_pattern = '*.scss'
+    cacheable = True
+    config_files = ('.sass-lint.yml', '.sasslintrc', 'package.json')
+    executable = 'sass-lint'
 
     def is_usable(self):
         return in_path('sass-lint') or npm_exists('sass-lint', self.working_dir)
 
     def lint_files(self, files):
         command = self.create_command(files)
-        _, output = run_command(command, cwd=self.working_dir)
+        _, output = self.run_command(command)
         if not output:
-            raise StopIteration()
+            return
 
         problems = parse_checkstyle(output)
         for filename, line, message in problems:
@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import Linter
 from badwolf.lint.utils import in_path, parse_checkstyle
@@ -7,16 +6,19 @@ from badwolf.lint.utils import in_path, parse_checkstyle
 
 class ShellCheckLinter(Linter):
     name = 'shellcheck'
+    shardable = True
     default_pattern = '*.sh'
+    cacheable = True
+    config_files = ('.shellcheckrc',)
 
     def is_usable(self):
         return in_path('shellcheck')
 
     def lint_files(self, files):
         command = self.create_command(files)
-        _, output = run_command(command, cwd=self.working_dir)
+        _, output = self.run_command(command)
         if not output:
-            raise StopIteration()
+            return
 
         problems = parse_checkstyle(output)
         for filename, line, message in problems:
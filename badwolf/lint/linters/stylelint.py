@@ -2,7 +2,6 @@
 import os
 import json
 
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import Linter
 from badwolf.lint.utils import in_path, npm_exists
@@ -10,7 +9,20 @@ from badwolf.lint.utils import in_path, npm_exists
 
 class StyleLinter(Linter):
     name = 'stylelint'
+    shardable = True
     default_pattern = '*.css *.scss *.less *.sss'
+    cacheable = True
+    # 2 means problems found
+    success_exit_codes = (0, 2)
+    config_files = (
+        '.stylelintrc',
+        '.stylelintrc.json',
+        '.stylelintrc.yml',
+        '.stylelintrc.yaml',
+        'stylelint.config.js',
+        'package.json',
+    )
+    nested_config = True
 
     def is_usable(self):
         return in_path('stylelint') or npm_exists('stylelint', self.working_dir)
@@ -23,14 +35,15 @@ class StyleLinter(Linter):
 
     def lint_files(self, files):
         command = self.create_command(files)
-        _, output = run_command(command, cwd=self.working_dir)
+        _, output = self.run_command(command)
         if not output:
-            raise StopIteration()
+            return
 
         try:
             problems = json.loads(output)
         except ValueError:
-            raise StopIteration()
+            self.mark_uncacheable('unparseable output')
+            return
 
         for source in problems:
             for problem in source['warnings']:
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import logging
 
-from badwolf.utils import run_command
 from badwolf.lint import Problem
 from badwolf.lint.linters import Linter
 from badwolf.lint.utils import in_path
@@ -12,7 +11,12 @@ logger = logging.getLogger(__name__)
 
 class YAMLLinter(Linter):
     name = 'yamllint'
+    shardable = True
     default_pattern = '*.yml'
+    cacheable = True
+    # 2 means only warnings found in strict mode
+    success_exit_codes = (0, 1, 2)
+    config_files = ('.yamllint', '.yamllint.yml', '.yamllint.yaml')
 
     def is_usable(self):
         return in_path('yamllint')
@@ -20,9 +24,9 @@ class YAMLLinter(Linter):
     def lint_files(self, files):
         command = ['yamllint', '-f', 'parsable']
         command += files
-        _, output = run_command(command, split=True, cwd=self.working_dir)
+        _, output = self.run_command(command, split=True)
         if not output:
-            raise StopIteration()
+            return
 
         for line in output:
             filename, line, message = self._parse_line(line)
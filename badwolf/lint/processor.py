@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
+import os
 import logging
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
-from unidiff import UnidiffParseError
+import requests
+from flask import current_app
 
-from badwolf.extensions import bitbucket, sentry
+from badwolf.extensions import bitbucket, sentry, statuses
 from badwolf.bitbucket import PullRequest, BitbucketAPIError, BuildStatus
+from badwolf.diff import git_diff
 from badwolf.lint import Problems
+from badwolf.lint.cache import LintCache
+from badwolf.lint.linters import match_pattern
+from badwolf.ratelimit import get_token_bucket
 from badwolf.lint.linters.eslint import ESLinter
 from badwolf.lint.linters.flake8 import Flake8Linter
 from badwolf.lint.linters.pycodestyle import PyCodeStyleLinter
@@ -49,6 +59,9 @@ class LintProcessor(object):
         self.spec = spec
         self.working_dir = working_dir or context.clone_path
         self.problems = Problems()
+        self.throttled = 0
+        self._throttled_lock = threading.Lock()
+        self._rate_limiter = None
         self.pr = PullRequest(bitbucket, context.repository)
         commit_hash = context.source['commit']['hash']
         self.build_status = BuildStatus(
@@ -60,16 +73,56 @@ class LintProcessor(object):
         )
 
     def load_changes(self):
-        try:
-            changes = self.pr.diff(self.context.pr_id)
-        except (BitbucketAPIError, UnidiffParseError):
-            logger.exception('Error getting pull request diff from API')
-            sentry.captureException()
-            return
+        changes = None
+        if current_app.config['BADWOLF_LINT_LOCAL_DIFF']:
+            changes = self._load_local_changes()
+        if changes is None:
+            try:
+                changes = self.pr.diff(self.context.pr_id, exclude=self._build_exclude())
+            except requests.RequestException:
+                logger.exception('Error getting pull request diff from API')
+                sentry.captureException()
+                return
 
         self.problems.set_changes(changes)
         return changes
 
+    def _load_local_changes(self):
+        """Diff of pull request from local clone, ``None`` when it can not be computed locally"""
+        target = self.context.target or {}
+        target_branch = target.get('branch', {}).get('name')
+        if not target_branch or not os.path.isdir(os.path.join(self.working_dir, '.git')):
+            return None
+
+        try:
+            changes = git_diff(
+                self.working_dir,
+                'refs/remotes/origin/{}'.format(target_branch),
+                self.context.source['commit']['hash'],
+                timeout=current_app.config['BADWOLF_LINT_TIMEOUT'] or None,
+                exclude=self._build_exclude()
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning('Error getting pull request diff from local clone, fallback to API: %s', e)
+            return None
+        logger.info('Loaded pull request diff of %d files from local clone', len(changes))
+        return changes
+
+    def _build_exclude(self):
+        """Predicate of paths no configured linter lints, ``None`` if every path may be linted"""
+        patterns = []
+        for linter_option in self.spec.linters:
+            linter_cls = self.LINTERS.get(linter_option.name)
+            if linter_cls is None:
+                continue
+            pattern = linter_option.pattern or linter_cls.default_pattern
+            if not pattern:
+                return None
+            patterns.append(pattern)
+        if not patterns:
+            return None
+        return lambda path: not any(match_pattern(pattern, path) for pattern in patterns)
+
     def process(self):
         if not self.spec.linters:
             logger.info('No linters configured, ignore lint.')
@@ -118,6 +171,14 @@ class LintProcessor(object):
             self.update_build_status('SUCCESSFUL', description)
 
     def _execute_linters(self, files):
+        cache = None
+        if current_app.config['BADWOLF_LINT_CACHE_ENABLED']:
+            cache = LintCache(
+                current_app.config['BADWOLF_LINT_CACHE_DIR'],
+                current_app.config['BADWOLF_LINT_CACHE_SIZE']
+            )
+
+        linters = []
         for linter_option in self.spec.linters:
             name = linter_option.name
             linter_cls = self.LINTERS.get(name)
@@ -125,17 +186,53 @@ class LintProcessor(object):
                 logger.info('Linter %s not found, ignore.', name)
                 continue
 
-            linter = linter_cls(self.working_dir, self.problems, linter_option)
+            linter = linter_cls(
+                self.working_dir,
+                self.problems,
+                linter_option,
+                timeout=current_app.config['BADWOLF_LINT_TIMEOUT'] or None,
+                jobs=current_app.config['BADWOLF_LINT_JOBS'] or multiprocessing.cpu_count(),
+                cache=cache
+            )
             if not linter.is_usable():
                 logger.info('Linter %s is not usable, ignore.', name)
                 continue
+            linters.append(linter)
+
+        if not linters:
+            return
+
+        # Linters are mostly subprocesses, run them concurrently so lint takes
+        # as long as the slowest linter instead of all of them together
+        app = current_app._get_current_object()
+        max_workers = min(len(linters), current_app.config['BADWOLF_LINT_WORKERS'])
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for linter in linters:
+                executor.submit(self._execute_linter, app, linter, files)
 
-            logger.info('Running %s code linter', name)
-            linter.execute(files)
+        logger.info(
+            'Code linters finished: %s',
+            ', '.join('{} {:.2f}s'.format(linter.name, linter.elapsed or 0) for linter in linters)
+        )
+        if cache is not None:
+            cache.evict()
+
+    def _execute_linter(self, app, linter, files):
+        with app.app_context():
+            logger.info('Running %s code linter', linter.name)
+            try:
+                linter.execute(files)
+            except subprocess.TimeoutExpired:
+                logger.error('Linter %s timed out after %s seconds', linter.name, linter.timeout)
+            except Exception:
+                logger.exception('Error running linter %s', linter.name)
+                sentry.captureException()
+            else:
+                logger.info('Linter %s finished in %.2f seconds', linter.name, linter.elapsed or 0)
 
     def _report(self):
         try:
-            comments = self.pr.all_comments(self.context.pr_id)
+            comments = self.pr.all_comments(self.context.pr_id, fields=('id', 'inline', 'content.raw'))
         except BitbucketAPIError:
             logger.exception('Error fetching all comments for pull request')
             sentry.captureException()
@@ -160,7 +257,7 @@ class LintProcessor(object):
             return 0, 0
 
         lint_comments = set()
-        problem_count = 0
+        new_comments = []
         for problem in self.problems:
             content = ':broken_heart: **{}**: {}'.format(problem.linter, problem.message)
             comment_tuple = (problem.filename, problem.line, content)
@@ -168,9 +265,9 @@ class LintProcessor(object):
             if comment_tuple in existing_comments_ids:
                 continue
 
-            if problem_count >= 50:
+            if len(new_comments) >= 50:
                 # Avoid sending too many comments
-                break
+                continue
             comment_kwargs = {
                 'filename': problem.filename,
             }
@@ -178,40 +275,76 @@ class LintProcessor(object):
                 comment_kwargs['line_to'] = problem.line
             else:
                 comment_kwargs['line_from'] = problem.line
-            try:
-                self.pr.comment(
+            new_comments.append((content, comment_kwargs))
+
+        outdated_comments = set(existing_comments_ids.keys()) - lint_comments
+        logger.info('%d outdated lint comments found', len(outdated_comments))
+
+        # Comments are created and deleted concurrently within Bitbucket API rate limit
+        app = current_app._get_current_object()
+        self._rate_limiter = get_token_bucket(
+            bitbucket.account,
+            current_app.config['BITBUCKET_RATE_LIMIT'],
+            current_app.config['BITBUCKET_RATE_BURST']
+        )
+        self.throttled = 0
+        with ThreadPoolExecutor(max_workers=current_app.config['BITBUCKET_COMMENT_WORKERS']) as executor:
+            created = [
+                executor.submit(
+                    self._call_api,
+                    app,
+                    'Error creating inline comment for pull request',
+                    self.pr.comment,
                     self.context.pr_id,
                     content,
                     **comment_kwargs
                 )
-            except BitbucketAPIError:
-                logger.exception('Error creating inline comment for pull request')
-                sentry.captureException()
-            else:
-                problem_count += 1
+                for content, comment_kwargs in new_comments
+            ]
+            deleted = [
+                executor.submit(
+                    self._call_api,
+                    app,
+                    'Error deleting pull request comment',
+                    self.pr.delete_comment,
+                    self.context.pr_id,
+                    existing_comments_ids[comment]
+                )
+                for comment in outdated_comments
+            ]
+        problem_count = sum(1 for future in created if future.result())
+        outdated_cleaned = sum(1 for future in deleted if future.result())
 
         logger.info(
-            'Code lint result: %d problems found, %d submitted',
+            'Code lint result: %d problems found, %d submitted, %d outdated comments deleted, '
+            '%d requests throttled by Bitbucket',
             len(self.problems),
-            problem_count
+            problem_count,
+            outdated_cleaned,
+            self.throttled
         )
+        return problem_count, outdated_cleaned
 
-        outdated_cleaned = 0
-        outdated_comments = set(existing_comments_ids.keys()) - lint_comments
-        logger.info('%d outdated lint comments found', len(outdated_comments))
-        for comment in outdated_comments:
-            # Delete comment
+    def _call_api(self, app, error_message, func, *args, **kwargs):
+        """Call Bitbucket API honouring rate limit, returns whether it succeeded
+
+        Throttled requests are retried by the Bitbucket client, they are counted here.
+        """
+        with app.app_context():
+            self._rate_limiter.acquire()
             try:
-                self.pr.delete_comment(self.context.pr_id, existing_comments_ids[comment])
-                outdated_cleaned += 1
+                func(*args, on_throttled=self._on_throttled, **kwargs)
             except BitbucketAPIError:
-                logger.exception('Error deleting pull request comment')
+                logger.exception(error_message)
                 sentry.captureException()
-        return problem_count, outdated_cleaned
+                return False
+            return True
+
+    def _on_throttled(self, retry_after):
+        with self._throttled_lock:
+            self.throttled += 1
+        # Other workers wait too instead of being throttled one after another
+        self._rate_limiter.pause(retry_after)
 
     def update_build_status(self, state, description=None):
-        try:
-            self.build_status.update(state, description=description)
-        except BitbucketAPIError:
-            logger.exception('Error calling Bitbucket API')
-            sentry.captureException()
+        statuses.publish(self.build_status, state, description=description)
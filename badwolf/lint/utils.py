@@ -44,3 +44,37 @@ def parse_checkstyle(xml):
 
             for line in lines:
                 yield (filename, line, message)
+
+
+def _max_argv_size():
+    try:
+        arg_max = os.sysconf('SC_ARG_MAX')
+    except (ValueError, OSError):
+        arg_max = -1
+    if arg_max <= 0:
+        arg_max = 128 * 1024
+    # Leave room for environment variables and the command itself
+    return arg_max // 2
+
+
+def split_argv(args, max_size=None):
+    """
+    Split arguments into batches whose command line length
+    stays below the system ARG_MAX limit.
+    """
+    max_size = max_size or _max_argv_size()
+    batches = []
+    batch = []
+    batch_size = 0
+    for arg in args:
+        # Argument bytes, NUL terminator and argv pointer
+        size = len(os.fsencode(arg)) + 1 + 8
+        if batch and batch_size + size > max_size:
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append(arg)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import re
+import codecs
+import functools
+from html import escape
+
+import deansi
+
+from badwolf.utils import to_binary, sanitize_sensitive_data
+
+
+# Text following ESC. SGR sequences set colors and attributes, other CSI sequences
+# (cursor movement, erasing lines...) mean nothing in HTML and are dropped
+RE_CSI = re.compile(r'\[([0-9;?]*)([@-~])')
+# Escape sequence cut at the end of a chunk
+RE_PARTIAL_ESCAPE = re.compile(r'\x1b(?:\[[0-9;?]*)?\Z')
+
+
+def _sgr_codes(params):
+    codes = []
+    values = iter(int(value) if value else 0 for value in params.split(';'))
+    for code in values:
+        if code in (38, 48):
+            # 256 colors or true color are not supported, skip their arguments
+            mode = next(values, None)
+            skip = 1 if mode == 5 else 3 if mode == 2 else 0
+            for _ in range(skip):
+                next(values, None)
+            continue
+        codes.append(code)
+    return codes
+
+
+@functools.lru_cache(maxsize=1024)
+def _transition(state, params):
+    """New state and its CSS classes after SGR sequence, logs use only a few of them"""
+    attribs, fg, bg = state
+    attribs = set(attribs)
+    for code in _sgr_codes(params):
+        attribs, fg, bg = deansi.ansiState(code, attribs, fg, bg)
+    return (frozenset(attribs), fg, bg), deansi.stateToClasses(attribs, fg, bg)
+
+
+class AnsiToHtml(object):
+    '''Streaming converter of terminal output with ANSI colors to HTML
+
+    Produces the same CSS classes as :func:`deansi.deansi`, but colors and
+    attributes are carried across chunks, so text may be fed in chunks of any
+    size. A new ``<span>`` is only opened when the style changes, and every
+    chunk of HTML returned is well-formed on its own.
+    '''
+    def __init__(self):
+        self._state = (frozenset(), None, None)
+        self._classes = ''
+        self._pending = ''
+
+    def feed(self, text, final=False):
+        '''Convert ``text`` to HTML, an escape sequence cut at the end of it is
+        kept until next call unless ``final`` is set'''
+        if self._pending:
+            text = self._pending + text
+            self._pending = ''
+        if not final:
+            start = text.rfind('\x1b')
+            if start != -1 and RE_PARTIAL_ESCAPE.match(text, start):
+                self._pending = text[start:]
+                text = text[:start]
+        if not text:
+            return ''
+
+        blocks = text.split('\x1b')
+        if len(blocks) == 1 and not self._classes:
+            return escape(text, quote=False)
+
+        html = []
+        span = ''
+        for i, block in enumerate(blocks):
+            if i:
+                match = RE_CSI.match(block)
+                if match:
+                    params = match.group(1)
+                    if match.group(2) == 'm' and '?' not in params:
+                        self._apply(params)
+                    block = block[match.end():]
+            if not block:
+                continue
+            if span != self._classes:
+                if span:
+                    html.append('</span>')
+                span = self._classes
+                if span:
+                    html.append("<span class='{}'>".format(span))
+            html.append(escape(block, quote=False))
+        if span:
+            html.append('</span>')
+        return ''.join(html)
+
+    def close(self):
+        '''Convert text kept by :meth:`feed`'''
+        return self.feed('', final=True)
+
+    def _apply(self, params):
+        self._state, self._classes = _transition(self._state, params)
+
+
+def iter_log_html(chunks, max_line_size=1024 * 1024):
+    '''Convert text chunks of log to HTML split at line boundaries, sensitive data removed
+
+    Lines longer than ``max_line_size`` are converted in pieces split at whitespace,
+    which never appears in the URLs sanitized.
+    '''
+    renderer = AnsiToHtml()
+    buffer = ''
+    for text in chunks:
+        buffer += text
+        end = buffer.rfind('\n') + 1
+        if not end and len(buffer) >= max_line_size:
+            end = max(buffer.rfind(' '), buffer.rfind('\t'), buffer.rfind('\r')) + 1 or len(buffer)
+        if end:
+            yield sanitize_sensitive_data(renderer.feed(buffer[:end]))
+            buffer = buffer[end:]
+    html = renderer.feed(buffer, final=True)
+    if html:
+        yield sanitize_sensitive_data(html)
+
+
+def iter_decoded(chunks):
+    '''Decode byte chunks as UTF-8, characters may be split across chunks'''
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    for chunk in chunks:
+        text = decoder.decode(to_binary(chunk))
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import os
+import codecs
+import logging
+import threading
+
+from badwolf.utils import to_binary
+from badwolf.log.ansi import iter_log_html
+
+
+logger = logging.getLogger(__name__)
+
+
+class LogStore(object):
+    '''Append only build log stored on disk in fixed size chunks
+
+    Memory usage stays constant regardless of log size. When the log grows
+    beyond ``head_size + tail_size`` bytes, chunks in the middle are dropped so
+    only the beginning and the end of the log are kept.
+    '''
+    CHUNK_NAME = 'build.log.{:06d}'
+    # Lines longer than this are converted to HTML in pieces
+    MAX_LINE_SIZE = 1024 * 1024
+
+    def __init__(self, path, chunk_size=1024 * 1024, head_size=1024 * 1024, tail_size=10 * 1024 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.head_chunks = max(1, -(-head_size // chunk_size))
+        self.tail_chunks = max(1, -(-tail_size // chunk_size))
+        self.size = 0
+        self.truncated = 0
+        self._chunks = []
+        self._next_index = 0
+        self._current = None
+        self._current_size = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def __repr__(self):
+        return '<LogStore {} {} bytes>'.format(self.path, self.size)
+
+    def _chunk_path(self, index):
+        return os.path.join(self.path, self.CHUNK_NAME.format(index))
+
+    def write(self, data):
+        data = to_binary(data)
+        with self._lock:
+            self.size += len(data)
+            while data:
+                if self._current is None or self._current_size >= self.chunk_size:
+                    self._rotate()
+                part = data[:self.chunk_size - self._current_size]
+                self._current.write(part)
+                self._current_size += len(part)
+                self._chunks[-1][1] = self._current_size
+                data = data[len(part):]
+
+    def _rotate(self):
+        if self._current is not None:
+            self._current.close()
+        index = self._next_index
+        self._next_index += 1
+        self._current = open(self._chunk_path(index), 'wb')
+        self._current_size = 0
+        self._chunks.append([index, 0])
+
+        # Drop the oldest chunk after head, never the one being written
+        while len(self._chunks) > self.head_chunks + self.tail_chunks:
+            index, size = self._chunks.pop(self.head_chunks)
+            self.truncated += size
+            try:
+                os.remove(self._chunk_path(index))
+            except OSError:
+                logger.exception('Error removing log chunk %s', index)
+
+    def close(self):
+        with self._lock:
+            if self._current is not None:
+                self._current.close()
+                self._current = None
+
+    def remove(self):
+        self.close()
+        for index, _ in self._chunks:
+            try:
+                os.remove(self._chunk_path(index))
+            except OSError:
+                pass
+        self._chunks = []
+
+    def iter_text(self, skip_chunks=0, offset=None):
+        '''Iterate decoded log text chunk by chunk
+
+        When ``offset`` is given, that many bytes are skipped from the first chunk
+        and reading starts at the next line, so no line, character or escape
+        sequence is cut.
+        '''
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        with self._lock:
+            chunks = [tuple(chunk) for chunk in self._chunks[skip_chunks:]]
+            if self._current is not None:
+                self._current.flush()
+        for position, (index, _) in enumerate(chunks, skip_chunks):
+            if position == self.head_chunks and self.truncated:
+                yield decoder.decode(b'', final=True)
+                decoder.reset()
+                yield '\n... {} bytes of log truncated ...\n'.format(self.truncated)
+            try:
+                with open(self._chunk_path(index), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                # Dropped by writer in the meantime
+                continue
+            if offset is not None:
+                data = data[offset:]
+                offset = 0
+                newline = data.find(b'\n')
+                if newline == -1:
+                    # Line goes on in next chunk
+                    continue
+                data = data[newline + 1:]
+                offset = None
+            yield decoder.decode(data)
+        yield decoder.decode(b'', final=True)
+
+    def iter_html(self, skip_chunks=0, offset=None):
+        '''Iterate log converted to HTML, split at line boundaries'''
+        return iter_log_html(self.iter_text(skip_chunks, offset), self.MAX_LINE_SIZE)
+
+    def tail_html(self, size):
+        '''Last ``size`` bytes of log converted to HTML, starting at a line boundary'''
+        with self._lock:
+            skip_chunks = len(self._chunks)
+            offset = 0
+            while skip_chunks and size > 0:
+                skip_chunks -= 1
+                chunk_size = self._chunks[skip_chunks][1]
+                offset = max(0, chunk_size - size)
+                size -= chunk_size
+            whole = not skip_chunks and not offset
+            if not whole:
+                # Read from the byte before, the tail starts right there if it ends a line
+                if offset:
+                    offset -= 1
+                elif not (skip_chunks == self.head_chunks and self.truncated):
+                    skip_chunks -= 1
+                    offset = self._chunks[skip_chunks][1] - 1
+        if whole:
+            return ''.join(self.iter_html())
+        return '... earlier log omitted ...\n' + ''.join(self.iter_html(skip_chunks, offset))
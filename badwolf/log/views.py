@@ -4,7 +4,9 @@ import logging
 
 import deansi
 from flask import Blueprint, current_app, send_from_directory, request, abort, Response
-from docker import DockerClient
+
+from badwolf.extensions import docker
+from badwolf.log.ansi import iter_decoded, iter_log_html
 
 
 logger = logging.getLogger(__name__)
@@ -62,18 +64,22 @@ def build_log(sha):
 
     # new log path
     log_dir = os.path.join(log_dir, task_id)
+    env = request.args.get('env')
+    if env:
+        # Environment of build matrix
+        if not env.isdigit():
+            abort(404)
+        log_dir = os.path.join(log_dir, env)
     if os.path.exists(os.path.join(log_dir, 'build.html')):
         return send_from_directory(log_dir, 'build.html')
 
     # Try realtime logs
-    docker = DockerClient(
-        base_url=current_app.config['DOCKER_HOST'],
-        timeout=current_app.config['DOCKER_API_TIMEOUT'],
-        version='auto',
-    )
+    labels = ['task_id={}'.format(task_id)]
+    if env:
+        labels.append('env={}'.format(env))
     containers = docker.containers.list(filters=dict(
         status='running',
-        label='task_id={}'.format(task_id),
+        label=labels,
     ))
     if not containers:
         abort(404)
@@ -85,15 +91,8 @@ def build_log(sha):
         yield '<style>{}</style>'.format(deansi.styleSheet())
         yield FOLLOW_LOG_JS
         yield '<div class="ansi_terminal">'
-        buffer = []
-        for log in container.logs(stdout=True, stderr=True, stream=True, follow=True):
-            char = str(log)
-            buffer.append(char)
-            if char == '\n':
-                yield deansi.deansi(''.join(buffer))
-                buffer = []
-        if buffer:
-            yield deansi.deansi(''.join(buffer))
+        logs = container.logs(stdout=True, stderr=True, stream=True, follow=True)
+        yield from iter_log_html(iter_decoded(logs))
         yield '</div>'
 
     return Response(_streaming_gen(), mimetype='text/html;charset=utf-8')
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import fcntl
+import shutil
+import logging
+import functools
+import contextlib
+
+import git
+
+from badwolf.extensions import bitbucket
+
+
+logger = logging.getLogger(__name__)
+
+MERGE_TREE_GIT_VERSION = (2, 38)
+
+
+class RepositoryMirror(object):
+    '''Local bare mirror of a BitBucket repository
+
+    Mirrors live in ``BADWOLF_MIRROR_DIR/<owner>/<repo>.git`` and are
+    incrementally fetched before every build, builds then clone from the
+    mirror locally which hardlinks the object files instead of downloading them.
+    '''
+    def __init__(self, mirror_dir, full_name):
+        self.mirror_dir = mirror_dir
+        self.full_name = full_name
+        self.path = os.path.join(mirror_dir, '{}.git'.format(full_name))
+
+    def __repr__(self):
+        return '<RepositoryMirror {}>'.format(self.full_name)
+
+    @property
+    def lock_path(self):
+        return '{}.lock'.format(self.path)
+
+    @contextlib.contextmanager
+    def lock(self, blocking=True):
+        '''Per repository lock, shared between threads and processes'''
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.lock_path, 'w') as f:
+            flags = fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            fcntl.flock(f, flags)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, 'HEAD'))
+
+    def sync(self):
+        '''Create the mirror or fetch new objects into it, caller must hold the lock'''
+        clone_url = bitbucket.get_git_url(self.full_name)
+        if not self.exists():
+            logger.info('Creating mirror of repository %s at %s', self.full_name, self.path)
+            shutil.rmtree(self.path, ignore_errors=True)
+            git.Git().clone('--mirror', clone_url, self.path)
+        else:
+            logger.info('Updating mirror of repository %s', self.full_name)
+            gitcmd = git.Git(self.path)
+            # Credentials may have been changed (OAuth access token expired for example)
+            gitcmd.remote('set-url', 'origin', clone_url)
+            gitcmd.fetch('--prune', '--tags', 'origin')
+        self.touch()
+
+    def clone_to(self, clone_path, branch=None):
+        '''Clone from mirror to local path, objects are hardlinked when possible'''
+        clone_kwargs = {'local': True}
+        if branch:
+            clone_kwargs['branch'] = branch
+        git.Git().clone(self.path, clone_path, **clone_kwargs)
+        self.touch()
+
+    def can_merge(self, target, source):
+        '''Whether commit ``source`` merges into ``target`` cleanly, checked by
+        ``git merge-tree`` without touching any work tree
+
+        :raises git.GitCommandError: when commits are not found in mirror or git
+                                     doesn't support ``merge-tree --write-tree``
+        '''
+        return _can_merge(self.path, target, source)
+
+    def is_corrupted(self):
+        if not self.exists():
+            return True
+        gitcmd = git.Git(self.path)
+        try:
+            gitcmd.fsck('--connectivity-only', '--no-dangling')
+        except git.GitCommandError:
+            logger.exception('Mirror of repository %s is corrupted', self.full_name)
+            return True
+        return False
+
+    def touch(self):
+        os.utime(self.path, None)
+
+    def last_used(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return 0
+
+    def disk_usage(self):
+        total = 0
+        for root, _dirs, files in os.walk(self.path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def remove(self):
+        logger.info('Removing mirror of repository %s', self.full_name)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@functools.lru_cache(maxsize=1)
+def merge_tree_supported():
+    """Whether installed git supports ``git merge-tree --write-tree``, added in git 2.38"""
+    try:
+        version = git.Git().version_info
+    except (OSError, git.GitCommandError, ValueError):
+        logger.exception('Error getting git version')
+        return False
+    if version < MERGE_TREE_GIT_VERSION:
+        logger.warning(
+            'git %s is older than %s, mergeability of pull requests is checked by Bitbucket API',
+            '.'.join(str(v) for v in version),
+            '.'.join(str(v) for v in MERGE_TREE_GIT_VERSION)
+        )
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=1024)
+def _can_merge(path, target, source):
+    # Merge result of two commits never changes, cached by their SHA
+    gitcmd = git.Git(path)
+    status, stdout, stderr = gitcmd.merge_tree(
+        '--write-tree',
+        '--no-messages',
+        target,
+        source,
+        with_extended_output=True,
+        with_exceptions=False
+    )
+    if status == 0:
+        return True
+    if status == 1 and stdout:
+        # Conflicts, tree written is printed. Unknown commits exit 1 too but print nothing
+        return False
+    raise git.GitCommandError(['git', 'merge-tree', target, source], status, stderr)
+
+
+def list_mirrors(mirror_dir):
+    if not os.path.isdir(mirror_dir):
+        return []
+
+    mirrors = []
+    for owner in os.listdir(mirror_dir):
+        owner_dir = os.path.join(mirror_dir, owner)
+        if not os.path.isdir(owner_dir):
+            continue
+        for name in os.listdir(owner_dir):
+            if not name.endswith('.git'):
+                continue
+            full_name = '{}/{}'.format(owner, name[:-len('.git')])
+            mirrors.append(RepositoryMirror(mirror_dir, full_name))
+    return mirrors
+
+
+def evict_mirrors(mirror_dir, max_size, keep=None):
+    '''Remove least recently used mirrors until total disk usage is below ``max_size`` bytes
+
+    Mirrors which are currently locked (being updated or cloned from) are never removed.
+    '''
+    if max_size <= 0:
+        return []
+
+    mirrors = list_mirrors(mirror_dir)
+    usages = {mirror.full_name: mirror.disk_usage() for mirror in mirrors}
+    total = sum(usages.values())
+    if total <= max_size:
+        return []
+
+    start = time.time()
+    removed = []
+    for mirror in sorted(mirrors, key=lambda m: m.last_used()):
+        if total <= max_size:
+            break
+        if mirror.full_name == keep:
+            continue
+        try:
+            with mirror.lock(blocking=False):
+                mirror.remove()
+        except BlockingIOError:
+            logger.info('Mirror of repository %s is in use, skip evicting', mirror.full_name)
+            continue
+        total -= usages[mirror.full_name]
+        removed.append(mirror.full_name)
+    logger.info('Evicted %d mirror(s) in %.2f seconds, %d bytes in use', len(removed), time.time() - start, total)
+    return removed
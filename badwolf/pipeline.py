@@ -12,7 +12,7 @@ from docker.errors import APIError as DockerAPIError
 from hvac.exceptions import VaultError
 
 from badwolf.spec import Specification
-from badwolf.extensions import bitbucket, sentry
+from badwolf.extensions import bitbucket, sentry, registry, statuses
 from badwolf.bitbucket import BuildStatus, BitbucketAPIError, PullRequest, Changesets
 from badwolf.utils import sanitize_sensitive_data, run_command
 from badwolf.cloner import RepositoryCloner
@@ -24,6 +24,7 @@ from badwolf.exceptions import (
     SpecificationNotFound,
     BuildDisabled,
     InvalidSpecification,
+    PipelineCancelled,
 )
 
 
@@ -47,17 +48,25 @@ class Pipeline(object):
     def start(self):
         '''Start Pipeline'''
         logger.info('Pipeline started for repository %s', self.context.repository)
+        task_id = self.context.task_id
         try:
+            registry.check(task_id)
             self.clone()
+            registry.check(task_id)
             self.parse_spec()
             exit_code = self.build()
             build_success = exit_code == 0
             self.save_artifacts(build_success)
             if exit_code != 137:
                 # 137 means build cancelled
+                registry.check(task_id)
                 self.lint()
             if build_success:
+                registry.check(task_id)
                 self.deploy()
+        except PipelineCancelled:
+            logger.info('Pipeline cancelled for repository %s', self.context.repository)
+            self._update_build_status('STOPPED', 'build cancelled')
         except git.GitCommandError as git_err:
             logger.exception('Git command error')
             self._report_git_error(git_err)
@@ -69,8 +78,13 @@ class Pipeline(object):
         except BadwolfException:
             pass
         finally:
+            # Make sure final build statuses are sent before pipeline finishes
+            statuses.flush(self.commit_hash)
             self.clean()
 
+    def _update_build_status(self, state, description=None):
+        statuses.publish(self.build_status, state, description=description)
+
     def _report_error(self, content):
         content = sanitize_sensitive_data(content)
         if self.context.pr_id:
@@ -90,7 +104,7 @@ class Pipeline(object):
         def _linkify_file(name):
             return '[`{name}`](#chg-{name})'.format(name=name)
 
-        self.build_status.update('FAILED', description='Git clone repository failed')
+        self._update_build_status('FAILED', 'Git clone repository failed')
         git_error_msg = str(exc)
         content = ':broken_heart: **Git error**: {}'.format(git_error_msg)
         if 'Merge conflict' in git_error_msg:
@@ -106,7 +120,7 @@ class Pipeline(object):
         self._report_error(content)
 
     def _report_docker_error(self, exc):
-        self.build_status.update('FAILED', description='Docker error occurred')
+        self._update_build_status('FAILED', 'Docker error occurred')
         content = ':broken_heart: **Docker error**: {}'.format(exc.explanation)
         self._report_error(content)
 
@@ -275,7 +289,7 @@ class Pipeline(object):
                     filename='artifacts.tar.gz',
                     _external=True)
         )
-        build_status.update('SUCCESSFUL', description='Build artifacts saved')
+        statuses.publish(build_status, 'SUCCESSFUL', description='Build artifacts saved')
 
     def lint(self):
         '''Lint codes'''
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import time
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+
+logger = logging.getLogger(__name__)
+
+_BUCKETS = {}
+_BUCKETS_LOCK = threading.Lock()
+
+
+class TokenBucket(object):
+    '''Thread safe token bucket rate limiter
+
+    Tokens are refilled at ``rate`` tokens per second up to ``capacity``,
+    ``rate`` of 0 means unlimited.
+    '''
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<TokenBucket {}/s>'.format(self.rate)
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        '''Take a token, blocks until one is available'''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self.rate <= 0:
+                        return
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        '''Hand out no tokens in the next ``seconds`` seconds, used when server asks to retry later'''
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+def get_token_bucket(key, rate, capacity=1):
+    '''Process wide token bucket of ``key``, e.g. an API account'''
+    with _BUCKETS_LOCK:
+        bucket = _BUCKETS.get(key)
+        if bucket is None or bucket.rate != rate or bucket.capacity != max(1, capacity):
+            bucket = _BUCKETS[key] = TokenBucket(rate, capacity)
+        return bucket
+
+
+def parse_retry_after(value, default=1):
+    '''Seconds to wait from the value of ``Retry-After`` HTTP header'''
+    if not value:
+        return default
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        logger.warning('Invalid Retry-After header: %s', value)
+        return default
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+from badwolf.exceptions import PipelineCancelled
+
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineHandle(object):
+    '''A queued or running pipeline'''
+    def __init__(self, task_id, key, commit, future):
+        self.task_id = task_id
+        self.key = key
+        self.commit = commit
+        self.future = future
+        self._cancel_event = threading.Event()
+
+    def __repr__(self):
+        return '<PipelineHandle {} {}@{}>'.format(self.task_id, self.key, self.commit)
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        '''Cancel the pipeline, returns ``True`` if it's still queued and will never run'''
+        self._cancel_event.set()
+        return self.future.cancel()
+
+
+class PipelineRegistry(object):
+    '''Registry of pipelines keyed by (repository, branch or pull request)
+
+    Used to cancel outdated pipelines in every phase: removing them from task queue
+    if they are still queued, otherwise running pipelines check :meth:`check` between
+    their phases and stop cooperatively.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pipelines = {}
+
+    @staticmethod
+    def key_of(context):
+        if context.pr_id:
+            return (context.repository, 'pullrequest', str(context.pr_id))
+        if context.type == 'branch':
+            return (context.repository, 'branch', context.source['branch']['name'])
+        # Never cancel tag builds and ci retry on commits
+        return None
+
+    def register(self, context, future):
+        handle = PipelineHandle(
+            context.task_id,
+            self.key_of(context),
+            context.source['commit']['hash'],
+            future
+        )
+        with self._lock:
+            self._pipelines[context.task_id] = handle
+        future.add_done_callback(lambda fut: self._unregister(context.task_id))
+        return handle
+
+    def _unregister(self, task_id):
+        with self._lock:
+            self._pipelines.pop(task_id, None)
+
+    def get(self, task_id):
+        with self._lock:
+            return self._pipelines.get(task_id)
+
+    def supersede(self, context):
+        '''Cancel all pipelines outdated by the pipeline of ``context``, returns cancelled ones'''
+        key = self.key_of(context)
+        if key is None:
+            return []
+
+        with self._lock:
+            handles = [
+                handle for handle in self._pipelines.values()
+                if handle.key == key and handle.task_id != context.task_id and not handle.cancelled
+            ]
+        for handle in handles:
+            handle.cancel()
+        return handles
+
+    def is_cancelled(self, task_id):
+        handle = self.get(task_id)
+        return handle is not None and handle.cancelled
+
+    def check(self, task_id):
+        '''Raise :class:`PipelineCancelled` if the pipeline of ``task_id`` has been cancelled'''
+        if self.is_cancelled(task_id):
+            raise PipelineCancelled()
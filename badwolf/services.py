@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import collections
+
+from docker.errors import APIError, DockerException, NotFound
+from requests.exceptions import RequestException
+
+from badwolf.utils import pid_alive
+
+
+logger = logging.getLogger(__name__)
+
+SERVICE_LABEL = 'badwolf.service'
+INSTANCE_LABEL = 'badwolf.instance'
+PID_LABEL = 'badwolf.pid'
+
+
+class ServicePool(object):
+    '''Sidecar service containers of builds
+
+    Services of a build run in their own containers on a per-build Docker network,
+    reachable from the test container by service name. Up to ``pool_size`` started
+    containers of every service (same image and environment) are kept warm, so builds
+    take a ready one instead of waiting for the service to initialize. Containers are
+    never shared: a used container is removed after the build and the pool is refilled
+    with a fresh one in background, which resets the service to its initial state.
+    Warm containers have no network until they are attached to the network of a build.
+    '''
+    def __init__(self, docker=None, app=None):
+        self.docker = docker
+        self.instance_id = 'badwolf'
+        self.pool_size = 1
+        self.ready_timeout = 60
+        self._pools = collections.defaultdict(list)
+        self._filling = collections.Counter()
+        self._lock = threading.Lock()
+        self._cleanup_lock = threading.Lock()
+        self._cleaned = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.instance_id = app.config['BADWOLF_INSTANCE_ID']
+        self.pool_size = app.config['BADWOLF_SERVICE_POOL_SIZE']
+        self.ready_timeout = app.config['BADWOLF_SERVICE_TIMEOUT']
+
+    @staticmethod
+    def service_key(service):
+        key = json.dumps([service.image, service.env], sort_keys=True)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]  # nosec
+
+    def start(self, network_name, services, labels=None):
+        '''Create network ``network_name`` with ready containers of ``services`` attached,
+        returns network and service containers'''
+        client = self.docker.client
+        self._cleanup_stale(client)
+        network = client.networks.create(network_name, driver='bridge', labels=labels or {})
+        containers = []
+        try:
+            for service in services:
+                container = self._acquire(client, service)
+                containers.append(container)
+                client.networks.get('none').disconnect(container)
+                network.connect(container, aliases=[service.name])
+            # Services not taken from pool start concurrently, wait for them all at last
+            for service, container in zip(services, containers):
+                self._wait_ready(container, service)
+        except BaseException:
+            self.stop(network, containers)
+            raise
+        logger.info('Started %d service(s) on network %s', len(containers), network_name)
+        return network, containers
+
+    def stop(self, network, containers):
+        '''Remove service containers and network of a build'''
+        for container in containers:
+            try:
+                container.remove(force=True, v=True)
+            except NotFound:
+                pass
+            except (APIError, DockerException, RequestException):
+                logger.exception('Error removing service container %s', container.id)
+        if network is None:
+            return
+        try:
+            network.remove()
+        except NotFound:
+            pass
+        except (APIError, DockerException, RequestException):
+            logger.exception('Error removing Docker network %s', network.name)
+
+    def _acquire(self, client, service):
+        key = self.service_key(service)
+        container = None
+        while True:
+            with self._lock:
+                container_id = self._pools[key].pop(0) if self._pools[key] else None
+            if container_id is None:
+                break
+            try:
+                container = client.containers.get(container_id)
+            except NotFound:
+                continue
+            if container.status == 'running':
+                logger.info('Using warm container %s of service %s', container.short_id, service.name)
+                break
+            container.remove(force=True, v=True)
+            container = None
+
+        if container is None:
+            container = self._create(client, service, key)
+        self._refill(service)
+        return container
+
+    def _create(self, client, service, key):
+        logger.info('Starting container of service %s from image %s', service.name, service.image)
+        return client.containers.run(
+            service.image,
+            environment=service.env,
+            labels={
+                SERVICE_LABEL: key,
+                INSTANCE_LABEL: self.instance_id,
+                PID_LABEL: str(os.getpid()),
+            },
+            network_mode='none',
+            detach=True,
+        )
+
+    def _refill(self, service):
+        if self.pool_size <= 0:
+            return
+        key = self.service_key(service)
+        with self._lock:
+            missing = self.pool_size - len(self._pools[key]) - self._filling[key]
+            if missing <= 0:
+                return
+            self._filling[key] += missing
+
+        def fill():
+            client = self.docker.client
+            for _ in range(missing):
+                try:
+                    container = self._create(client, service, key)
+                    if not self._wait_ready(container, service):
+                        container.remove(force=True, v=True)
+                        container = None
+                except (APIError, DockerException, RequestException):
+                    logger.exception('Error warming up container of service %s', service.name)
+                    container = None
+                with self._lock:
+                    self._filling[key] -= 1
+                    if container is not None:
+                        self._pools[key].append(container.id)
+
+        worker = threading.Thread(target=fill, name='badwolf-service-{}'.format(service.name))
+        worker.daemon = True
+        worker.start()
+
+    def _wait_ready(self, container, service):
+        '''Wait until container is running and healthy if image has a health check'''
+        deadline = time.time() + self.ready_timeout
+        while True:
+            container.reload()
+            state = container.attrs.get('State', {})
+            health = (state.get('Health') or {}).get('Status')
+            if container.status == 'running' and health in (None, 'healthy'):
+                return True
+            if container.status in ('exited', 'dead'):
+                logger.error('Service %s exited with code %s', service.name, state.get('ExitCode'))
+                return False
+            if time.time() >= deadline:
+                logger.warning('Service %s is not ready after %s seconds', service.name, self.ready_timeout)
+                return False
+            time.sleep(0.5)
+
+    def _cleanup_stale(self, client):
+        '''Remove service containers left by exited processes of this badwolf instance'''
+        with self._cleanup_lock:
+            if self._cleaned:
+                return
+            self._cleaned = True
+            label = '{}={}'.format(INSTANCE_LABEL, self.instance_id)
+            try:
+                for container in client.containers.list(all=True, filters={'label': [SERVICE_LABEL, label]}):
+                    try:
+                        pid = int(container.labels.get(PID_LABEL, 0))
+                    except ValueError:
+                        pid = 0
+                    # Containers created by this process are not there yet, same pid was reused
+                    if pid and pid != os.getpid() and pid_alive(pid):
+                        continue
+                    logger.info('Removing stale service container %s', container.short_id)
+                    container.remove(force=True, v=True)
+            except (APIError, DockerException, RequestException):
+                logger.exception('Error removing stale service containers')
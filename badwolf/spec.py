@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import os
 import io
 import base64
 import logging
@@ -48,6 +49,10 @@ class SetField(ListField):
         return set(super(SetField, self)._deserialize(value, attr, data, **kwargs))
 
 
+class SecureString(str):
+    """Decrypted value of secure field, never shown in build pages"""
+
+
 class SecureField(fields.String):
     def _deserialize(self, value, attr, data, **kwargs):
         if isinstance(value, dict) and 'secure' in value:
@@ -60,7 +65,7 @@ class SecureField(fields.String):
         from cryptography.fernet import InvalidToken
 
         try:
-            return SecureToken.decrypt(token)
+            return SecureString(SecureToken.decrypt(token))
         except InvalidToken:
             logger.warning('Invalid secure token: %s', token)
             return ''
@@ -72,6 +77,38 @@ class ObjectDictSchema(Schema):
         return ObjectDict(data)
 
 
+def parse_env(env_list):
+    """Parse ``['A=1 B=2', ...]`` to ``{'A': '1', 'B': '2'}``, values of secure
+    fields are :class:`SecureString`"""
+    env_map = {}
+    for env in env_list:
+        for env_str in env.split():
+            key, val = env_str.split('=', 1)
+            env_map[key] = SecureString(val) if isinstance(env, SecureString) else val
+    return env_map
+
+
+class SidecarServiceSchema(ObjectDictSchema):
+    name = fields.String(required=True, validate=validate.Regexp(r'^[a-zA-Z0-9][a-zA-Z0-9_.-]*$'))
+    image = fields.String(required=True)
+    env = ListField(SecureField(), missing=list)
+
+    @post_load
+    def _postprocess(self, data, **kwargs):
+        data['env'] = parse_env(data['env'])
+        return super()._postprocess(data, **kwargs)
+
+
+class ServiceField(fields.Field):
+    """Service started in test container by name, or sidecar container of an image"""
+    def _deserialize(self, value, attr, data, **kwargs):
+        if isinstance(value, dict):
+            return SidecarServiceSchema().load(value)
+        if not isinstance(value, str):
+            raise ValidationError('Invalid service {}'.format(value))
+        return value
+
+
 class EmailNotificationSchema(ObjectDictSchema):
     recipients = ListField(fields.Email(), data_key='recipients', missing=list)
     on_success = fields.String(missing='never', validate=validate.OneOf(('always', 'never')))
@@ -203,6 +240,11 @@ class VaultSchema(ObjectDictSchema):
         return super()._postprocess(data, **kwargs)
 
 
+def _validate_cache_path(path):
+    if not path or os.path.isabs(path) or '..' in path.split('/'):
+        raise ValidationError('Cache path must be relative to home (~) or clone directory: {}'.format(path))
+
+
 class SpecificationSchema(Schema):
     class Meta:
         strict = True
@@ -212,7 +254,9 @@ class SpecificationSchema(Schema):
     dockerfile = fields.String(missing='Dockerfile')
     docker = fields.Boolean(missing=False)
     privileged = fields.Boolean(missing=False)
-    services = ListField(fields.String(), data_key='service', missing=list)
+    parallel = fields.Integer(missing=1, validate=validate.Range(min=1, max=100))
+    cache = ListField(fields.String(validate=_validate_cache_path), missing=list)
+    services = ListField(ServiceField(), data_key='service', missing=list)
     branch = SetField(fields.String(), missing=set)
     environments = ListField(SecureField(), data_key='env', missing=list)
     scripts = ListField(SecureField(), data_key='script', missing=list)
@@ -241,15 +285,11 @@ class SpecificationSchema(Schema):
             image = image + ':latest'
         data['image'] = image
 
-        env_map_list = []
-        for _env in data['environments']:
-            envs = _env.split()
-            env_map = {}
-            for env_str in envs:
-                key, val = env_str.split('=', 1)
-                env_map[key] = val
-            env_map_list.append(env_map)
-        data['environments'] = env_map_list
+        data['environments'] = [parse_env([env]) for env in data['environments']]
+
+        services = data['services']
+        data['services'] = [service for service in services if isinstance(service, str)]
+        data['sidecars'] = [service for service in services if not isinstance(service, str)]
         return data
 
 
@@ -258,6 +298,8 @@ class Specification(object):
         self.shell = 'bash'
         self.image = None
         self.services = []
+        # Services run in separate containers
+        self.sidecars = []
         self.scripts = []
         self.dockerfile = 'Dockerfile'
         self.docker = False  # Bind Docker sock to container or not
@@ -271,6 +313,10 @@ class Specification(object):
         self.environments = []
         self.linters = []
         self.privileged = False
+        # Containers each environment's tests are sharded into
+        self.parallel = 1
+        # Directories persisted between builds of a branch
+        self.cache = []
         self.deploy = []
         self.after_deploy = []
         self.artifacts = ObjectDict(
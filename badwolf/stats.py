@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from flask import Blueprint, jsonify
+
+from badwolf.extensions import bitbucket, queue, statuses
+
+
+blueprint = Blueprint('stats', __name__)
+
+
+@blueprint.route('/', methods=['GET'])
+def show_stats():
+    '''Counters of this process for monitoring'''
+    return jsonify({
+        'bitbucket': bitbucket.stats,
+        'build_status': {'coalesced': statuses.coalesced},
+        'queue': {'queued': queue.qsize()},
+    })
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import time
+import logging
+import threading
+import collections
+
+import requests
+
+from badwolf.bitbucket import BitbucketAPIError
+
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATES = frozenset(['SUCCESSFUL', 'FAILED', 'STOPPED'])
+
+
+class _StatusUpdate(object):
+    def __init__(self, build_status, state, description):
+        self.build_status = build_status
+        self.state = state
+        self.description = description
+        self.attempts = 0
+        self.not_before = 0
+
+    @property
+    def key(self):
+        return (self.build_status.repo, self.build_status.revision, self.build_status.key)
+
+
+class BuildStatusPublisher(object):
+    '''Publish Bitbucket build statuses in background threads
+
+    Updates are queued per (repository, commit, status key) and only the latest
+    queued state of a key is sent, intermediate states are dropped. Updates of
+    the same key are sent in order, failed ones are retried with backoff unless
+    a newer state is queued meanwhile. Pipelines :meth:`flush` their final
+    states before they finish.
+    '''
+    def __init__(self, app=None):
+        self.app = app
+        self.max_workers = 4
+        self.max_attempts = 5
+        self.flush_timeout = 60
+        # Seconds before first retry, doubled for each retry
+        self.retry_delay = 2
+        self._pending = collections.OrderedDict()
+        self._inflight = set()
+        self._cond = threading.Condition()
+        self._workers = []
+        self.coalesced = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_workers = app.config['BADWOLF_STATUS_WORKERS']
+        self.max_attempts = app.config['BADWOLF_STATUS_RETRIES'] + 1
+        self.flush_timeout = app.config['BADWOLF_STATUS_TIMEOUT']
+
+    def publish(self, build_status, state, description=None):
+        '''Queue a build status update, returns immediately'''
+        update = _StatusUpdate(build_status, state, description)
+        with self._cond:
+            previous = self._pending.get(update.key)
+            if previous is not None:
+                self.coalesced += 1
+                logger.debug('Build status %s of %s coalesced to %s', previous.state, update.key, state)
+            self._pending[update.key] = update
+            self._start_workers()
+            self._cond.notify_all()
+
+    def flush(self, revision=None, timeout=None):
+        '''Wait until queued updates, of commit ``revision`` if given, are sent
+
+        Returns ``False`` if some updates are still queued after ``timeout`` seconds.
+        '''
+        timeout = self.flush_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+
+        def is_pending(key):
+            return revision is None or key[1] == revision
+
+        with self._cond:
+            while any(is_pending(key) for key in list(self._pending) + list(self._inflight)):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.warning('Timed out waiting for build status updates of %s', revision)
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._work,
+                name='badwolf-status-{}'.format(len(self._workers))
+            )
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _next_update(self):
+        now = time.time()
+        wait = None
+        for key, update in self._pending.items():
+            if key in self._inflight:
+                continue
+            if update.not_before > now:
+                delay = update.not_before - now
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            del self._pending[key]
+            self._inflight.add(key)
+            return update, None
+        return None, wait
+
+    def _work(self):
+        while True:
+            with self._cond:
+                update, wait = self._next_update()
+                while update is None:
+                    self._cond.wait(wait)
+                    update, wait = self._next_update()
+
+            try:
+                self._send(update)
+            finally:
+                with self._cond:
+                    self._inflight.discard(update.key)
+                    self._cond.notify_all()
+
+    def _send(self, update):
+        update.attempts += 1
+        try:
+            update.build_status.update(update.state, description=update.description)
+        except (BitbucketAPIError, requests.RequestException) as exc:
+            code = getattr(exc, 'code', None)
+            # Intermediate states are soon replaced, only final states are worth retrying
+            retryable = update.state in FINAL_STATES and (code is None or code >= 500 or code == 429)
+            with self._cond:
+                superseded = update.key in self._pending
+                if retryable and not superseded and update.attempts < self.max_attempts:
+                    update.not_before = time.time() + min(60, self.retry_delay * 2 ** (update.attempts - 1))
+                    self._pending[update.key] = update
+                    logger.warning('Error updating build status %s of %s, retry later', update.state, update.key)
+                    return
+            if superseded:
+                return
+            from badwolf.extensions import sentry
+
+            logger.exception('Error updating build status %s of %s', update.state, update.key)
+            sentry.captureException()
+        else:
+            logger.debug('Build status of %s updated to %s', update.key, update.state)
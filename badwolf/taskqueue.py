@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import pickle
+import logging
+import sqlite3
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import Future
+
+from badwolf.exceptions import QueueFull
+from badwolf.utils import pid_alive
+
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    payload BLOB NOT NULL,
+    resources TEXT NOT NULL DEFAULT '{}',
+    state TEXT NOT NULL DEFAULT 'queued',
+    created_at REAL NOT NULL,
+    started_at REAL,
+    owner INTEGER
+)
+'''
+
+
+class TaskQueue(object):
+    '''Persistent, prioritized task queue backed by SQLite
+
+    Queued and running tasks are stored in ``BADWOLF_QUEUE_DB`` along with the pid of
+    the process running them, tasks whose process exited while running them are queued
+    again on next startup. Tasks with higher
+    priority run first, tasks with the same priority run in FIFO order.
+
+    Tasks may claim resources such as ``{'repo': 'owner/name'}``, at most
+    ``limits[kind]`` tasks holding the same resource run concurrently, and tasks of
+    the same priority are scheduled round-robin across repositories.
+
+    Tasks registered with ``on_position`` are told how many queued tasks will start
+    before them whenever that changes.
+    '''
+    def __init__(self, app=None):
+        self.app = app
+        self._tasks = {}
+        self._on_queued = {}
+        self._on_position = {}
+        self._positions = {}
+        self._futures = {}
+        self._cond = threading.Condition()
+        self._conn = None
+        self._workers = []
+        self._running = {}
+        self._started_seq = 0
+        self._last_started = {}
+        self.limits = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config['BADWOLF_WORKERS'] or 5 * multiprocessing.cpu_count()
+        self.max_size = app.config['BADWOLF_QUEUE_MAX_SIZE']
+        self.put_timeout = app.config['BADWOLF_QUEUE_PUT_TIMEOUT']
+        self.limits = {
+            'pipeline': app.config['BADWOLF_MAX_PIPELINES'],
+            'repo': app.config['BADWOLF_MAX_PIPELINES_PER_REPO'],
+            'docker_host': app.config['BADWOLF_MAX_PIPELINES_PER_DOCKER_HOST'],
+        }
+        self.open(app.config['BADWOLF_QUEUE_DB'])
+
+    def open(self, path):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._cond:
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute(_SCHEMA)
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')]
+            if 'owner' not in columns:
+                # Created by previous versions
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN owner INTEGER')
+
+    def register(self, name, func, on_queued=None, on_position=None):
+        '''Register task ``name``, ``on_queued(future, *args, **kwargs)`` is called when the
+        task is queued or recovered, before any worker may run it, and
+        ``on_position(future, position, *args, **kwargs)`` when its position in queue changes'''
+        self._tasks[name] = func
+        if on_queued is not None:
+            self._on_queued[name] = on_queued
+        if on_position is not None:
+            self._on_position[name] = on_position
+
+    def start(self):
+        '''Recover interrupted tasks and start worker threads'''
+        with self._cond:
+            if self._workers:
+                return
+            recovered = 0
+            pid = os.getpid()
+            for job_id, owner in self._conn.execute("SELECT id, owner FROM jobs WHERE state = 'running'").fetchall():
+                # Same pid as this process means the pid was reused, e.g. in a restarted container
+                if owner and owner != pid and pid_alive(owner):
+                    continue
+                self._conn.execute("UPDATE jobs SET state = 'queued', owner = NULL WHERE id = ?", (job_id,))
+                recovered += 1
+            if recovered:
+                logger.warning('Recovered %d interrupted task(s)', recovered)
+            rows = self._conn.execute("SELECT id, name, payload FROM jobs WHERE state = 'queued'").fetchall()
+            for job_id, name, payload in rows:
+                if job_id in self._futures:
+                    continue
+                future = self._futures[job_id] = self._create_future(job_id)
+                args, kwargs = pickle.loads(payload)
+                self._call_on_queued(name, future, args, kwargs)
+            self._report_positions()
+            for index in range(self.max_workers):
+                worker = threading.Thread(target=self._work, name='badwolf-worker-{}'.format(index))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        logger.info('Started %d task queue workers, %d task(s) queued', self.max_workers, self.qsize())
+
+    def qsize(self):
+        with self._cond:
+            return self._qsize()
+
+    def put(self, name, args=(), kwargs=None, priority=0, resources=None):
+        '''Queue a task, blocks up to ``put_timeout`` seconds when the queue is full
+
+        :param resources: dict of resource kind to resource name the task holds while running
+        :raises QueueFull: when there is still no room in queue after timeout
+        '''
+        payload = pickle.dumps((args, kwargs or {}))
+        resources = json.dumps(resources or {})
+        deadline = time.time() + self.put_timeout
+        with self._cond:
+            while self._qsize() >= self.max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise QueueFull('Task queue is full, {} tasks queued'.format(self.max_size))
+                self._cond.wait(remaining)
+
+            cursor = self._conn.execute(
+                'INSERT INTO jobs (name, priority, payload, resources, created_at) VALUES (?, ?, ?, ?, ?)',
+                (name, priority, payload, resources, time.time())
+            )
+            job_id = cursor.lastrowid
+            future = self._create_future(job_id)
+            self._futures[job_id] = future
+            # Workers wait for the lock, so the task can't start before this returns
+            self._call_on_queued(name, future, args, kwargs or {})
+            self._report_positions()
+            self._cond.notify_all()
+        logger.debug('Queued task %s #%d with priority %d', name, job_id, priority)
+        return future
+
+    def _call_on_queued(self, name, future, args, kwargs):
+        on_queued = self._on_queued.get(name)
+        if on_queued is None:
+            return
+        try:
+            on_queued(future, *args, **kwargs)
+        except Exception:
+            logger.exception('Error calling on_queued of task %s', name)
+
+    def _qsize(self):
+        return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+
+    def _create_future(self, job_id):
+        def _on_done(fut):
+            if fut.cancelled():
+                self._discard(job_id)
+
+        future = Future()
+        future.add_done_callback(_on_done)
+        return future
+
+    def _discard(self, job_id):
+        with self._cond:
+            self._conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            self._futures.pop(job_id, None)
+            self._running.pop(job_id, None)
+            self._report_positions()
+            self._cond.notify_all()
+
+    def _is_runnable(self, resources, running=None):
+        '''Whether a task holding ``resources`` is within limits, ``running`` counts
+        running tasks by (kind, name) of their resources'''
+        if running is None:
+            running = self._count_resources(self._running.values())
+        for kind, value in resources.items():
+            limit = self.limits.get(kind)
+            if limit and running[(kind, value)] >= limit:
+                return False
+        return True
+
+    @staticmethod
+    def _count_resources(resources_list):
+        return collections.Counter(item for resources in resources_list for item in resources.items())
+
+    @staticmethod
+    def _schedule_key(job_id, priority, resources, last_started):
+        # Repository started least recently goes first among tasks of the same priority
+        return -priority, last_started.get(resources.get('repo'), -1), job_id
+
+    def _next_job(self):
+        candidates = []
+        running = self._count_resources(self._running.values())
+        rows = self._conn.execute("SELECT id, priority, resources FROM jobs WHERE state = 'queued'")
+        for job_id, priority, resources in rows:
+            resources = json.loads(resources)
+            if not self._is_runnable(resources, running):
+                continue
+            key = self._schedule_key(job_id, priority, resources, self._last_started)
+            candidates.append((key, job_id, resources))
+        if not candidates:
+            return None
+
+        _, job_id, resources = min(candidates)
+        name, payload = self._conn.execute('SELECT name, payload FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return job_id, name, payload, resources
+
+    def _claim_next_job(self):
+        # Other processes may share the database, pick and claim the task in one write transaction
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            job = self._next_job()
+            claimed = job is not None and self._conn.execute(
+                "UPDATE jobs SET state = 'running', started_at = ?, owner = ? WHERE id = ? AND state = 'queued'",
+                (time.time(), os.getpid(), job[0])
+            ).rowcount == 1
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        if not claimed:
+            return None
+
+        job_id, name, payload, resources = job
+        self._running[job_id] = resources
+        self._started_seq += 1
+        if 'repo' in resources:
+            self._last_started[resources['repo']] = self._started_seq
+        self._positions.pop(job_id, None)
+        self._report_positions()
+        return job_id, name, payload
+
+    def _schedule_order(self):
+        '''Queued job ids in the order workers will start them
+
+        Follows the same priority, round-robin and limits as :meth:`_next_job`, when
+        limits hold back every queued task, running tasks are assumed to finish in the
+        order they started.
+        '''
+        jobs = [
+            (job_id, priority, json.loads(resources))
+            for job_id, priority, resources in self._conn.execute(
+                "SELECT id, priority, resources FROM jobs WHERE state = 'queued'"
+            )
+        ]
+        running = collections.deque(self._running.values())
+        counts = self._count_resources(running)
+        last_started = dict(self._last_started)
+        started_seq = self._started_seq
+        order = []
+        while jobs:
+            runnable = [job for job in jobs if self._is_runnable(job[2], counts)]
+            if not runnable:
+                if not running:
+                    # Limits can never be met, keep queue order
+                    order.extend(job[0] for job in jobs)
+                    break
+                counts.subtract(running.popleft().items())
+                continue
+            job = min(runnable, key=lambda job: self._schedule_key(*job, last_started))
+            jobs.remove(job)
+            order.append(job[0])
+            running.append(job[2])
+            counts.update(job[2].items())
+            started_seq += 1
+            if 'repo' in job[2]:
+                last_started[job[2]['repo']] = started_seq
+        return order
+
+    def _report_positions(self):
+        '''Call ``on_position`` of tasks whose position in queue changed'''
+        if not self._on_position:
+            return
+        positions = {job_id: position for position, job_id in enumerate(self._schedule_order())}
+        changed = [
+            (job_id, position) for job_id, position in positions.items()
+            # Tasks first in queue are about to start, only report them when they moved there
+            if self._positions.get(job_id, 0) != position
+        ]
+        self._positions = positions
+        for job_id, position in changed:
+            name, payload = self._conn.execute('SELECT name, payload FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            on_position = self._on_position.get(name)
+            future = self._futures.get(job_id)
+            if on_position is None or future is None:
+                continue
+            args, kwargs = pickle.loads(payload)
+            try:
+                if self.app is not None:
+                    with self.app.app_context():
+                        on_position(future, position, *args, **kwargs)
+                else:
+                    on_position(future, position, *args, **kwargs)
+            except Exception:
+                logger.exception('Error calling on_position of task %s', name)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._claim_next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._claim_next_job()
+                job_id, name, payload = job
+                future = self._futures.pop(job_id, None) or Future()
+
+            if future.set_running_or_notify_cancel():
+                self._execute(future, name, payload)
+            self._discard(job_id)
+
+    def _execute(self, future, name, payload):
+        func = self._tasks.get(name)
+        try:
+            if func is None:
+                raise LookupError('Task {} not registered'.format(name))
+            args, kwargs = pickle.loads(payload)
+            result = func(*args, **kwargs)
+        except Exception as exc:
+            logger.exception('Error running task %s', name)
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
@@ -1,21 +1,30 @@
 # -*- coding: utf-8 -*-
 import time
 import logging
-import multiprocessing
 from concurrent.futures import ThreadPoolExecutor
 try:
     import re2 as re
 except ImportError:
     import re
 
-from badwolf.extensions import sentry, bitbucket
+import git
+from flask import current_app, url_for
+
+from badwolf.extensions import sentry, bitbucket, queue, registry, statuses
 from badwolf.bitbucket import PullRequest, BuildStatus, BitbucketAPIError
+from badwolf.mirror import RepositoryMirror, merge_tree_supported
 from badwolf.pipeline import Pipeline
 
 
 logger = logging.getLogger(__name__)
-executor = ThreadPoolExecutor(max_workers=5 * multiprocessing.cpu_count())
 _MERGE_COMMIT_RE = re.compile(r'[mM]erged?.*?pull request #(\d+)')
+# Tag and branch builds may trigger deployments, run them ahead of pull requests
+PIPELINE_PRIORITIES = {
+    'tag': 30,
+    'branch': 20,
+    'commit': 10,
+    'pullrequest': 0,
+}
 
 
 def _run_task(_task_func, *args, **kwargs):
@@ -30,40 +39,160 @@ def _run_task(_task_func, *args, **kwargs):
         sentry.captureException()
 
 
-def async_task(f):
-    def delay(*args, **kwargs):
-        # return _run_task(f, *args, **kwargs)
-        return executor.submit(_run_task, f, *args, **kwargs)
-    f.delay = delay
-    return f
+def async_task(f=None, priority=None, resources=None, on_queued=None, on_position=None):
+    """Make function runnable in task queue by ``f.delay(*args, **kwargs)``
 
+    :param priority: optional callable returns task priority from task arguments
+    :param resources: optional callable returns resources held by task from task arguments,
+                      used to limit task concurrency
+    :param on_queued: optional callable called with task future and arguments when task
+                      is queued or recovered on restart
+    :param on_position: optional callable called with task future, number of tasks ahead of it
+                        and task arguments when its position in queue changes
+    """
+    def decorator(f):
+        name = '{}.{}'.format(f.__module__, f.__name__)
 
-@async_task
+        def run(*args, **kwargs):
+            return _run_task(f, *args, **kwargs)
+
+        def delay(*args, **kwargs):
+            task_priority = priority(*args, **kwargs) if priority else 0
+            task_resources = resources(*args, **kwargs) if resources else None
+            return queue.put(name, args, kwargs, priority=task_priority, resources=task_resources)
+
+        queue.register(name, run, on_queued=on_queued, on_position=on_position)
+        f.delay = delay
+        return f
+
+    if f is None:
+        return decorator
+    return decorator(f)
+
+
+def _pipeline_priority(context):
+    priority = PIPELINE_PRIORITIES.get(context.type, 0)
+    if context.rebuild:
+        priority -= 1
+    return priority
+
+
+def _pipeline_resources(context):
+    return {
+        'pipeline': 'all',
+        'repo': context.repository,
+        'docker_host': current_app.config['DOCKER_HOST'],
+    }
+
+
+def _register_pipeline(future, context):
+    registry.register(context, future)
+
+
+def _report_pipeline_position(future, position, context):
+    commit_hash = context.source['commit']['hash']
+    build_status = BuildStatus(
+        bitbucket,
+        context.source['repository']['full_name'],
+        commit_hash,
+        'badwolf/test',
+        url_for('log.build_log', sha=commit_hash, task_id=context.task_id, _external=True)
+    )
+    if position:
+        description = 'Queued, {} pipeline(s) ahead'.format(position)
+    else:
+        description = 'Queued, next to run'
+    statuses.publish(build_status, 'INPROGRESS', description=description)
+
+
+@async_task(
+    priority=_pipeline_priority,
+    resources=_pipeline_resources,
+    on_queued=_register_pipeline,
+    on_position=_report_pipeline_position
+)
 def start_pipeline(context):
     Pipeline(context).start()
 
 
 @async_task
 def check_pr_mergeable(context):
-    repo = bitbucket.get('2.0/repositories/{}'.format(context.repository))
+    repo = bitbucket.get(
+        '2.0/repositories/{}'.format(context.repository),
+        ttl=current_app.config['BITBUCKET_REPO_CACHE_TTL']
+    )
     main_branch = repo['mainbranch']['name']
     current_branch = context.source['branch']['name']
     if current_branch != 'master' and current_branch != main_branch:
         logger.info('Current branch %s is not main branch %s', current_branch, main_branch)
         return
 
-    time.sleep(5)  # wait for Bitbucket merge process ready
     pr = PullRequest(bitbucket, context.repository)
-    open_prs = pr.list(state='OPEN')['values']
+    open_prs = pr.list_all(
+        state='OPEN',
+        query='destination.branch.name="{}"'.format(current_branch)
+    )
+    # Filter again in case query is ignored
+    open_prs = [p for p in open_prs if p['destination']['branch']['name'] == current_branch]
     if not open_prs:
-        logger.debug('No opening pull requests found')
+        logger.debug('No opening pull requests targeting %s found', current_branch)
         return
 
-    for open_pr in open_prs:
-        check_mergeable(context, pr, open_pr)
+    # Bitbucket merge process needs time to be ready, API is not queried before
+    api_ready_at = time.time() + 5
+    mirror = _sync_mirror(context.repository)
+
+    app = current_app._get_current_object()
+    max_workers = min(len(open_prs), current_app.config['BADWOLF_MERGEABLE_WORKERS'])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for open_pr in open_prs:
+            executor.submit(_check_mergeable, app, context, pr, open_pr, mirror, api_ready_at)
 
 
-def check_mergeable(context, pr_api, pr_info):
+def _sync_mirror(full_name):
+    """Up to date mirror of repository for checking mergeability locally, ``None`` if unavailable"""
+    if not current_app.config['BADWOLF_MIRROR_ENABLED'] or not merge_tree_supported():
+        return None
+
+    mirror = RepositoryMirror(current_app.config['BADWOLF_MIRROR_DIR'], full_name)
+    try:
+        with mirror.lock():
+            mirror.sync()
+    except (OSError, git.GitCommandError):
+        logger.exception('Error syncing mirror of repository %s', full_name)
+        return None
+    return mirror
+
+
+def _check_mergeable(app, context, pr_api, pr_info, mirror, api_ready_at):
+    with app.app_context():
+        try:
+            check_mergeable(context, pr_api, pr_info, mirror, api_ready_at)
+        except Exception:
+            logger.exception('Error checking mergeability of pull request #%s', pr_info['id'])
+            sentry.captureException()
+
+
+def is_mergeable(context, pr_api, pr_info, mirror=None, api_ready_at=0):
+    """Whether pull request merges cleanly into the pushed commit of its target branch
+
+    Bitbucket API is only queried after ``api_ready_at`` when it can't be checked locally.
+    """
+    if mirror is not None and pr_info['source']['repository']['full_name'] == context.repository:
+        try:
+            return mirror.can_merge(context.source['commit']['hash'], pr_info['source']['commit']['hash'])
+        except git.GitCommandError:
+            logger.warning('Error checking mergeability of pull request #%s locally, fallback to API',
+                           pr_info['id'], exc_info=True)
+
+    delay = api_ready_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    diff = pr_api.diff(pr_info['id'], raw=True)
+    return '+<<<<<<< destination:' not in diff
+
+
+def check_mergeable(context, pr_api, pr_info, mirror=None, api_ready_at=0):
     pr_id = pr_info['id']
     merge_status = BuildStatus(
         bitbucket,
@@ -84,8 +213,7 @@ def check_mergeable(context, pr_api, pr_info):
         if status['state'] == 'SUCCESSFUL':
             notify = True
 
-    diff = pr_api.diff(pr_id, raw=True)
-    if '+<<<<<<< destination:' not in diff:
+    if is_mergeable(context, pr_api, pr_info, mirror, api_ready_at):
         # Mergeable
         logger.info('Pull request #%s is mergeable', pr_id)
         if status['state'] != 'SUCCESSFUL':
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import io
 import os
 import logging
 import subprocess
@@ -73,19 +74,35 @@ def sanitize_sensitive_data(s):
 
 
 def _sanitize_urls(s):
+    if '@' not in s:
+        return s
+
     def remove_basic_auth(match):
         return '{}***:***@{}'.format(
             match.group('protocol'),
             match.group('address'),
         )
-    ret = []
-    for line in s.split('\n'):
-        ret.append(BASIC_AUTH_URL_RE.sub(remove_basic_auth, line))
-    return '\n'.join(ret)
+    # URLs never span lines, the pattern matches no whitespace
+    return BASIC_AUTH_URL_RE.sub(remove_basic_auth, s)
+
+
+def pid_alive(pid):
+    """Whether process ``pid`` of this host is still running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
 
 
-def run_command(command, split=False, include_errors=False, cwd=None, shell=False, env=None):
-    """Run command in subprocess and return exit code and output"""
+def run_command(command, split=False, include_errors=False, cwd=None, shell=False, env=None, timeout=None):
+    """Run command in subprocess and return exit code and output
+
+    :raises subprocess.TimeoutExpired: when ``timeout`` is set and the command
+                                       doesn't finish in time, it's killed then.
+    """
     sub_env = os.environ.copy()
     if env is not None:
         sub_env.update(env)
@@ -104,11 +121,16 @@ def run_command(command, split=False, include_errors=False, cwd=None, shell=Fals
         cwd=cwd,
         env=sub_env
     )
+    try:
+        output, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        logger.warning('subprocess %s killed after %s seconds', command, timeout)
+        raise
     if split:
-        output = process.stdout.readlines()
-    else:
-        output = process.stdout.read()
+        output = io.StringIO(output).readlines()
 
-    return_code = process.wait()
+    return_code = process.returncode
     logger.debug('subprocess %s returned %d, output: %s', command, return_code, output)
     return return_code, output
@@ -2,20 +2,19 @@
 import json
 import logging
 
-from docker import DockerClient
 from flask import Blueprint, request, current_app, url_for, jsonify
 
 from badwolf.context import Context
 from badwolf.tasks import start_pipeline, check_pr_mergeable
-from badwolf.extensions import bitbucket, sentry
+from badwolf.extensions import bitbucket, sentry, registry, docker, statuses
 from badwolf.bitbucket import BitbucketAPIError, PullRequest, BuildStatus, Hooks
+from badwolf.exceptions import QueueFull
 
 
 logger = logging.getLogger(__name__)
 blueprint = Blueprint('webhook', __name__)
 
 _EVENT_HANDLERS = {}
-_RUNNING_PIPELINES = {}
 
 
 def register_event_handler(event_key):
@@ -27,52 +26,54 @@ def register_event_handler(event_key):
 
 def _cancel_outdated_pipelines(context):
     from docker.errors import NotFound, APIError
-    docker = DockerClient(
-        base_url=current_app.config['DOCKER_HOST'],
-        timeout=current_app.config['DOCKER_API_TIMEOUT'],
-        version='auto',
-    )
-    containers = docker.containers.list(filters=dict(
-        status='running',
-        label='repo={}'.format(context.repository),
-    ))
-    if not containers:
-        return
-
-    for container in containers:
-        labels = container.labels
-        if context.type == 'tag':
-            continue
-        if context.pr_id and labels.get('pull_request') != str(context.pr_id):
-            continue
-        if context.type == 'branch' and labels.get('branch') != context.source['branch']['name']:
-            continue
 
-        task_id = labels.get('task_id')
-        if not task_id:
-            continue
-
-        future = _RUNNING_PIPELINES.get(task_id)
-        if not future or future.cancelled():
-            continue
+    handles = registry.supersede(context)
+    if not handles:
+        return
 
-        commit = labels['commit']
+    for handle in handles:
         if context.pr_id:
             logger.info('Cancelling outdated pipeline for %s pull request #%s @%s',
                         context.repository,
                         context.pr_id,
-                        commit)
+                        handle.commit)
         else:
-            logger.info('Cancelling outdated pipeline for %s @%s', context.repository, commit)
-        # cancel the future and remove the container
-        try:
-            container.remove(force=True)
-        except NotFound:
-            pass
-        except APIError as exc:
-            if 'already in progress' not in exc.explanation:
-                raise
-        future.cancel()
+            logger.info('Cancelling outdated pipeline for %s @%s', context.repository, handle.commit)
+
+        if handle.future.cancelled():
+            # Still queued, it will never run
+            build_status = BuildStatus(
+                bitbucket,
+                context.source['repository']['full_name'],
+                handle.commit,
+                'badwolf/test',
+                url_for('log.build_log', sha=handle.commit, task_id=handle.task_id, _external=True)
+            )
+            statuses.publish(build_status, 'STOPPED', description='build cancelled')
+            continue
+
+        # Running pipeline stops at its next phase, remove the container if tests already started
+        containers = docker.containers.list(filters={
+            'status': 'running',
+            'label': 'task_id={}'.format(handle.task_id),
+        })
+        for container in containers:
+            try:
+                container.remove(force=True)
+            except NotFound:
+                pass
+            except APIError as exc:
+                if 'already in progress' not in exc.explanation:
+                    raise
+
+
+def _start_pipeline(context):
+    try:
+        _cancel_outdated_pipelines(context)
+    except Exception:
+        sentry.captureException()
+    # Registered by the task queue before any worker may start it
+    return start_pipeline.delay(context)
 
 
 @blueprint.route('/register/<user>/<repo>', methods=['POST'])
@@ -124,7 +125,11 @@ def webhook_push():
     # FIXME: process Gitlab webhook
     handler = _EVENT_HANDLERS.get(event_key)
     if handler:
-        return handler(payload) or ''
+        try:
+            return handler(payload) or ''
+        except QueueFull:
+            logger.error('Task queue is full, rejecting %s webhook event %s', provider, event_key)
+            return 'Service unavailable', 503
     return ''
 
 
@@ -182,13 +187,7 @@ def handle_repo_push(payload):
             rebuild=rebuild,
             nocache=nocache
         )
-        try:
-            _cancel_outdated_pipelines(context)
-        except Exception:
-            sentry.captureException()
-        future = start_pipeline.delay(context)
-        future.add_done_callback(lambda fut: _RUNNING_PIPELINES.pop(context.task_id, None))
-        _RUNNING_PIPELINES[context.task_id] = future
+        _start_pipeline(context)
         if push_type == 'branch':
             check_pr_mergeable.delay(context)
 
@@ -232,13 +231,7 @@ def handle_pull_request(payload):
         pr_id=pr['id'],
         skip_lint=skip_lint
     )
-    try:
-        _cancel_outdated_pipelines(context)
-    except Exception:
-        sentry.captureException()
-    future = start_pipeline.delay(context)
-    future.add_done_callback(lambda fut: _RUNNING_PIPELINES.pop(context.task_id, None))
-    _RUNNING_PIPELINES[context.task_id] = future
+    _start_pipeline(context)
 
 
 @register_event_handler('pullrequest:approved')
@@ -327,7 +320,7 @@ def handle_repo_commit_comment(payload):
         rebuild=rebuild,
         nocache=nocache,
     )
-    start_pipeline.delay(context)
+    _start_pipeline(context)
 
 
 @register_event_handler('pullrequest:comment_created')
@@ -367,10 +360,4 @@ def handle_pull_request_comment(payload):
         nocache=nocache,
         skip_lint=skip_lint
     )
-    try:
-        _cancel_outdated_pipelines(context)
-    except Exception:
-        sentry.captureException()
-    future = start_pipeline.delay(context)
-    future.add_done_callback(lambda fut: _RUNNING_PIPELINES.pop(context.task_id, None))
-    _RUNNING_PIPELINES[context.task_id] = future
+    _start_pipeline(context)
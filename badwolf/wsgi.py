@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 from badwolf import create_app
+from badwolf.extensions import queue
 
 
 app = create_app()
+queue.start()
@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
+import os
+
 import pytest
 
+# Don't persist tasks queued by tests
+os.environ.setdefault('BADWOLF_QUEUE_DB', ':memory:')
+# Don't replay lint results from previous test runs
+os.environ.setdefault('BADWOLF_LINT_CACHE_ENABLED', 'false')
+
 
 @pytest.fixture(scope='module')
 def app(request):
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest.mock as mock
+
+import pytest
+import requests
+
+from badwolf.bitbucket import (
+    Bitbucket, BitbucketAPIError, CircuitOpenError, OAuth2Dispatcher, PullRequest, get_stats
+)
+
+
+def make_response(status_code, data=None, headers=None):
+    res = requests.Response()
+    res.status_code = status_code
+    res._content = json.dumps(data or {}).encode('utf-8')
+    res.headers.update(headers or {})
+    return res
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    with mock.patch('badwolf.bitbucket.time.sleep') as sleep:
+        yield sleep
+
+
+def test_retry_idempotent_request_on_server_error():
+    dispatcher = mock.Mock()
+    dispatcher.dispatch.side_effect = [
+        make_response(503),
+        requests.ConnectionError(),
+        make_response(200, {'name': 'master'}),
+    ]
+    client = Bitbucket(dispatcher, timeout=10, max_retries=3)
+    assert client.get('2.0/repositories/deepanalyzer/badwolf') == {'name': 'master'}
+    assert dispatcher.dispatch.call_count == 3
+    assert dispatcher.dispatch.call_args[1]['timeout'] == 10
+
+
+def test_no_retry_post_on_server_error():
+    dispatcher = mock.Mock()
+    dispatcher.dispatch.side_effect = [make_response(503), make_response(200)]
+    client = Bitbucket(dispatcher, max_retries=3)
+    with pytest.raises(BitbucketAPIError) as exc_info:
+        client.post('2.0/repositories/deepanalyzer/badwolf/hooks')
+    assert exc_info.value.code == 503
+    assert dispatcher.dispatch.call_count == 1
+
+
+def test_retry_throttled_request_after_retry_after(no_sleep):
+    dispatcher = mock.Mock()
+    dispatcher.dispatch.side_effect = [
+        make_response(429, headers={'Retry-After': '7'}),
+        make_response(200),
+    ]
+    client = Bitbucket(dispatcher, throttle_retries=1)
+    throttled = []
+    client.post('2.0/repositories/deepanalyzer/badwolf/hooks', on_throttled=throttled.append)
+    no_sleep.assert_called_once_with(7)
+    assert throttled == [7]
+
+    dispatcher.dispatch.side_effect = [make_response(429), make_response(200)]
+    client = Bitbucket(dispatcher, max_retries=3)
+    with pytest.raises(BitbucketAPIError) as exc_info:
+        client.post('2.0/repositories/deepanalyzer/badwolf/hooks')
+    # Retried by throttle_retries only
+    assert exc_info.value.code == 429
+
+
+def test_refresh_oauth_token_once():
+    dispatcher = OAuth2Dispatcher('key', 'secret')
+    with mock.patch.object(dispatcher, 'dispatch') as dispatch,\
+            mock.patch.object(dispatcher, 'refresh_access_token') as refresh:
+        dispatch.return_value = make_response(401)
+        client = Bitbucket(dispatcher, max_retries=3)
+        with pytest.raises(BitbucketAPIError) as exc_info:
+            client.get('2.0/user')
+    assert exc_info.value.code == 401
+    assert refresh.call_count == 1
+    assert dispatch.call_count == 2
+
+
+def test_circuit_breaker_short_circuits_calls():
+    dispatcher = mock.Mock()
+    dispatcher.dispatch.return_value = make_response(500)
+    client = Bitbucket(dispatcher, failure_threshold=2, reset_timeout=60)
+    url = 'https://circuit.bitbucket.test/2.0/user'
+    for _ in range(2):
+        with pytest.raises(BitbucketAPIError):
+            client.get(url)
+
+    short_circuited = get_stats().get('short_circuited', 0)
+    with pytest.raises(CircuitOpenError):
+        client.get(url)
+    assert dispatcher.dispatch.call_count == 2
+    assert get_stats()['short_circuited'] == short_circuited + 1
+
+
+def test_pull_request_all_comments_fetches_pages_concurrently():
+    def get(endpoint, params):
+        page = params['page']
+        assert params['fields'] == 'values.id,values.content.raw,size,page,pagelen,next'
+        res = {
+            'values': [{'id': page * 10 + i} for i in range(2 if page < 3 else 1)],
+            'page': page,
+            'pagelen': 2,
+            'size': 5,
+        }
+        if page < 3:
+            res['next'] = 'https://api.bitbucket.org/next'
+        return res
+
+    client = mock.Mock()
+    client.get.side_effect = get
+    pr = PullRequest(client, 'deepanalyzer/badwolf')
+    comments = pr.all_comments(1, size=2, fields=('id', 'content.raw'))
+    assert [c['id'] for c in comments] == [10, 11, 20, 21, 30]
+    assert client.get.call_count == 3
+    assert [c['id'] for c in pr.iter_comments(1, size=2, fields=('id', 'content.raw'))] == [10, 11, 20, 21, 30]
+
+
+def test_conditional_get_revalidates_cached_response():
+    dispatcher = mock.Mock()
+    dispatcher.dispatch.side_effect = [
+        make_response(200, {'values': []}, headers={'ETag': '"v1"'}),
+        make_response(304),
+        make_response(201, {'uuid': '1'}),
+        make_response(200, {'values': [{'uuid': '1'}]}, headers={'ETag': '"v2"'}),
+    ]
+    client = Bitbucket(dispatcher, cache_size=10)
+    endpoint = '2.0/repositories/deepanalyzer/badwolf/hooks'
+    assert client.get(endpoint) == {'values': []}
+    assert client.get(endpoint) == {'values': []}
+    assert dispatcher.dispatch.call_args[1]['headers'] == {'If-None-Match': '"v1"'}
+
+    client.post(endpoint, data={'url': 'http://badwolf'})
+    assert client.get(endpoint) == {'values': [{'uuid': '1'}]}
+    assert 'headers' not in dispatcher.dispatch.call_args[1]
+
+
+def test_get_with_ttl_served_from_cache():
+    dispatcher = mock.Mock()
+    dispatcher.dispatch.return_value = make_response(200, {'mainbranch': {'name': 'master'}})
+    client = Bitbucket(dispatcher, cache_size=10)
+    repo = client.get('2.0/repositories/deepanalyzer/badwolf', ttl=60)
+    repo['mainbranch']['name'] = 'develop'
+    assert client.get('2.0/repositories/deepanalyzer/badwolf', ttl=60) == {'mainbranch': {'name': 'master'}}
+    assert dispatcher.dispatch.call_count == 1
+
+
+def test_stats_view(test_client):
+    res = test_client.get('/stats/')
+    assert res.status_code == 200
+    stats = res.get_json()
+    assert stats['bitbucket'] == get_stats()
+    assert 'coalesced' in stats['build_status']
+    assert 'queued' in stats['queue']
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from badwolf.buildcache import BuildCache, evict_build_caches
+
+
+def write_file(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'0' * size)
+
+
+def test_mount_build_cache(tmpdir):
+    cache = BuildCache(str(tmpdir), 'deepanalyzer/badwolf', 'feature/cache')
+    with cache.mount(['~/.cache/pip', 'node_modules'], '/root', '/repo') as volumes:
+        assert sorted(v['bind'] for v in volumes.values()) == ['/repo/node_modules', '/root/.cache/pip']
+        for host_path in volumes:
+            assert os.path.isdir(host_path)
+            assert host_path.startswith(cache.path)
+
+
+def test_build_cache_seeded_from_fallback_branch(tmpdir):
+    master = BuildCache(str(tmpdir), 'deepanalyzer/badwolf', 'master')
+    with master.mount(['node_modules'], '/root', '/repo') as volumes:
+        host_path = list(volumes)[0]
+        write_file(os.path.join(host_path, 'package.js'), 10)
+
+    cache = BuildCache(str(tmpdir), 'deepanalyzer/badwolf', 'feature', fallback_branch='master')
+    with cache.mount(['node_modules'], '/root', '/repo') as volumes:
+        host_path = list(volumes)[0]
+        assert os.path.exists(os.path.join(host_path, 'package.js'))
+
+
+def test_build_cache_in_use(tmpdir):
+    cache = BuildCache(str(tmpdir), 'deepanalyzer/badwolf', 'master')
+    other = BuildCache(str(tmpdir), 'deepanalyzer/badwolf', 'master')
+    with cache.mount(['node_modules'], '/root', '/repo') as volumes:
+        assert volumes
+        with other.mount(['node_modules'], '/root', '/repo') as other_volumes:
+            assert other_volumes == {}
+            # Locked caches are never evicted
+            assert evict_build_caches(str(tmpdir), 1) == []
+    with other.mount(['node_modules'], '/root', '/repo') as other_volumes:
+        assert other_volumes
+
+
+def test_evict_build_caches(tmpdir):
+    paths = []
+    for i, branch in enumerate(['old', 'new']):
+        cache = BuildCache(str(tmpdir), 'deepanalyzer/badwolf', branch)
+        with cache.mount(['node_modules'], '/root', '/repo') as volumes:
+            write_file(os.path.join(list(volumes)[0], 'data'), 100)
+        os.utime(cache.path, (time.time() - 100 + i, time.time() - 100 + i))
+        paths.append(cache.path)
+
+    assert evict_build_caches(str(tmpdir), 1000) == []
+    assert evict_build_caches(str(tmpdir), 150) == [paths[0]]
+    assert not os.path.exists(paths[0])
+    assert os.path.exists(paths[1])
+
+
+def test_build_cache_snapshot(tmpdir):
+    cache = BuildCache(str(tmpdir), 'deepanalyzer/badwolf', 'master')
+    with cache.mount(['node_modules'], '/root', '/repo') as volumes:
+        cached_path = list(volumes)[0]
+        write_file(os.path.join(cached_path, 'package.js'), 10)
+
+    with cache.snapshot(['node_modules'], '/root', '/repo') as volumes:
+        host_path = list(volumes)[0]
+        assert host_path != cached_path
+        assert volumes[host_path]['bind'] == '/repo/node_modules'
+        assert os.path.exists(os.path.join(host_path, 'package.js'))
+        write_file(os.path.join(host_path, 'evil.js'), 10)
+        # Snapshots are never evicted as caches
+        assert evict_build_caches(str(tmpdir), 1) == [cache.path]
+    assert not os.path.exists(host_path)
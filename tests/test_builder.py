@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest.mock as mock
+
+from docker.errors import APIError, ImageNotFound
+
+from badwolf.spec import Specification, SecureString
+from badwolf.context import Context
+from badwolf.builder import Builder
+
+
+def make_builder(tmpdir, environments):
+    context = Context(
+        'deepanalyzer/badwolf',
+        {'username': 'badwolf', 'display_name': 'badwolf'},
+        'commit',
+        'Test build matrix',
+        {
+            'repository': {'full_name': 'deepanalyzer/badwolf'},
+            'branch': {'name': 'master'},
+            'commit': {'hash': '2cedc1af762'},
+        }
+    )
+    context.clone_path = str(tmpdir)
+    spec = Specification()
+    spec.scripts = ['py.test']
+    spec.environments = environments
+    with mock.patch('badwolf.builder.docker'):
+        builder = Builder(context, spec, build_status=mock.Mock(key='badwolf/test', url='http://badwolf/log'))
+    builder.log_dir = str(tmpdir.join('log'))
+    return builder
+
+
+def test_build_matrix_runs_every_environment(app, tmpdir):
+    with app.test_request_context():
+        builder = make_builder(tmpdir, [{'PY': '2'}, {'PY': '3'}])
+
+    def run_in_container(image, env, log_dir=None, build_status=None, extra_labels=None):
+        assert build_status.key == 'badwolf/test/{}'.format(extra_labels['env'])
+        return (0 if env['PY'] == '3' else 1), None
+
+    with app.test_request_context(), \
+            mock.patch.object(builder, 'get_docker_image', return_value=('badwolf:1', '')), \
+            mock.patch.object(builder, 'run_in_container', side_effect=run_in_container), \
+            mock.patch('badwolf.builder.statuses') as statuses:
+        assert builder.run() == 1
+
+    published = [(call[0][0].key, call[0][1]) for call in statuses.publish.call_args_list]
+    assert ('badwolf/test/1', 'FAILED') in published
+    assert ('badwolf/test/2', 'SUCCESSFUL') in published
+    assert published[-1] == ('badwolf/test', 'FAILED')
+    assert statuses.publish.call_args[1]['description'] == '1 of 2 tests failed'
+    assert os.path.exists(os.path.join(builder.log_dir, '1', 'build.html'))
+    with open(os.path.join(builder.log_dir, 'build.html')) as f:
+        assert '#2</a> PY=3: succeed' in f.read()
+
+
+def test_test_shards_of_environments(app, tmpdir):
+    with app.test_request_context():
+        builder = make_builder(tmpdir, [{'PY': '2'}, {'PY': '3'}])
+    builder.spec.parallel = 2
+    environments = builder.get_run_environments()
+    assert environments == [
+        {'PY': '2', 'BADWOLF_NODE_INDEX': '0', 'BADWOLF_NODE_TOTAL': '2'},
+        {'PY': '2', 'BADWOLF_NODE_INDEX': '1', 'BADWOLF_NODE_TOTAL': '2'},
+        {'PY': '3', 'BADWOLF_NODE_INDEX': '0', 'BADWOLF_NODE_TOTAL': '2'},
+        {'PY': '3', 'BADWOLF_NODE_INDEX': '1', 'BADWOLF_NODE_TOTAL': '2'},
+    ]
+    assert Builder._describe_environment(environments[1]) == 'PY=2 node 2/2'
+    assert Builder._describe_environment({'PY': '3', 'TOKEN': SecureString('secret')}) == 'PY=3 TOKEN'
+
+
+def test_build_matrix_environment_error(app, tmpdir):
+    with app.test_request_context():
+        builder = make_builder(tmpdir, [{'PY': '2'}, {'PY': '3'}])
+
+    def run_in_container(image, env, log_dir=None, build_status=None, extra_labels=None):
+        if env['PY'] == '2':
+            raise APIError('No such image')
+        return 0, None
+
+    with app.test_request_context(), \
+            mock.patch.object(builder, 'get_docker_image', return_value=('badwolf:1', '')), \
+            mock.patch.object(builder, 'run_in_container', side_effect=run_in_container), \
+            mock.patch('badwolf.builder.statuses') as statuses:
+        assert builder.run() == -1
+
+    published = [(call[0][0].key, call[0][1]) for call in statuses.publish.call_args_list]
+    assert ('badwolf/test/1', 'FAILED') in published
+    assert ('badwolf/test/2', 'SUCCESSFUL') in published
+    assert published[-1] == ('badwolf/test', 'FAILED')
+    with open(os.path.join(builder.log_dir, 'build.html')) as f:
+        assert '#1</a> PY=2: failed, exit code -1' in f.read()
+
+
+def test_mount_build_cache(app, tmpdir):
+    with app.test_request_context():
+        builder = make_builder(tmpdir, [])
+        builder.context.target = {'branch': {'name': 'develop'}}
+        builder.spec.cache = ['~/.cache/pip']
+        app.config['BADWOLF_BUILD_CACHE_DIR'] = str(tmpdir.join('cache'))
+        with builder.mount_build_cache() as volumes:
+            assert [v['bind'] for v in volumes.values()] == ['/root/.cache/pip']
+            assert list(volumes)[0].startswith(str(tmpdir.join('cache', 'deepanalyzer', 'badwolf')))
+
+        # Pull request from fork
+        builder.context.source['repository']['full_name'] = 'evil/badwolf'
+        with builder.mount_build_cache() as volumes:
+            host_path = list(volumes)[0]
+            assert host_path.startswith(str(tmpdir.join('cache', '.snapshots')))
+        assert not os.path.exists(host_path)
+
+        builder.spec.cache = []
+        with builder.mount_build_cache() as volumes:
+            assert volumes == {}
+
+
+def test_build_cache_shared_by_test_shards(app, tmpdir):
+    with app.test_request_context():
+        builder = make_builder(tmpdir, [])
+        builder.spec.cache = ['node_modules']
+        builder.spec.parallel = 2
+        builder.context.target = {'branch': {'name': 'master'}}
+        app.config['BADWOLF_BUILD_CACHE_DIR'] = str(tmpdir.join('cache'))
+
+    mounted = []
+
+    def run_in_container(image, env, log_dir=None, build_status=None, extra_labels=None):
+        mounted.append(dict(builder.cache_volumes))
+        return 0, None
+
+    with app.test_request_context(), \
+            mock.patch.object(builder, 'get_docker_image', return_value=('badwolf:1', '')), \
+            mock.patch.object(builder, 'run_in_container', side_effect=run_in_container), \
+            mock.patch('badwolf.builder.evict_build_caches') as evict, \
+            mock.patch('badwolf.builder.statuses'):
+        assert builder.run() == 0
+
+    assert len(mounted) == 2
+    assert mounted[0] and mounted[0] == mounted[1]
+    assert evict.call_count == 1
+
+
+def test_docker_image_reused_across_builds(app, tmpdir):
+    tmpdir.join('Dockerfile').write('FROM python:3.6\nARG PY\nCOPY requirements.txt /tmp/\n')
+    tmpdir.join('requirements.txt').write('requests\n')
+    images = []
+    with app.test_request_context():
+        builders = [make_builder(tmpdir, [{'PY': '3'}]) for _ in range(2)]
+    builders[1].context.source['branch']['name'] = 'feature'
+    builders[1].context.source['commit']['hash'] = '8a2dd0f1c3e'
+    for builder in builders:
+        builder.docker.images.get.side_effect = lambda name: images[0] if name in images else _not_found(name)
+        builder.docker.api.build.side_effect = lambda path, tag, **kwargs: (
+            images.append(tag) or iter([{'stream': 'Successfully tagged {}'.format(tag)}])
+        )
+
+    with app.test_request_context(), mock.patch('badwolf.builder.ImageCache'):
+        first, _ = builders[0].get_docker_image()
+        second, _ = builders[1].get_docker_image()
+
+    assert builders[0].context.environment != builders[1].context.environment
+    assert first.startswith('deepanalyzer-badwolf:')
+    assert second == first
+    builders[1].docker.api.build.assert_not_called()
+
+
+def _not_found(name):
+    raise ImageNotFound(name)
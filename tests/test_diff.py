@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from unidiff import PatchSet
+
+from badwolf.diff import iter_lines, parse_diff
+from badwolf.lint import Problems
+
+
+DIFF = """diff --git a/a.py b/a.py
+new file mode 100644
+index 0000000..fdeea15
+--- /dev/null
++++ b/a.py
+@@ -0,0 +1,3 @@
++# -*- coding: utf-8 -*-
++
++x = 1
+diff --git a/b.py b/b.py
+index 1111111..2222222 100644
+--- a/b.py
++++ b/b.py
+@@ -1,5 +1,6 @@
+ import os
+-import sys
++import re
++import json
+ 
+ 
+ def main():
+@@ -10,2 +11,3 @@ def main():
+     pass
++    return
+ \\ No newline at end of file
+diff --git a/c.py b/c.py
+deleted file mode 100644
+index 3333333..0000000
+--- a/c.py
++++ /dev/null
+@@ -1,2 +0,0 @@
+-import os
+-import sys
+diff --git a/logo.png b/logo.png
+new file mode 100644
+index 0000000..4444444
+Binary files /dev/null and b/logo.png differ
+"""
+
+
+def test_parse_diff():
+    changes = parse_diff(iter_lines(DIFF[i:i + 7] for i in range(0, len(DIFF), 7)))
+    assert [f.path for f in changes.added_files] == ['a.py']
+    assert [f.path for f in changes.modified_files] == ['b.py']
+    assert [f.path for f in changes.removed_files] == ['c.py']
+    assert changes['logo.png'].is_binary_file
+    assert changes['c.py'].lines == {}
+
+    patch = PatchSet(DIFF.split('\n'))
+    assert changes.line_index == Problems._build_line_index(patch)
+
+
+def test_parse_plain_unified_diff():
+    diff = """--- a/a.py
++++ b/a.py
+@@ -1,2 +1,2 @@
+-import os
++import sys
+ import re
+--- a/b.py
++++ b/b.py
+@@ -1 +1,2 @@
+ import re
++import json
+"""
+    changes = parse_diff(iter_lines([diff]))
+    assert [f.path for f in changes.modified_files] == ['a.py', 'b.py']
+    assert changes['a.py'].lines == {1: (True, None), 2: (False, 2)}
+    assert changes['b.py'].lines == {1: (False, 1), 2: (True, None)}
+
+
+def test_parse_diff_excluded_paths():
+    changes = parse_diff(iter_lines([DIFF]), exclude=lambda path: path == 'b.py')
+    assert [f.path for f in changes.modified_files] == []
+    assert changes['b.py'].is_excluded
+    assert changes['b.py'].lines == {}
+    assert [f.path for f in changes.added_files] == ['a.py']
+    assert changes['a.py'].lines
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import unittest.mock as mock
+
+from docker.errors import DockerException
+
+from badwolf.docker_client import FlaskDocker
+
+
+def test_docker_client_shared_and_version_negotiated_once(app):
+    docker = FlaskDocker(app)
+    docker.health_check_interval = 3600
+    with mock.patch('badwolf.docker_client.DockerClient') as client_cls:
+        client_cls.return_value.api.api_version = '1.40'
+        client = docker.client
+        assert docker.client is client
+        assert docker.client is client
+
+    # one probe client for version negotiation, one shared client
+    assert client_cls.call_count == 2
+    _, kwargs = client_cls.call_args
+    assert kwargs['version'] == '1.40'
+    assert kwargs['max_pool_size'] == docker.max_pool_size
+
+
+def test_docker_client_reconnect_when_unhealthy(app):
+    docker = FlaskDocker(app)
+    docker.version = '1.40'
+    docker.health_check_interval = 0
+    with mock.patch('badwolf.docker_client.DockerClient') as client_cls:
+        first = mock.Mock()
+        probe = mock.Mock()
+        probe.ping.side_effect = DockerException('connection refused')
+        second = mock.Mock()
+        client_cls.side_effect = [first, probe, second]
+        assert docker.client is first
+        assert docker.client is second
+        # In use by other threads
+        assert not first.close.called
+        _, kwargs = client_cls.call_args_list[1]
+        assert kwargs['timeout'] == docker.ping_timeout
+
+
+def test_docker_client_not_blocked_by_health_check(app):
+    docker = FlaskDocker(app)
+    docker.version = '1.40'
+    docker.health_check_interval = 0
+    with mock.patch('badwolf.docker_client.DockerClient') as client_cls:
+        client = docker.client
+        # Another thread is checking health
+        docker._checking = True
+        assert docker.client is client
+        assert client_cls.call_count == 1
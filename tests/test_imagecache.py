@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest.mock as mock
+
+from docker.errors import APIError
+
+from badwolf.imagecache import ImageCache, image_content_hash
+
+
+DOCKERFILE = """FROM python:3.6
+ARG A
+COPY requirements.txt \\
+     /tmp/
+COPY --from=builder /app /app
+RUN pip install -r /tmp/requirements.txt
+"""
+
+
+def test_image_content_hash(tmpdir):
+    context_path = str(tmpdir)
+    tmpdir.join('requirements.txt').write('requests\n')
+    tmpdir.join('app.py').write('print(1)\n')
+    content_hash = image_content_hash(context_path, DOCKERFILE, {'A': '1'})
+
+    # Files not copied into image don't matter
+    tmpdir.join('app.py').write('print(2)\n')
+    assert image_content_hash(context_path, DOCKERFILE, {'A': '1'}) == content_hash
+
+    # Build args not declared by ARG don't matter
+    assert image_content_hash(context_path, DOCKERFILE, {'A': '1', 'BADWOLF_COMMIT': 'abc'}) == content_hash
+    assert image_content_hash(context_path, DOCKERFILE, {'A': '2'}) != content_hash
+    tmpdir.join('requirements.txt').write('requests\nflask\n')
+    assert image_content_hash(context_path, DOCKERFILE, {'A': '1'}) != content_hash
+
+
+def test_image_cache_gc_least_recently_used(tmpdir):
+    def make_image(image_id, tag):
+        return mock.Mock(id=image_id, tags=[tag], attrs={'Size': 100})
+
+    def remove(tag):
+        if tag == 'a:2':
+            raise APIError('image is being used by running container')
+
+    client = mock.Mock()
+    client.df.return_value = {'Images': []}
+    client.images.list.return_value = [
+        make_image('1', 'a:1'),
+        make_image('2', 'a:2'),
+        make_image('3', 'a:3'),
+        make_image('4', 'a:4'),
+    ]
+    client.images.remove.side_effect = remove
+    cache = ImageCache(client, str(tmpdir), max_size=200)
+    for index, tag in enumerate(('a:1', 'a:2', 'a:3', 'a:4')):
+        cache.touch(tag)
+        os.utime(cache._marker_path(tag), (index, index))
+
+    assert cache.gc(keep='a:3') == ['a:1', 'a:4']
+    assert cache.last_used('a:1') == 0
+
+
+def test_image_cache_gc_counts_shared_layers_once(tmpdir):
+    client = mock.Mock()
+    client.df.return_value = {'Images': [
+        {'Id': str(index), 'Size': 1000, 'SharedSize': 900} for index in range(3)
+    ]}
+    client.images.list.return_value = [
+        mock.Mock(id=str(index), tags=['a:{}'.format(index)], attrs={'Size': 1000}) for index in range(3)
+    ]
+    cache = ImageCache(client, str(tmpdir), max_size=1200)
+    # 3 * 100 unique bytes + 900 shared bytes
+    assert cache.gc() == []
+
+    cache.max_size = 1100
+    assert cache.gc() == ['a:0']
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
+import time
+import subprocess
 import unittest.mock as mock
 
 import pytest
@@ -8,7 +10,12 @@ from unidiff import PatchSet
 from badwolf.spec import Specification
 from badwolf.context import Context
 from badwolf.lint.processor import LintProcessor
-from badwolf.utils import ObjectDict
+from badwolf.lint import Problem, Problems
+from badwolf.lint.linters import Linter
+from badwolf.lint.utils import split_argv
+from badwolf.lint.cache import LintCache, blob_hash
+from badwolf.utils import ObjectDict, run_command
+from badwolf.bitbucket import BitbucketAPIError
 
 
 CURR_PATH = os.path.abspath(os.path.dirname(__file__))
@@ -204,7 +211,7 @@ index 0000000..266e19f
 """
 
     spec = Specification()
-    spec.linters.append(ObjectDict(name='jsonlint', pattern=None))
+    spec.linters.append(ObjectDict(name='jsonlint', pattern=None, builtin=True))
     lint = LintProcessor(pr_context, spec, os.path.join(FIXTURES_PATH, 'jsonlint'))
     patch = PatchSet(diff.split('\n'))
     with mock.patch.object(lint, 'load_changes') as load_changes,\
@@ -237,7 +244,7 @@ index 6ebebfe..6be8d74 100644
 """
 
     spec = Specification()
-    spec.linters.append(ObjectDict(name='jsonlint', pattern=None))
+    spec.linters.append(ObjectDict(name='jsonlint', pattern=None, builtin=True))
     lint = LintProcessor(pr_context, spec, os.path.join(FIXTURES_PATH, 'jsonlint'))
     patch = PatchSet(diff.split('\n'))
     with mock.patch.object(lint, 'load_changes') as load_changes,\
@@ -271,7 +278,7 @@ index 9b90002..c36a2a4 100644
 """
 
     spec = Specification()
-    spec.linters.append(ObjectDict(name='jsonlint', pattern=None))
+    spec.linters.append(ObjectDict(name='jsonlint', pattern=None, builtin=True))
     lint = LintProcessor(pr_context, spec, os.path.join(FIXTURES_PATH, 'jsonlint'))
     patch = PatchSet(diff.split('\n'))
     with mock.patch.object(lint, 'load_changes') as load_changes,\
@@ -288,6 +295,33 @@ index 9b90002..c36a2a4 100644
     assert len(lint.problems) == 0
 
 
+def test_jsonlint_not_usable_without_builtin(tmpdir):
+    from badwolf.lint.linters.jsonlint import JSONLinter
+
+    with mock.patch('badwolf.lint.linters.jsonlint.in_path', return_value=False):
+        assert not JSONLinter(str(tmpdir), Problems()).is_usable()
+        assert JSONLinter(str(tmpdir), Problems(), options={'builtin': True}).is_usable()
+
+
+def test_jsonlint_in_process_error_lines(tmpdir):
+    from badwolf.lint.linters.jsonlint import JSONLinter
+
+    tmpdir.join('a.json').write('{\n    "a": 1\n\n    "b": 2\n}\n')
+    tmpdir.join('b.json').write('{"a": NaN}')
+    tmpdir.join('c.json').write('[1, 2]')
+    linter = JSONLinter(str(tmpdir), Problems())
+
+    problems = list(linter._lint_file_in_process('a.json'))
+    assert len(problems) == 1
+    # Reported at the end of the last valid token like jsonlint, not the next token
+    assert problems[0].line == 2
+    assert 'line 4' in problems[0].message
+
+    problems = list(linter._lint_file_in_process('b.json'))
+    assert [(p.line, p.message) for p in problems] == [(1, 'Invalid JSON constant NaN')]
+    assert list(linter._lint_file_in_process('c.json')) == []
+
+
 def test_shellcheck_a_sh(app, pr_context):
     diff = """diff --git a/a.sh b/a.sh
 new file mode 100644
@@ -723,3 +757,355 @@ index 0000000..cd19857
     problem = lint.problems[0]
     assert problem.line == 3
     assert problem.filename == 'Dockerfile'
+
+
+def test_hadolint_lints_files_in_one_batch():
+    from badwolf.lint.linters.hadolint import HadoLinter
+
+    output = [
+        'Dockerfile:3 DL3008 Pin versions in apt get install',
+        'docker/Dockerfile.dev:1 DL3006 Always tag the version of an image explicitly',
+        'docker/Dockerfile.dev DL4000 MAINTAINER is deprecated',
+    ]
+    linter = HadoLinter('/tmp', Problems(), jobs=4)
+    with mock.patch('badwolf.lint.linters.run_command', return_value=(1, output)) as run:
+        linter.execute(['Dockerfile', 'docker/Dockerfile.dev'])
+
+    run.assert_called_once()
+    assert run.call_args[0][0] == ['hadolint', 'Dockerfile', 'docker/Dockerfile.dev']
+    assert [(p.filename, p.line) for p in linter.problems] == [
+        ('Dockerfile', 3),
+        ('docker/Dockerfile.dev', 1),
+        ('docker/Dockerfile.dev', 1),
+    ]
+
+
+class SleepLinter(Linter):
+    name = 'sleep'
+
+    def lint_files(self, files):
+        run_command(['sleep', '10'], timeout=self.timeout)
+        return iter(())
+
+
+def test_linters_run_concurrently_with_timeout(app, pr_context):
+    diff = """diff --git a/a.py b/a.py
+new file mode 100644
+index 0000000..fdeea15
+--- /dev/null
++++ b/a.py
+@@ -0,0 +1,6 @@
++# -*- coding: utf-8 -*-
++from __future__ import absolute_import, unicode_literals
++
++
++def add(a, b):
++    return a+ b
+"""
+
+    spec = Specification()
+    spec.linters.append(ObjectDict(name='sleep', pattern=None, timeout=1))
+    spec.linters.append(ObjectDict(name='flake8', pattern=None))
+    lint = LintProcessor(pr_context, spec, os.path.join(FIXTURES_PATH, 'flake8'))
+    patch = PatchSet(diff.split('\n'))
+    with mock.patch.dict(LintProcessor.LINTERS, sleep=SleepLinter),\
+            mock.patch.object(lint, 'load_changes') as load_changes,\
+            mock.patch.object(lint, 'update_build_status') as build_status,\
+            mock.patch.object(lint, '_report') as report:
+        load_changes.return_value = patch
+        build_status.return_value = None
+        report.return_value = (1, 2)
+        lint.problems.set_changes(patch)
+        start_time = time.time()
+        lint.process()
+        elapsed = time.time() - start_time
+
+    # Timed out linter is killed and doesn't block the others
+    assert elapsed < 10
+    assert len(lint.problems) == 1
+    problem = lint.problems[0]
+    assert problem.filename == 'a.py'
+    assert problem.line == 6
+
+
+class FileLinter(Linter):
+    name = 'file'
+    shardable = True
+
+    def lint_files(self, files):
+        for filename in files:
+            yield Problem(filename, 1, 'error', self.name)
+
+
+def test_shardable_linter_merges_shards_in_order():
+    files = ['{}.py'.format(i) for i in range(100)]
+    linter = FileLinter('/tmp', Problems(), jobs=4)
+    assert len(linter.split_files(files)) == 4
+
+    linter.execute(files)
+    assert [problem.filename for problem in linter.problems] == files
+    assert linter.problems[-1].filename == '99.py'
+
+
+def test_linter_not_shardable():
+    files = ['{}.py'.format(i) for i in range(100)]
+    linter = Linter('/tmp', Problems(), jobs=4)
+    assert linter.split_files(files) == [files]
+
+
+class BatchSleepLinter(Linter):
+    name = 'batch-sleep'
+
+    def split_files(self, files):
+        return [[filename] for filename in files]
+
+    def lint_files(self, files):
+        self.run_command(['sleep', '1'])
+        return iter(())
+
+
+def test_linter_timeout_covers_all_batches():
+    linter = BatchSleepLinter('/tmp', Problems(), timeout=1.5)
+    start_time = time.time()
+    with pytest.raises(subprocess.TimeoutExpired):
+        linter.execute(['a.py', 'b.py', 'c.py'])
+    assert time.time() - start_time < 2.5
+
+
+def test_split_argv():
+    assert split_argv(['a.py', 'b.py', 'c.py'], max_size=30) == [['a.py', 'b.py'], ['c.py']]
+    assert split_argv(['a' * 100], max_size=30) == [['a' * 100]]
+    assert split_argv([]) == []
+
+
+class CountingLinter(FileLinter):
+    cacheable = True
+    config_files = ('.filelintrc',)
+
+    def __init__(self, *args, **kwargs):
+        super(CountingLinter, self).__init__(*args, **kwargs)
+        self.linted = []
+
+    def get_version(self):
+        return '1.0'
+
+    def lint_files(self, files):
+        self.linted.extend(files)
+        return super(CountingLinter, self).lint_files(files)
+
+
+def test_lint_cache_replays_unchanged_files(tmpdir):
+    working_dir = tmpdir.mkdir('repo')
+    working_dir.join('a.py').write('a = 1\n')
+    working_dir.join('b.py').write('b = 1\n')
+    cache = LintCache(str(tmpdir.join('cache')))
+
+    linter = CountingLinter(str(working_dir), Problems(), cache=cache)
+    linter.execute(['a.py', 'b.py'])
+    assert linter.linted == ['a.py', 'b.py']
+
+    working_dir.join('b.py').write('b = 2\n')
+    linter = CountingLinter(str(working_dir), Problems(), cache=cache)
+    linter.execute(['a.py', 'b.py'])
+    assert linter.linted == ['b.py']
+    assert sorted(problem.filename for problem in linter.problems) == ['a.py', 'b.py']
+
+    # Configuration changes invalidate all cached results
+    working_dir.join('.filelintrc').write('strict = true\n')
+    linter = CountingLinter(str(working_dir), Problems(), cache=cache)
+    linter.execute(['a.py', 'b.py'])
+    assert linter.linted == ['a.py', 'b.py']
+
+
+def test_lint_cache_evict(tmpdir):
+    cache = LintCache(str(tmpdir), max_size=100)
+    keys = [LintCache.make_key('file', i) for i in range(10)]
+    for key in keys:
+        cache.set(key, [[1, 'x' * 20, True]])
+    assert cache.evict() > 0
+    assert cache.get(keys[-1]) == [[1, 'x' * 20, True]]
+    assert cache.get(keys[0]) is None
+
+
+def test_blob_hash(tmpdir):
+    path = tmpdir.join('a.txt')
+    path.write('hello\n')
+    # git hash-object a.txt
+    assert blob_hash(str(path)) == 'ce013625030ba8dba906f756967f9e9ca394464a'
+
+
+def test_problems_limit_to_changes():
+    diff = """diff --git a/a.py b/a.py
+index 0000000..fdeea15 100644
+--- a/a.py
++++ b/a.py
+@@ -1,4 +1,5 @@
+ import os
+-import sys
++import re
++import json
+ 
+ 
+@@ -20,2 +21,3 @@
+ def add(a, b):
++    a = a+ b
+     return a
+"""
+    problems = Problems()
+    added = Problem('a.py', 3, 'unused import', 'flake8')
+    context = Problem('a.py', 23, 'return', 'flake8')
+    near = Problem('a.py', 6, 'blank line', 'flake8')
+    other = Problem('b.py', 2, 'unused import', 'flake8')
+    for problem in (added, context, near, other):
+        problems.add(problem)
+    problems.set_changes(PatchSet(diff.split('\n')))
+    problems.limit_to_changes()
+
+    assert list(problems) == [added, context]
+    assert added.has_line_change
+    assert added.line == 3
+    assert not context.has_line_change
+    assert context.line == 21
+
+
+def test_report_counts_throttled_comments(app, pr_context):
+    spec = Specification()
+    lint = LintProcessor(pr_context, spec, '/tmp')
+    lint.problems.add(Problem('a.py', 1, 'unused import', 'flake8', has_line_change=True))
+    lint.problems.add(Problem('a.py', 2, 'line too long', 'flake8', has_line_change=True))
+    outdated = {
+        'id': 100,
+        'inline': {'path': 'b.py', 'to': 3, 'from': None},
+        'content': {'raw': ':broken_heart: **flake8**: fixed'},
+    }
+    calls = []
+
+    def comment(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            # Retried by Bitbucket client
+            kwargs['on_throttled'](0)
+        elif len(calls) == 2:
+            raise BitbucketAPIError(429, 'Rate limit', '')
+
+    with mock.patch.object(lint.pr, 'all_comments') as all_comments,\
+            mock.patch.object(lint.pr, 'comment', side_effect=comment),\
+            mock.patch.object(lint.pr, 'delete_comment') as delete_comment:
+        all_comments.return_value = [outdated]
+        assert lint._report() == (1, 1)
+
+    # Never retried again here
+    assert len(calls) == 2
+    assert delete_comment.call_args[0] == (1, 100)
+    assert lint.throttled == 1
+
+
+def test_load_changes_from_local_clone(app, tmpdir):
+    repo = str(tmpdir)
+
+    def git(*args):
+        exit_code, output = run_command(['git', '-C', repo] + list(args), include_errors=True)
+        assert exit_code == 0, output
+        return output.strip()
+
+    git('init', '-q')
+    git('config', 'user.email', 'badwolf@example.com')
+    git('config', 'user.name', 'badwolf')
+    tmpdir.join('a.py').write('import os\nimport sys\n')
+    git('add', 'a.py')
+    git('commit', '-q', '-m', 'init')
+    git('update-ref', 'refs/remotes/origin/master', 'HEAD')
+    tmpdir.join('a.py').write('import os\nimport re\nimport sys\n')
+    tmpdir.join('b.py').write('x = 1\n')
+    git('add', 'a.py', 'b.py')
+    git('commit', '-q', '-m', 'change')
+    context = Context(
+        'deepanalyzer/badwolf',
+        None,
+        'pullrequest',
+        'message',
+        {
+            'repository': {'full_name': 'deepanalyzer/badwolf'},
+            'branch': {'name': 'feature'},
+            'commit': {'hash': git('rev-parse', 'HEAD')}
+        },
+        {'branch': {'name': 'master'}, 'commit': {'hash': '111111'}},
+        pr_id=1
+    )
+
+    lint = LintProcessor(context, Specification(), repo)
+    with mock.patch.object(lint.pr, 'diff') as diff:
+        changes = lint.load_changes()
+        diff.assert_not_called()
+    assert [f.path for f in changes.added_files] == ['b.py']
+    assert changes['a.py'].lines == {1: (False, 1), 2: (True, None), 3: (False, 2)}
+
+    # Fallback to API when diff can not be computed locally
+    context.target['branch']['name'] = 'missing'
+    with mock.patch.object(lint.pr, 'diff') as diff:
+        diff.return_value = changes
+        assert lint.load_changes() is changes
+        assert diff.called
+
+
+def test_load_changes_excludes_unlinted_paths(app, pr_context):
+    spec = Specification()
+    lint = LintProcessor(pr_context, spec, '/tmp')
+    assert lint._build_exclude() is None
+
+    spec.linters.append(ObjectDict(name='flake8', pattern=None))
+    spec.linters.append(ObjectDict(name='jsonlint', pattern='*.mapping'))
+    exclude = lint._build_exclude()
+    assert not exclude('a.py')
+    assert not exclude('b.mapping')
+    assert exclude('vendor/lib.js')
+
+
+def test_lint_cache_skips_failed_runs(tmpdir):
+    working_dir = tmpdir.mkdir('repo')
+    working_dir.join('a.py').write('a = 1\n')
+    cache = LintCache(str(tmpdir.join('cache')))
+
+    class CrashingLinter(CountingLinter):
+        def lint_files(self, files):
+            self.linted.extend(files)
+            # Crashed without any output
+            self.run_command(['sh', '-c', 'exit 1'])
+            return []
+
+    for _ in range(2):
+        linter = CrashingLinter(str(working_dir), Problems(), cache=cache)
+        linter.execute(['a.py'])
+        assert linter.linted == ['a.py']
+
+
+def test_lint_cache_keyed_by_path(tmpdir):
+    working_dir = tmpdir.mkdir('repo')
+    working_dir.join('a.py').write('a = 1\n')
+    working_dir.join('b.py').write('a = 1\n')
+    cache = LintCache(str(tmpdir.join('cache')))
+
+    linter = CountingLinter(str(working_dir), Problems(), cache=cache)
+    linter.execute(['a.py'])
+    linter = CountingLinter(str(working_dir), Problems(), cache=cache)
+    linter.execute(['b.py'])
+    assert linter.linted == ['b.py']
+
+
+class NestedConfigLinter(CountingLinter):
+    nested_config = True
+
+
+def test_lint_cache_keyed_by_nested_config(tmpdir):
+    working_dir = tmpdir.mkdir('repo')
+    working_dir.mkdir('web').mkdir('js').join('a.py').write('a = 1\n')
+    working_dir.join('b.py').write('a = 1\n')
+    cache = LintCache(str(tmpdir.join('cache')))
+    files = ['web/js/a.py', 'b.py']
+
+    NestedConfigLinter(str(working_dir), Problems(), cache=cache).execute(files)
+    working_dir.join('web').join('.filelintrc').write('strict\n')
+    linter = NestedConfigLinter(str(working_dir), Problems(), cache=cache)
+    linter.execute(files)
+    # Only files under the changed config are linted again
+    assert linter.linted == ['web/js/a.py']
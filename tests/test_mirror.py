@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest.mock as mock
+
+import git
+import pytest
+
+from badwolf.mirror import RepositoryMirror, evict_mirrors, list_mirrors
+
+
+@pytest.fixture(scope='function')
+def upstream(tmpdir):
+    path = str(tmpdir.join('upstream'))
+    repo = git.Repo.init(path)
+    with repo.config_writer() as config:
+        config.set_value('user', 'name', 'badwolf')
+        config.set_value('user', 'email', 'badwolf@example.com')
+    with open(os.path.join(path, 'README'), 'w') as f:
+        f.write('badwolf\n')
+    repo.index.add(['README'])
+    repo.index.commit('Initial commit')
+    return repo
+
+
+def test_mirror_sync_and_clone(app, tmpdir, upstream):
+    mirror_dir = str(tmpdir.join('mirrors'))
+    mirror = RepositoryMirror(mirror_dir, 'deepanalyzer/badwolf')
+    with mock.patch('badwolf.mirror.bitbucket') as bitbucket:
+        bitbucket.get_git_url.return_value = upstream.working_dir
+        with mirror.lock():
+            mirror.sync()
+        assert mirror.exists()
+
+        with open(os.path.join(upstream.working_dir, 'README'), 'a') as f:
+            f.write('updated\n')
+        upstream.index.add(['README'])
+        commit = upstream.index.commit('Update')
+        with mirror.lock():
+            mirror.sync()
+
+    clone_path = str(tmpdir.join('clone'))
+    mirror.clone_to(clone_path, branch=upstream.active_branch.name)
+    assert git.Repo(clone_path).head.commit.hexsha == commit.hexsha
+    assert not mirror.is_corrupted()
+
+
+def test_evict_mirrors_lru(app, tmpdir, upstream):
+    mirror_dir = str(tmpdir.join('mirrors'))
+    with mock.patch('badwolf.mirror.bitbucket') as bitbucket:
+        bitbucket.get_git_url.return_value = upstream.working_dir
+        for index, name in enumerate(('deepanalyzer/a', 'deepanalyzer/b', 'deepanalyzer/c')):
+            mirror = RepositoryMirror(mirror_dir, name)
+            mirror.sync()
+            os.utime(mirror.path, (index, index))
+
+    assert len(list_mirrors(mirror_dir)) == 3
+    size = RepositoryMirror(mirror_dir, 'deepanalyzer/a').disk_usage()
+    removed = evict_mirrors(mirror_dir, size * 2, keep='deepanalyzer/a')
+    assert removed == ['deepanalyzer/b']
+    assert sorted(m.full_name for m in list_mirrors(mirror_dir)) == ['deepanalyzer/a', 'deepanalyzer/c']
+
+
+def test_mirror_can_merge(app, tmpdir, upstream):
+    base = upstream.head.commit
+
+    def commit_readme(content):
+        upstream.head.reference = base
+        upstream.head.reset(index=True, working_tree=True)
+        with open(os.path.join(upstream.working_dir, 'README'), 'w') as f:
+            f.write(content)
+        upstream.index.add(['README'])
+        return upstream.index.commit(content).hexsha
+
+    ours = commit_readme('ours\n')
+    theirs = commit_readme('theirs\n')
+    upstream.head.reference = base
+    upstream.head.reset(index=True, working_tree=True)
+    with open(os.path.join(upstream.working_dir, 'LICENSE'), 'w') as f:
+        f.write('MIT\n')
+    upstream.index.add(['LICENSE'])
+    other = upstream.index.commit('License').hexsha
+    upstream.create_head('ours', ours)
+    upstream.create_head('theirs', theirs)
+    upstream.create_head('other', other)
+
+    mirror = RepositoryMirror(str(tmpdir.join('mirrors')), 'deepanalyzer/badwolf')
+    with mock.patch('badwolf.mirror.bitbucket') as bitbucket:
+        bitbucket.get_git_url.return_value = upstream.working_dir
+        mirror.sync()
+
+    assert mirror.can_merge(ours, other)
+    assert not mirror.can_merge(ours, theirs)
+    with pytest.raises(git.GitCommandError):
+        mirror.can_merge(ours, '0' * 40)
+
+
+def test_merge_tree_supported():
+    from badwolf.mirror import merge_tree_supported
+
+    merge_tree_supported.cache_clear()
+    try:
+        with mock.patch('badwolf.mirror.git.Git') as git_cls:
+            git_cls.return_value.version_info = (2, 7, 4)
+            assert not merge_tree_supported()
+        merge_tree_supported.cache_clear()
+        with mock.patch('badwolf.mirror.git.Git') as git_cls:
+            git_cls.return_value.version_info = (2, 38, 0)
+            assert merge_tree_supported()
+    finally:
+        merge_tree_supported.cache_clear()
+
+
+def test_is_mergeable_waits_before_api_fallback(app):
+    from badwolf.context import Context
+    from badwolf.tasks import is_mergeable
+
+    context = Context(
+        'deepanalyzer/badwolf',
+        None,
+        'commit',
+        'Merge',
+        {
+            'repository': {'full_name': 'deepanalyzer/badwolf'},
+            'branch': {'name': 'master'},
+            'commit': {'hash': '2cedc1af762'},
+        }
+    )
+    pr_info = {
+        'id': 1,
+        'source': {'repository': {'full_name': 'fork/badwolf'}, 'commit': {'hash': '1ad4baf'}},
+    }
+    pr_api = mock.Mock()
+    pr_api.diff.return_value = '+<<<<<<< destination:2cedc1af762'
+    mirror = mock.Mock()
+    with mock.patch('badwolf.tasks.time') as time:
+        time.time.return_value = 100
+        assert not is_mergeable(context, pr_api, pr_info, mirror, api_ready_at=103)
+    time.sleep.assert_called_once_with(3)
+    # Pull request from fork can't be checked in mirror
+    assert not mirror.can_merge.called
@@ -7,6 +7,7 @@ import pytest
 from badwolf.context import Context
 from badwolf.bitbucket import PullRequest, Changesets
 from badwolf.pipeline import Pipeline
+from badwolf.cloner import RepositoryCloner
 
 
 @pytest.fixture(scope='function')
@@ -42,3 +43,19 @@ def test_clone_repo_failed(app, pipeline):
         pipeline.start()
         assert report_git_error.called
         mock_spec.assert_not_called()
+
+
+def test_clone_removes_leftover_clone(app, push_context, tmpdir):
+    push_context.clone_path = str(tmpdir.join('clone'))
+    tmpdir.mkdir('clone').join('half-written').write('')
+    cloner = RepositoryCloner(push_context)
+
+    def clone_from_remote():
+        assert not tmpdir.join('clone').exists()
+        raise git.GitCommandError('git clone', 1)
+
+    with app.app_context(), \
+            mock.patch.dict(app.config, BADWOLF_MIRROR_ENABLED=False), \
+            mock.patch.object(cloner, '_clone_from_remote', side_effect=clone_from_remote):
+        with pytest.raises(git.GitCommandError):
+            cloner.clone()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import time
+from email.utils import formatdate
+
+from badwolf.ratelimit import TokenBucket, get_token_bucket, parse_retry_after
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=5)
+    start = time.monotonic()
+    for _ in range(10):
+        bucket.acquire()
+    # 5 tokens in burst, 5 more refilled at 50/s
+    assert time.monotonic() - start >= 0.08
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=0)
+    bucket.pause(0.1)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_get_token_bucket_per_account():
+    assert get_token_bucket('a', 5, 10) is get_token_bucket('a', 5, 10)
+    assert get_token_bucket('a', 5, 10) is not get_token_bucket('b', 5, 10)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after(None, default=3) == 3
+    assert parse_retry_after('invalid', default=3) == 3
+    assert 50 < parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import Future
+
+import pytest
+
+from badwolf.context import Context
+from badwolf.exceptions import PipelineCancelled
+from badwolf.registry import PipelineRegistry
+
+
+def _pr_context(commit, pr_id=1):
+    return Context(
+        'deepanalyzer/badwolf',
+        {},
+        'pullrequest',
+        'message',
+        {
+            'repository': {'full_name': 'deepanalyzer/badwolf'},
+            'branch': {'name': 'feature'},
+            'commit': {'hash': commit},
+        },
+        {'branch': {'name': 'master'}},
+        pr_id=pr_id,
+    )
+
+
+def test_supersede_queued_pipeline(app):
+    registry = PipelineRegistry()
+    old_context = _pr_context('000000')
+    old_future = Future()
+    registry.register(old_context, old_future)
+    other_future = Future()
+    registry.register(_pr_context('111111', pr_id=2), other_future)
+
+    new_context = _pr_context('222222')
+    registry.register(new_context, Future())
+    cancelled = registry.supersede(new_context)
+    assert [handle.commit for handle in cancelled] == ['000000']
+    assert old_future.cancelled()
+    assert not other_future.cancelled()
+    # Cancelled queued pipeline is unregistered
+    assert registry.get(old_context.task_id) is None
+
+
+def test_supersede_running_pipeline(app):
+    registry = PipelineRegistry()
+    old_context = _pr_context('000000')
+    old_future = Future()
+    old_future.set_running_or_notify_cancel()
+    registry.register(old_context, old_future)
+    registry.check(old_context.task_id)
+
+    registry.supersede(_pr_context('222222'))
+    assert registry.is_cancelled(old_context.task_id)
+    with pytest.raises(PipelineCancelled):
+        registry.check(old_context.task_id)
+
+    old_future.set_result(None)
+    assert registry.get(old_context.task_id) is None
+
+
+def test_never_supersede_tag_pipeline(app):
+    context = Context(
+        'deepanalyzer/badwolf',
+        {},
+        'tag',
+        'message',
+        {
+            'repository': {'full_name': 'deepanalyzer/badwolf'},
+            'branch': {'name': 'v0.1.0'},
+            'commit': {'hash': '000000'},
+        },
+    )
+    registry = PipelineRegistry()
+    future = Future()
+    registry.register(context, future)
+    assert registry.supersede(context) == []
+    assert not future.cancelled()
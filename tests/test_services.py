@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import unittest.mock as mock
+
+from badwolf.services import ServicePool
+from badwolf.utils import ObjectDict
+
+
+def make_container(container_id):
+    return mock.Mock(id=container_id, short_id=container_id, status='running', attrs={'State': {}})
+
+
+def test_service_pool_reuses_warm_containers():
+    containers = {}
+
+    def run(image, **kwargs):
+        container = make_container('c{}'.format(len(containers) + 1))
+        containers[container.id] = container
+        return container
+
+    client = mock.Mock()
+    client.containers.run.side_effect = run
+    client.containers.get.side_effect = lambda container_id: containers[container_id]
+    client.containers.list.return_value = []
+    pool = ServicePool(mock.Mock(client=client))
+    service = ObjectDict(name='redis', image='redis:4', env={})
+
+    network, started = pool.start('badwolf-1', [service])
+    assert [c.id for c in started] == ['c1']
+    assert client.containers.run.call_args[1]['network_mode'] == 'none'
+    client.networks.get.return_value.disconnect.assert_called_once_with(started[0])
+    network.connect.assert_called_once_with(started[0], aliases=['redis'])
+
+    # Pool is refilled in background
+    deadline = time.time() + 5
+    while not pool._pools[pool.service_key(service)] and time.time() < deadline:
+        time.sleep(0.01)
+    pool.stop(network, started)
+    started[0].remove.assert_called_once_with(force=True, v=True)
+    network.remove.assert_called_once_with()
+
+    _, started = pool.start('badwolf-2', [service])
+    assert [c.id for c in started] == ['c2']
+
+
+def test_service_pool_cleanup_own_stale_containers():
+    def make_stale(container_id, pid):
+        container = make_container(container_id)
+        container.labels = {'badwolf.pid': str(pid)}
+        return container
+
+    dead = make_stale('dead', 2 ** 22 + 1)
+    alive = make_stale('alive', os.getppid())
+    reused = make_stale('reused', os.getpid())
+    client = mock.Mock()
+    client.containers.list.return_value = [dead, alive, reused]
+    pool = ServicePool(mock.Mock(client=client))
+    pool.instance_id = 'ci-1'
+
+    pool._cleanup_stale(client)
+    client.containers.list.assert_called_once_with(
+        all=True,
+        filters={'label': ['badwolf.service', 'badwolf.instance=ci-1']},
+    )
+    dead.remove.assert_called_once_with(force=True, v=True)
+    reused.remove.assert_called_once_with(force=True, v=True)
+    alive.remove.assert_not_called()
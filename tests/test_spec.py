@@ -5,7 +5,7 @@ import pytest
 from marshmallow import Schema, fields
 
 from badwolf.spec import Specification
-from badwolf.spec import SecureField, ListField
+from badwolf.spec import SecureField, SecureString, ListField
 from badwolf.security import SecureToken
 from badwolf.utils import to_text
 from badwolf.exceptions import InvalidSpecification
@@ -221,6 +221,7 @@ def test_parse_secure_env(app):
     assert env0['X'] == '1'
     assert env0['Y'] == '2'
     assert env0['Z'] == '3'
+    assert isinstance(env0['X'], SecureString)
 
 
 def test_parse_env_multi_list(app):
@@ -606,3 +607,60 @@ API_KEY secret/API:key
     assert env == ('secret/API', 'token')
     env = spec.vault.env['API_KEY']
     assert env == ('secret/API', 'key')
+
+
+def test_parse_parallel(app):
+    s = """parallel: 4"""
+    f = io.StringIO(s)
+    spec = Specification.parse_file(f)
+    assert spec.parallel == 4
+
+    s = """linter: flake8"""
+    f = io.StringIO(s)
+    spec = Specification.parse_file(f)
+    assert spec.parallel == 1
+
+    s = """parallel: 0"""
+    f = io.StringIO(s)
+    with pytest.raises(InvalidSpecification):
+        Specification.parse_file(f)
+
+
+def test_parse_sidecar_services(app):
+    s = """service:
+  - redis-server
+  - name: postgres
+    image: postgres:9.6
+    env: POSTGRES_PASSWORD=badwolf POSTGRES_DB=test
+"""
+    f = io.StringIO(s)
+    spec = Specification.parse_file(f)
+    assert spec.services == ['redis-server']
+    assert len(spec.sidecars) == 1
+    sidecar = spec.sidecars[0]
+    assert sidecar.name == 'postgres'
+    assert sidecar.image == 'postgres:9.6'
+    assert sidecar.env == {'POSTGRES_PASSWORD': 'badwolf', 'POSTGRES_DB': 'test'}
+    assert 'service postgres start' not in spec.shell_script
+
+    s = """service:
+  - name: postgres
+"""
+    f = io.StringIO(s)
+    with pytest.raises(InvalidSpecification):
+        Specification.parse_file(f)
+
+
+def test_parse_cache(app):
+    s = """cache:
+  - ~/.cache/pip
+  - node_modules
+"""
+    f = io.StringIO(s)
+    spec = Specification.parse_file(f)
+    assert spec.cache == ['~/.cache/pip', 'node_modules']
+
+    for path in ('/etc', '../outside'):
+        f = io.StringIO('cache: {}'.format(path))
+        with pytest.raises(InvalidSpecification):
+            Specification.parse_file(f)
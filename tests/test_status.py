@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest.mock as mock
+
+from badwolf.bitbucket import BuildStatus, BitbucketAPIError
+from badwolf.status import BuildStatusPublisher
+
+
+def make_build_status(revision='2cedc1af762'):
+    return BuildStatus(mock.Mock(), 'deepanalyzer/badwolf', revision, 'badwolf/test', 'http://localhost')
+
+
+def test_coalesce_intermediate_states():
+    publisher = BuildStatusPublisher()
+    publisher.max_workers = 1
+    build_status = make_build_status()
+    sent = []
+    sending = threading.Event()
+    release = threading.Event()
+
+    def update(state, description=None):
+        sent.append(state)
+        sending.set()
+        release.wait(5)
+
+    with mock.patch.object(build_status, 'update', side_effect=update):
+        publisher.publish(build_status, 'INPROGRESS', 'Test in progress')
+        assert sending.wait(5)
+        # Queued while the first update is being sent, only the latest one is sent
+        publisher.publish(build_status, 'INPROGRESS', 'Building Docker image')
+        publisher.publish(build_status, 'INPROGRESS', 'Running tests in Docker container')
+        publisher.publish(build_status, 'SUCCESSFUL', '1 of 1 test succeed')
+        release.set()
+        assert publisher.flush(build_status.revision, timeout=5)
+
+    assert sent == ['INPROGRESS', 'SUCCESSFUL']
+    assert publisher.coalesced == 2
+
+
+def test_retry_final_state():
+    publisher = BuildStatusPublisher()
+    publisher.retry_delay = 0
+    build_status = make_build_status('retry')
+    with mock.patch.object(build_status, 'update') as update:
+        update.side_effect = [BitbucketAPIError(503, '', ''), None]
+        publisher.publish(build_status, 'FAILED', '1 of 1 test failed')
+        assert publisher.flush('retry', timeout=5)
+
+    assert update.call_count == 2
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import pytest
+
+from badwolf.exceptions import QueueFull
+from badwolf.taskqueue import TaskQueue
+
+
+@pytest.fixture(scope='function')
+def task_queue(tmpdir):
+    q = TaskQueue()
+    q.max_workers = 1
+    q.max_size = 3
+    q.put_timeout = 0
+    q.open(str(tmpdir.join('queue.sqlite3')))
+    return q
+
+
+def test_task_queue_priority(task_queue):
+    results = []
+    done = threading.Event()
+
+    def record(value):
+        results.append(value)
+        if len(results) == 3:
+            done.set()
+
+    task_queue.register('record', record)
+    task_queue.put('record', ('pullrequest',), priority=0)
+    task_queue.put('record', ('tag',), priority=30)
+    task_queue.put('record', ('branch',), priority=20)
+    task_queue.start()
+    assert done.wait(5)
+    assert results == ['tag', 'branch', 'pullrequest']
+
+
+def test_task_queue_full(task_queue):
+    for _ in range(3):
+        task_queue.put('noop')
+    with pytest.raises(QueueFull):
+        task_queue.put('noop')
+
+
+def test_task_queue_cancel_frees_slot(task_queue):
+    futures = [task_queue.put('noop') for _ in range(3)]
+    assert futures[0].cancel()
+    assert task_queue.qsize() == 2
+    task_queue.put('noop')
+
+
+def test_task_queue_recover_interrupted_tasks(tmpdir, task_queue):
+    task_queue.put('echo', ('hello',))
+    # Simulate crash while task running
+    task_queue._conn.execute("UPDATE jobs SET state = 'running'")
+
+    results = []
+    done = threading.Event()
+
+    def echo(value):
+        results.append(value)
+        done.set()
+
+    queued = []
+    recovered = TaskQueue()
+    recovered.max_workers = 1
+    recovered.open(str(tmpdir.join('queue.sqlite3')))
+    recovered.register('echo', echo, on_queued=lambda future, value: queued.append((future, value)))
+    recovered.start()
+    assert done.wait(5)
+    assert results == ['hello']
+    # Recovered tasks are announced again, e.g. to be registered for cancellation
+    assert len(queued) == 1
+    assert queued[0][1] == 'hello'
+    assert queued[0][0].result(5) is None
+
+
+def test_task_queue_recover_only_tasks_of_exited_processes(tmpdir, task_queue):
+    task_queue.put('echo', ('alive',))
+    task_queue.put('echo', ('dead',))
+    task_queue._conn.execute("UPDATE jobs SET state = 'running', owner = ? WHERE id = 1", (os.getppid(),))
+    task_queue._conn.execute("UPDATE jobs SET state = 'running', owner = ? WHERE id = 2", (2 ** 22 + 1,))
+
+    recovered = TaskQueue()
+    recovered.max_workers = 1
+    recovered.open(str(tmpdir.join('queue.sqlite3')))
+    recovered.register('echo', lambda value: None)
+    recovered.start()
+    rows = recovered._conn.execute("SELECT id, state FROM jobs WHERE state = 'running' AND owner != ?",
+                                   (os.getpid(),)).fetchall()
+    # Task of the live process is left alone
+    assert rows == [(1, 'running')]
+
+
+def test_task_queue_on_queued_before_run(task_queue):
+    events = []
+    done = threading.Event()
+
+    def record(value):
+        events.append(('run', value))
+        done.set()
+
+    task_queue.register('record', record, on_queued=lambda future, value: events.append(('queued', value)))
+    task_queue.start()
+    future = task_queue.put('record', ('a',))
+    assert done.wait(5)
+    future.result(5)
+    assert events == [('queued', 'a'), ('run', 'a')]
+
+
+def test_task_queue_concurrency_limits_round_robin(task_queue):
+    task_queue.max_size = 10
+    task_queue.limits = {'repo': 2, 'pipeline': 3}
+    for repo in ('a', 'a', 'a', 'b', 'c'):
+        task_queue.put('noop', (repo,), resources={'repo': repo, 'pipeline': 'all'})
+
+    claimed = []
+    for _ in range(4):
+        job = task_queue._claim_next_job()
+        if job is None:
+            break
+        claimed.append(job[0])
+    # a, b, c started round-robin, then global limit reached
+    assert claimed == [1, 4, 5]
+
+    task_queue._discard(4)
+    # repo b finished, next queued task of repo a can run
+    job_id, _, _ = task_queue._claim_next_job()
+    assert job_id == 2
+    task_queue._discard(5)
+    # repo a reached its limit
+    assert task_queue._claim_next_job() is None
+
+
+def test_task_queue_positions_follow_schedule(task_queue):
+    task_queue.max_size = 10
+    task_queue.limits = {'repo': 1}
+    positions = {}
+    task_queue.register('noop', None, on_position=lambda future, position, repo: positions.update({repo: position}))
+    for repo in ('a1', 'a2', 'b1'):
+        task_queue.put('noop', (repo,), resources={'repo': repo[0]})
+    # b1 goes before a2 round-robin, the new first task is not reported
+    assert task_queue._schedule_order() == [1, 3, 2]
+    assert positions == {'a2': 2, 'b1': 1}
+
+    task_queue._claim_next_job()
+    assert positions == {'a2': 1, 'b1': 0}
+    task_queue._claim_next_job()
+    # a2 waits for a1 to finish
+    assert task_queue._claim_next_job() is None
+    assert positions['a2'] == 0
+
+
+def test_task_queue_claimed_once_across_processes(tmpdir, task_queue):
+    task_queue.put('noop')
+    other = TaskQueue()
+    other.open(str(tmpdir.join('queue.sqlite3')))
+
+    assert other._claim_next_job()[0] == 1
+    # Claimed by the other process sharing the database
+    assert task_queue._claim_next_job() is None